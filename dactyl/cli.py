@@ -23,6 +23,9 @@ class DactylCLIParser:
                             help="Print version information and exit.")
         parser.add_argument("--bypass_errors", "-b", action="store_true",
                             help="Continue if recoverable errors occur")
+        parser.add_argument("--html_parser", type=str, choices=HTML_PARSERS,
+                            help="Parse HTML with this parser instead of "+\
+                            "the html_parser from the config file.")
 
         if utility in (self.UTIL_BUILD, self.UTIL_STYLE):
             parser.add_argument("--target", "-t", type=str,
@@ -92,6 +95,52 @@ class DactylCLIParser:
             parser.add_argument("--watch", "-w", action="store_true", default=False,
                                 help="Watch for changes and re-generate output. "+\
                                 "This runs until force-quit.")
+            parser.add_argument("--jobs", "-j", type=int, default=None,
+                                help="Render pages using this many worker "+\
+                                "processes. Defaults to the number of CPUs "+\
+                                "where Python forks processes by default "+\
+                                "(such as Linux), or 1 elsewhere. "+\
+                                "Use 1 to build one page at a time. With "+\
+                                "--watch, this only applies to the first build.")
+            parser.add_argument("--max_inflight_pages", type=int, default=0,
+                                help="In parallel builds, parse at most "+\
+                                "this many pages before writing them, to "+\
+                                "limit memory use. Defaults to no limit.")
+            parser.add_argument("--incremental", "-i", action="store_true",
+                                help="Only rebuild pages whose sources, "+\
+                                "templates, filters, or settings changed since "+\
+                                "the last incremental build.", default=False)
+            parser.add_argument("--html_cache", action="store_true",
+                                help="Reuse pages' parsed and filtered HTML "+\
+                                "from previous builds when their inputs are "+\
+                                "unchanged.", default=False)
+            parser.add_argument("--highlight_cache", action="store_true",
+                                help="Reuse syntax-highlighted code blocks "+\
+                                "from previous builds.", default=False)
+            parser.add_argument("--fragment_cache", action="store_true",
+                                help="Reuse the HTML of templates' "+\
+                                "{%% cache %%} blocks from previous builds.",
+                                default=False)
+            parser.add_argument("--no_template_cache", action="store_true",
+                                help="Compile all templates from source "+\
+                                "instead of reusing compiled templates from "+\
+                                "previous builds.", default=False)
+            parser.add_argument("--clear_template_cache", action="store_true",
+                                help="Delete templates' compiled code cached "+\
+                                "by previous builds before building.",
+                                default=False)
+            parser.add_argument("--delete_stale", action="store_true",
+                                help="Delete files in the output folder "+\
+                                "that the build didn't produce.",
+                                default=False)
+            parser.add_argument("--staged", action="store_true",
+                                help="Build into a staging folder next to "+\
+                                "the output folder, then swap it into place "+\
+                                "if the build succeeds.", default=False)
+            parser.add_argument("--rollback", action="store_true",
+                                help="Swap the output folder with the "+\
+                                "previous staged build's output, then quit.",
+                                default=False)
             parser.add_argument("--http_port", type=int, default=DEFAULT_SERVER_PORT,
                                 help="Use this port for HTTP server (when "+\
                                 "building PDFs.) Use '0' for no server (may not "+\
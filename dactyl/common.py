@@ -4,6 +4,7 @@
 # Imports and utilities shared across multiple pieces of Dactyl
 ################################################################################
 
+import hashlib
 # The ElasticSearch templates need to write *actual* JSON and not YAML
 import json
 import logging
@@ -12,12 +13,19 @@ import re
 import time
 import traceback
 
+from collections.abc import Mapping
+
 from pkg_resources import resource_stream
 
+from bs4 import BeautifulSoup
+from bs4.builder import HTMLParserTreeBuilder
+
 import ruamel.yaml
 yaml = ruamel.yaml.YAML(typ="safe")
 
 import gettext
+from html import escape as html_escape, unescape as html_unescape
+from html.entities import html5 as html5_entities
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
@@ -52,6 +60,55 @@ HOVERANCHOR_FIELD = "hover_anchors"
 
 DEFAULT_SERVER_PORT = 32289 # "DACTY" in T-9
 
+# Sibling folders of out_path for staged builds
+STAGING_SUFFIX = ".dactyl_staging"
+PREVIOUS_SUFFIX = ".dactyl_previous"
+ROLLBACK_SUFFIX = ".dactyl_rollback"
+
+# Page fields that identify a page to other pages
+PAGE_ID_FIELDS = ["md", "html", "name", "targets"]
+
+# Settings that only change how Dactyl builds, caches, checks, and writes its
+# output, not the HTML it makes from a page's Markdown. Any other setting
+# might be an option for a filter.
+BUILD_SETTINGS = [
+    "out_path",
+    "template_static_path",
+    "temporary_files_path",
+    "pdf_filename_fields",
+    "pdf_filename_separator",
+    "es_index_fields",
+    "es_index_separator",
+    "prince_executable",
+    "legacy_prince",
+    "template_allow_undefined",
+    "html_cache",
+    "html_cache_size",
+    "highlight_cache",
+    "highlight_cache_size",
+    "fragment_cache",
+    "fragment_cache_size",
+    "template_cache",
+    "delete_stale_files",
+    "staged_output",
+    "watch_quiet_period",
+    "watch_ignore",
+    "known_broken_links",
+    "ignore_anchors_in",
+]
+
+# Page fields that building a page adds, which aren't part of its definition
+BUILT_PAGE_FIELDS = [
+    "children",
+    "is_ancestor_of",
+    "plaintext",
+    "headermap",
+]
+
+
+class BuildCancelled(Exception):
+    """Raised to stop a build that's no longer needed"""
+    pass
 
 def recoverable_error(msg, bypass_errors, error=None):
     """Logs a warning/error message and exits if bypass_errors==False"""
@@ -65,6 +122,10 @@ def recoverable_error(msg, bypass_errors, error=None):
 #  which is not preferable when making non-English filenames.
 unacceptable_chars = re.compile(r"[^A-Za-z0-9._ ]+")
 whitespace_regex = re.compile(r"\s+")
+# Used by DactylPage.idify() to make header IDs
+id_unsafe_chars = re.compile(r"[^\w\s-]")
+id_separators = re.compile(r"[\s-]+")
+
 def slugify(s):
     s = re.sub(unacceptable_chars, "", s)
     s = re.sub(whitespace_regex, "_", s)
@@ -98,6 +159,262 @@ def parse_frontmatter(text):
         logger.debug("...no front matter detected")
         return text, {}
 
+# Patterns for guess_title(). These follow how Python-Markdown parses headers.
+atx_header = re.compile(r"^(#{1,6})((?:\\.|[^\\])*?)#*$")
+setext_underline = re.compile(r"^[=-]+[ ]*$")
+html_header = re.compile(r"^<(h[1-6])(?:\s[^<>]*)?>(.*?)</\1>\s*$", re.I)
+md_special_chars = re.compile(r"[\\`*_\[\]<>&!]")
+md_code_span = re.compile(r"(?<!\\)(`+)(.+?)(?<!`)\1(?!`)")
+md_escape = re.compile(r"\\([\\`*_{}\[\]()>#+\-.!])")
+md_image = re.compile(r"!\[[^\[\]]*\]\([^()\s]*\)")
+md_link = re.compile(r"\[([^\[\]]*)\]\([^()\s]*\)")
+md_autolink = re.compile(r"<((?:https?|ftp)://[^<>\s]*)>")
+html_tag = re.compile(r"</?[A-Za-z][A-Za-z0-9-]*(?:\s[^<>]*)?/?>")
+html_entity = re.compile(r"&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);")
+# Emphasis is only simple when it starts and ends with a letter or number,
+# and isn't next to other * or _ markers
+md_strong = re.compile(
+        r"(?<![*_])\*\*([\w\x00](?:[^*_]*[\w\x01])?)\*\*(?![*_])")
+md_strong_underscore = re.compile(
+        r"(?<![\w*])__([\w\x00](?:[^*_]*[\w\x01])?)__(?![\w*])")
+md_em = re.compile(r"(?<![*_])\*([\w\x00](?:[^*_]*[\w\x01])?)\*(?![*_])")
+md_em_underscore = re.compile(
+        r"(?<![\w*])_([\w\x00](?:[^*_]*[\w\x01])?)_(?![\w*])")
+# Runs of mixed or many markers, like "**_", are parsed in ways that are
+# hard to predict, so only these runs are simple
+md_marker_run = re.compile(r"[*_]+")
+md_simple_markers = ("*", "**", "_", "__")
+md_unsure = re.compile(r"[*`\[\]<]|(?<!\w)_|_(?!\w)")
+def guess_title(lines):
+    """
+    Return the text of the first header in a page's first two lines of
+    Markdown, the same as converting them to HTML would give, without
+    running the whole Markdown converter. Returns None if there's no header,
+    or False if the lines have markup that needs the full converter to be
+    sure.
+    """
+    if any("\t" in line for line in lines):
+        return False
+    lines = [line.replace("\r", "") for line in lines]
+    for i, line in enumerate(lines):
+        m = html_header.match(line)
+        if m:
+            return markdown_text(m.group(2), html_only=True)
+        m = atx_header.match(line)
+        if m:
+            return markdown_text(m.group(2).strip())
+        if (i == 0 and len(lines) > 1 and line.strip() and
+                line[0] not in " <" and setext_underline.match(lines[1])):
+            return markdown_text(line.strip())
+        if line and not line[0].isalpha():
+            # Could be raw HTML, a code block, a list, a blockquote...
+            # which can contain headers or hide the next line's.
+            return False
+    return None
+
+def markdown_text(text, html_only=False):
+    """
+    Return the plain text of a line of inline Markdown, as it would be after
+    converting it to HTML, or False if it has markup that needs the full
+    converter. With html_only, treat the text as HTML instead of Markdown.
+    """
+    if html_only and "  " in text:
+        # Whitespace in raw HTML may or may not be collapsed
+        return False
+    if not md_special_chars.search(text):
+        return text
+    if "  " in text:
+        # Runs of spaces next to inline markup are collapsed
+        return False
+    # Text that's already converted goes here, replaced by placeholders
+    stash = []
+    def hide(s):
+        stash.append(s)
+        return "\x00%d\x01" % (len(stash) - 1)
+
+    def inline(text):
+        text = html_tag.sub("", text)
+        for entity in html_entity.findall(text):
+            if entity[1] != "#" and entity[1:] not in html5_entities:
+                # Unknown entities come out differently depending on the parser
+                stash.append(False)
+        text = html_entity.sub(lambda m: hide(html_unescape(m.group(0))), text)
+        if "&#" in text:
+            # Numeric references without semicolons are parser-dependent too
+            stash.append(False)
+        if html_only:
+            if "<" in text:
+                stash.append(False)
+            return text
+        if any(run not in md_simple_markers
+               for run in md_marker_run.findall(text)):
+            stash.append(False)
+        for pattern in (md_strong, md_strong_underscore, md_em,
+                        md_em_underscore):
+            text = pattern.sub(lambda m: m.group(1), text)
+        if md_unsure.search(re.sub(r"\x00\d+\x01", " ", text)):
+            stash.append(False)
+        return text
+
+    if not html_only:
+        text = md_code_span.sub(lambda m: hide(m.group(2).strip()), text)
+        text = md_escape.sub(lambda m: hide(m.group(1)), text)
+        text = md_image.sub(lambda m: hide(""), text)
+        text = md_link.sub(lambda m: hide(inline(m.group(1))), text)
+        text = md_autolink.sub(lambda m: hide(m.group(1)), text)
+    text = inline(text)
+    if False in stash:
+        return False
+    placeholder = re.compile(r"\x00(\d+)\x01")
+    while placeholder.search(text):
+        text = placeholder.sub(lambda m: stash[int(m.group(1))], text)
+    return text
+
+# Patterns for reading HTML fragments without parsing them into a tree.
+# Attribute values can contain ">", and some parts of HTML don't have text.
+html_attrs = r"""(?:\s(?:[^>"']|"[^"]*"|'[^']*')*)?"""
+html_no_text = r"<!--.*?-->|<(?:script|style)\b.*?</(?:script|style)\s*>|<[!?][^>]*>"
+html_tag_or_no_text = re.compile(r"(?P<skip>%s)|<(?P<close>/?)(?P<tag>[A-Za-z][^\s/>]*)%s/?>" %
+        (html_no_text, html_attrs), re.S|re.I)
+html_attr = re.compile(r"""([^\s"'>/=]+)(\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'>]+))?""")
+html_header_element = re.compile(r"(?P<skip>%s)|<(?P<tag>h[1-6])(?P<attrs>%s)>"
+        r"(?P<contents>.*?)(?P<close></(?P=tag)\s*>)" % (html_no_text, html_attrs),
+        re.S|re.I)
+html_paragraph = re.compile(r"(?P<skip>%s)|<p%s>(?P<contents>.*?)</p\s*>" %
+        (html_no_text, html_attrs), re.S|re.I)
+def html_text(html):
+    """
+    Return the text of an HTML fragment, the same as Beautiful Soup's
+    get_text() does, without parsing it into a tree. Like Beautiful Soup,
+    this collapses strings of only whitespace outside of <pre> elements.
+    """
+    strings = []
+    in_pre = 0
+    def add_string(text):
+        text = html_unescape(text)
+        if text and not in_pre and not text.strip(" \t\n\r\f"):
+            text = "\n" if "\n" in text else " "
+        strings.append(text)
+
+    pos = 0
+    for m in html_tag_or_no_text.finditer(html):
+        add_string(html[pos:m.start()])
+        pos = m.end()
+        if m.group("tag") and m.group("tag").lower() in ("pre", "textarea"):
+            in_pre = max(in_pre + (-1 if m.group("close") else 1), 0)
+    add_string(html[pos:])
+    return "".join(strings)
+
+# Patterns for writing HTML the way Beautiful Soup writes it after parsing it
+# with html.parser: lowercase names, sorted attributes in double quotes,
+# <br/> for empty elements, only &amp; &lt; and &gt; references in text, and
+# strings of only whitespace collapsed.
+soup_builder = HTMLParserTreeBuilder()
+soup_form_tag = re.compile(r"""<(?P<close>/?)(?P<tag>[a-z][a-z0-9-]*)"""
+        r"""(?P<attrs>(?: [a-z_:][a-z0-9_.:-]*="(?:[^"&<>\r]|&(?:amp|lt|gt);)*")*)"""
+        r"""(?P<empty> ?/?)>|<""")
+soup_form_attr = re.compile(r' ([^=]+)="([^"]*)"')
+soup_form_text = re.compile(r"(?:[^&<\r]|&(?![A-Za-z0-9#])|"
+        r"&(?P<ref>[A-Za-z][A-Za-z0-9]*|#[0-9]{1,7}|#[xX][0-9a-fA-F]{1,6});)*")
+soup_form_ref = re.compile(r"&([A-Za-z][A-Za-z0-9]*|#[0-9]+|#[xX][0-9a-fA-F]+);")
+soup_form_space = re.compile(r"[ \t\n\r\f]*")
+non_whitespace = re.compile(r"\S+")
+def soup_text(text, preserve_whitespace):
+    """
+    Return a string of text from HTML as Beautiful Soup writes it, or None
+    if it has character references that Beautiful Soup may read differently.
+    """
+    if not soup_form_text.fullmatch(text):
+        return None
+    if "&" in text:
+        for ref in soup_form_ref.findall(text):
+            if ref[0] != "#":
+                if ref + ";" not in html5_entities:
+                    return None
+                continue
+            n = int(ref[2:], 16) if ref[1] in "xX" else int(ref[1:])
+            if not (32 <= n < 127 or n in (9, 10, 12, 13) or
+                    160 <= n < 0xd800):
+                # Control characters and such
+                return None
+        text = html_unescape(text)
+    if text and not preserve_whitespace and soup_form_space.fullmatch(text):
+        return "\n" if "\n" in text else " "
+    return html_escape(text, quote=False)
+
+def soup_form(html):
+    """
+    Return an HTML fragment as Beautiful Soup would write it after parsing it
+    with html.parser, without parsing it into a tree; or None if it has
+    markup that might not come out the same way.
+    """
+    out = []
+    stack = []
+    pos = 0
+    for m in soup_form_tag.finditer(html):
+        text = soup_text(html[pos:m.start()],
+                         any(t in soup_builder.preserve_whitespace_tags
+                             for t in stack))
+        if text is None:
+            return None
+        out.append(text)
+        pos = m.end()
+
+        tag = m.group("tag")
+        if not tag or tag in soup_builder.string_containers:
+            # Comments, scripts, and such
+            return None
+        empty = tag in soup_builder.empty_element_tags
+        if m.group("close"):
+            if empty or m.group("attrs") or m.group("empty") or \
+                    not stack or stack.pop() != tag:
+                return None
+            out.append(m.group(0))
+            continue
+        if m.group("empty") and not empty:
+            return None
+        attrs = soup_form_attr.findall(m.group("attrs"))
+        names = [name for name, value in attrs]
+        if names != sorted(set(names)):
+            return None
+        multi_valued = (soup_builder.cdata_list_attributes.get("*", set()) |
+                        soup_builder.cdata_list_attributes.get(tag, set()))
+        for name, value in attrs:
+            if (name in multi_valued and
+                    value != " ".join(non_whitespace.findall(value))):
+                return None
+        if empty:
+            out.append("<%s%s/>" % (tag, m.group("attrs")))
+        else:
+            out.append("<%s%s>" % (tag, m.group("attrs")))
+            stack.append(tag)
+    text = soup_text(html[pos:], False)
+    if stack or text is None:
+        return None
+    out.append(text)
+    return "".join(out)
+
+# Values for the html_parser setting, which Beautiful Soup uses to parse HTML
+HTML_PARSERS = ("html.parser", "lxml", "html5lib")
+def html_soup(html, parser="html.parser"):
+    """
+    Parse an HTML fragment, such as a page's content, into a BeautifulSoup
+    object. The lxml and html5lib parsers make a whole document out of the
+    fragment, so this unwraps the <html> and <body> elements they add, to get
+    the same tree that html.parser does.
+    """
+    if parser == "html.parser":
+        return BeautifulSoup(html, parser)
+    # Start the body first, so leading comments and whitespace stay in it
+    soup = BeautifulSoup("<body>%s</body>" % html, parser)
+    if soup.head is not None:
+        soup.head.decompose()
+    if soup.html is not None:
+        soup.html.unwrap()
+    if soup.body is not None:
+        soup.body.unwrap()
+    return soup
+
 def merge_dicts(default_d, specific_d, reserved_keys_top=[], override=False):
     """
     Extend specific_d with values from default_d (recursively), keeping values
@@ -119,3 +436,93 @@ def merge_dicts(default_d, specific_d, reserved_keys_top=[], override=False):
         elif override:
             specific_d[key] = val
         #else leave the key in the specific_d
+
+def hash_text(text):
+    """Return a hex digest of a string or bytes"""
+    if type(text) == str:
+        text = text.encode("utf-8")
+    return hashlib.sha256(text).hexdigest()
+
+def hash_data(data):
+    """
+    Hash a JSON-like value, or return None if it can't be hashed consistently.
+    """
+    def json_default(o):
+        if callable(o):
+            return "<callable>"
+        return repr(o)
+    try:
+        return hash_text(json.dumps(data, sort_keys=True, default=json_default))
+    except (TypeError, ValueError):
+        return None
+
+class TrackedList(list):
+    """
+    A list that notes whether its contents have been read.
+    """
+    accessed = False
+
+    def __iter__(self):
+        self.accessed = True
+        return super().__iter__()
+
+    def __reversed__(self):
+        self.accessed = True
+        return super().__reversed__()
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def __len__(self):
+        self.accessed = True
+        return super().__len__()
+
+    def __contains__(self, item):
+        self.accessed = True
+        return super().__contains__(item)
+
+class TrackedMapping(Mapping):
+    """
+    A read-only view of a dictionary that notes in a TrackedList whether the
+    dictionary's contents have been read, for indexes of the list's items.
+    """
+    def __init__(self, data, tracker):
+        self.data = data
+        self.tracker = tracker
+
+    def __getitem__(self, key):
+        self.tracker.accessed = True
+        return self.data[key]
+
+    def __iter__(self):
+        self.tracker.accessed = True
+        return iter(self.data)
+
+    def __len__(self):
+        self.tracker.accessed = True
+        return len(self.data)
+
+    def __contains__(self, key):
+        self.tracker.accessed = True
+        return key in self.data
+
+# Context fields that index all the pages; see DactylTarget.page_indexes()
+PAGE_INDEXES = ("pages_by_html", "pages_by_md", "pages_by_category",
+                "pages_by_parent")
+
+def track_pages(context):
+    """
+    Return a render context whose list of all pages notes whether it has been
+    read, including through the page indexes. If the list already does, return
+    the context as-is.
+    """
+    pages = context.get("pages", [])
+    if isinstance(pages, TrackedList):
+        return context
+    pages = TrackedList(pages)
+    tracked = {"pages": pages}
+    for key in PAGE_INDEXES:
+        if key in context:
+            tracked[key] = TrackedMapping(context[key], pages)
+    return {**context, **tracked}
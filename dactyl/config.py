@@ -4,6 +4,12 @@
 from dactyl.common import *
 from dactyl.version import __version__
 from dactyl.page import DactylPage
+from dactyl.disk_cache import DiskCache
+from dactyl.fragment_cache import FragmentCache
+
+import jinja2
+import shutil
+import stat
 
 # Used to import filters.
 from importlib import import_module
@@ -12,6 +18,9 @@ import importlib.util
 # Not the file containing defaults, but the default name of user-specified conf
 DEFAULT_CONFIG_FILE = "dactyl-config.yml"
 
+# Values for the markdown_engine setting
+MARKDOWN_ENGINES = ("python-markdown", "markdown-it")
+
 class DactylConfig:
     def __init__(self, cli_args):
         """Load config from commandline arguments"""
@@ -30,11 +39,30 @@ class DactylConfig:
         # Start with the default config, then overwrite later
         self.config = yaml.load(resource_stream(__name__, "default-config.yml"))
         self.filters = {}
+        self.filter_versions = {}
+        self.html_cache = None
+        self.highlight_cache = None
+        # Rendered {% cache %} fragments; saved on disk if fragment_cache is on
+        self.fragment_cache = FragmentCache(version=self.version_hash)
+        self.template_cache_path = None
+        self._version_hash = None
+        self._html_settings_hash = None
+        # Preprocessor environments that pages share; see DactylPage
+        self.pp_envs = {}
+        # Markdown converters that pages share, by extensions
+        self.md_converters = {}
+        # Filter pipelines that pages share, by filter names
+        self.filter_pipelines = {}
+        # Parsed hover anchor contents that pages share; see DactylPage
+        self.hover_anchors = {}
+        # Pages and targets by name for the xrefs filter; see filter_xrefs
+        self.xref_index = None
         if cli_args.config:
             self.load_config_from_file(cli_args.config)
         else:
             logger.debug("No config file specified, trying ./dactyl-config.yml")
             self.load_config_from_file(DEFAULT_CONFIG_FILE)
+        self.load_html_parser()
         self.load_filters()
 
         self.page_cache = []
@@ -125,6 +153,10 @@ class DactylConfig:
         """
 
         self.page_cache = []
+        self._version_hash = None
+        self._html_settings_hash = None
+        self.pp_envs = {}
+        self.xref_index = None
         skip_pp = self.config.get("skip_preprocessor", False)
         for page_data in self.config["pages"]:
             if OPENAPI_SPEC_KEY not in page_data:
@@ -205,6 +237,67 @@ class DactylConfig:
 
 
 
+    def version_hash(self):
+        """
+        Return a hash of the config settings and the fields that identify
+        each page, which filters such as xrefs use to refer to other pages.
+        """
+        if self._version_hash is None:
+            # The output path doesn't affect the content of pages
+            settings = {key: val for key,val in self.config.items()
+                        if key not in ("pages", "out_path")}
+            self._version_hash = hash_data([settings, self.page_ids()])
+        return self._version_hash
+
+    def html_settings_hash(self):
+        """
+        Return a hash of the settings that can change the HTML made from a
+        page's Markdown, and the fields that identify each page, for keys in
+        the HTML cache. Unlike version_hash(), this leaves out BUILD_SETTINGS,
+        so turning a cache on or changing its size keeps the cached HTML.
+        """
+        if self._html_settings_hash is None:
+            settings = {key: val for key,val in self.config.items()
+                        if key not in BUILD_SETTINGS and key != "pages"}
+            self._html_settings_hash = hash_data([settings, self.page_ids()])
+        return self._html_settings_hash
+
+    def page_ids(self):
+        """
+        Return the fields that identify each page to other pages.
+        """
+        return [[page.get(key) for key in PAGE_ID_FIELDS]
+                for page in self.config["pages"]]
+
+    def filter_version(self, filter_name):
+        """
+        Return a hash of a loaded filter's source code, so that caches of
+        filtered content can tell when the filter changes. Returns None if
+        the source isn't available.
+        """
+        if filter_name not in self.filter_versions:
+            try:
+                with open(self.filters[filter_name].__file__, "rb") as f:
+                    self.filter_versions[filter_name] = hash_text(f.read())
+            except (AttributeError, TypeError, OSError):
+                self.filter_versions[filter_name] = None
+        return self.filter_versions[filter_name]
+
+    def load_html_parser(self):
+        """Use the commandline's html_parser, if any, and check that it works"""
+        if self.cli_args.html_parser:
+            self.config["html_parser"] = self.cli_args.html_parser
+        parser = self.config["html_parser"]
+        if parser not in HTML_PARSERS:
+            exit("FATAL: Unknown html_parser '%s'. Use one of: %s" %
+                 (parser, ", ".join(HTML_PARSERS)))
+        if parser != "html.parser":
+            try:
+                import_module(parser)
+            except ImportError as e:
+                exit("FATAL: The %s html_parser requires the %s package: %s" %
+                     (parser, parser, e))
+
     def load_build_options(self):
         """Overwrites some build-specific options based on the CLI params"""
         if self.cli_args.out_dir:
@@ -218,7 +311,93 @@ class DactylConfig:
             self.config["preprocessor_allow_undefined"] = False
         if self.cli_args.legacy_prince:
             self.config["legacy_prince"] = True
-
+        if self.cli_args.html_cache:
+            self.config["html_cache"] = True
+
+        if self.config["html_cache"]:
+            self.html_cache = DiskCache("HTML",
+                os.path.join(self.config["temporary_files_path"],
+                             "dactyl_cache", "html"),
+                self.config["html_cache_size"] * 1024 * 1024)
+        if self.cli_args.highlight_cache:
+            self.config["highlight_cache"] = True
+        if self.config["highlight_cache"]:
+            self.highlight_cache = DiskCache("highlighted code",
+                os.path.join(self.config["temporary_files_path"],
+                             "dactyl_cache", "highlight"),
+                self.config["highlight_cache_size"] * 1024 * 1024)
+        if self.cli_args.fragment_cache:
+            self.config["fragment_cache"] = True
+        if self.config["fragment_cache"]:
+            self.fragment_cache.disk_cache = DiskCache("template fragment",
+                os.path.join(self.config["temporary_files_path"],
+                             "dactyl_cache", "fragments"),
+                self.config["fragment_cache_size"] * 1024 * 1024)
+
+        engine = self.config["markdown_engine"]
+        if engine not in MARKDOWN_ENGINES:
+            exit("FATAL: Unknown markdown_engine '%s'. Use one of: %s" %
+                 (engine, ", ".join(MARKDOWN_ENGINES)))
+        if engine == "markdown-it":
+            try:
+                from dactyl.markdown_it_converter import MarkdownItConverter
+            except ImportError as e:
+                exit("FATAL: The markdown-it engine requires the "+
+                     "markdown-it-py and mdit-py-plugins packages: %s" % e)
+
+        # Compiled templates are code, so each user gets their own folder
+        # that nobody else can write to. (Windows has per-user temp folders.)
+        if hasattr(os, "getuid"):
+            template_cache_path = os.path.join(
+                    self.config["temporary_files_path"],
+                    "dactyl_jinja_cache-%d" % os.getuid())
+        else:
+            template_cache_path = os.path.join(
+                    self.config["temporary_files_path"], "dactyl_cache", "jinja")
+        if self.cli_args.clear_template_cache:
+            logger.info("clearing template cache at %s" % template_cache_path)
+            shutil.rmtree(template_cache_path, ignore_errors=True)
+        if self.cli_args.no_template_cache:
+            self.config["template_cache"] = False
+        if self.config["template_cache"]:
+            self.template_cache_path = template_cache_path
+
+    def bytecode_cache(self, env_name):
+        """
+        Return a Jinja bytecode cache for one kind of template environment,
+        or None if the template cache is off. Each kind gets its own folder
+        because they compile the same source with different settings.
+        """
+        if not self.template_cache_path:
+            return None
+        path = os.path.join(self.template_cache_path, env_name)
+        try:
+            self.check_private_folder(self.template_cache_path)
+            os.makedirs(path, mode=0o700, exist_ok=True)
+        except OSError as e:
+            logger.warning("Not caching compiled templates: %s" % e)
+            return None
+        return jinja2.FileSystemBytecodeCache(path)
+
+    @staticmethod
+    def check_private_folder(path):
+        """
+        Create a folder that only the current user can use, or raise an
+        OSError if the folder exists and someone else owns it or can write to
+        it, since its contents can't be trusted then.
+        """
+        if not hasattr(os, "getuid"):
+            os.makedirs(path, exist_ok=True)
+            return
+        try:
+            os.makedirs(path, mode=0o700)
+        except FileExistsError:
+            pass
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+            raise OSError("%s isn't a folder owned by the current user" % path)
+        if st.st_mode & 0o077:
+            raise OSError("%s can be used by other users" % path)
 
     def __getitem__(self, key):
         return self.config[key]
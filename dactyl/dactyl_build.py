@@ -11,7 +11,7 @@ from dactyl.common import *
 
 # Necessary to copy static files to the output dir
 from distutils.dir_util import copy_tree, remove_tree
-from shutil import copy as copy_file
+from shutil import copy as copy_file, copy2, rmtree
 
 # shallow copying of data types
 from copy import copy
@@ -21,6 +21,14 @@ import subprocess
 import sys
 from time import sleep
 
+# Used to render pages in parallel
+import concurrent.futures
+import multiprocessing
+
+# Used to swap staged output into place
+import ctypes
+import errno
+
 # Used to fetch markdown sources from the net
 import requests
 from urllib.parse import urlparse
@@ -36,8 +44,20 @@ from dactyl.config import DactylConfig
 from dactyl.cli import DactylCLIParser
 from dactyl.target import DactylTarget
 from dactyl.page import DactylPage
+from dactyl.manifest import BuildManifest, MANIFEST_SUFFIX
+from dactyl.tree_nav import TreeNav
+from dactyl.fragment_cache import FragmentCacheExtension
 from dactyl.watch_handler import UpdaterHandler
 
+# From <fcntl.h> and <linux/fs.h>, for exchange_paths()
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+# State shared with the worker processes of a parallel build. This is set right
+# before a process pool starts, and the workers are forked from this process,
+# so they inherit the already-loaded config, target, pages, and filter modules
+# instead of loading and parsing them again for every page.
+_pool_state = None
 
 class DactylBuilder:
     def __init__(self, target, config, mode="html", only_page=None):
@@ -85,13 +105,31 @@ class DactylBuilder:
         self.default_es_template = self.get_es_template(self.config["default_es_template"])
 
         self.http_port = DEFAULT_SERVER_PORT
+        self.jobs = 1
+        # Parse at most this many pages ahead of writing them in parallel
+        # builds (0 for no limit)
+        self.max_inflight_pages = 0
+        # Drop each page's contents after writing it. Watch mode keeps them
+        # so it can render pages again without re-parsing them.
+        self.release_pages = True
+        self.incremental = False
+        # Set this Event to stop the current build; see check_cancelled()
+        self.cancel_event = None
+        self.delete_stale = self.config["delete_stale_files"]
+        self.staged = self.config["staged_output"]
+
+        # Output files of the latest build, for report_output()
+        self.written_files = []
+        self.unchanged_files = []
+        self.static_files = []
+        self.partial_build = False
 
 
     def temp_dir(self):
         run_dir = os.path.join(self.config["temporary_files_path"],
                           "dactyl-"+self.nonce)
-        if not os.path.isdir(run_dir):
-            os.makedirs(run_dir)
+        # Worker processes may get here at the same time
+        os.makedirs(run_dir, exist_ok=True)
         return run_dir
 
     def match_only_page(self, currentpage_data):
@@ -111,15 +149,22 @@ class DactylBuilder:
                 return True
         return False
 
-    def build(self):
+    def build(self, rebuild=None):
         """
         Build and write all pages in the target, according to the set mode,
         and upload their entries to ElasticSearch if requested.
+
+        If rebuild is a list of pages, reuse the target's already-loaded pages
+        and only build the ones in the list. Watch mode uses this.
         """
 
-        logger.info("loading pages in target...")
-        pages = self.target.load_pages()
-        logger.info("... done loading pages in target")
+        if rebuild is None:
+            logger.info("loading pages in target...")
+            pages = self.target.load_pages()
+            logger.info("... done loading pages in target")
+        else:
+            pages = self.target.pages
+            rebuild = set(id(page) for page in rebuild)
 
         # Set up context that gets passed to several build/render functions
         # as well as filters
@@ -130,61 +175,267 @@ class DactylBuilder:
             "target": self.target.data, # just data, for legacy compat
             "pages": [p.data for p in pages], # just data, for legacy compat
             "categories": self.target.categories(),
+            **self.target.page_indexes(),
         }
 
-        es_data = {}
-        matched_only = False
+        for cache in (self.config.html_cache, self.config.highlight_cache,
+                      self.config.fragment_cache):
+            if cache:
+                cache.reset_stats()
+        # Pages and their hierarchy may have changed since the last build
+        self.tree_nav.reset()
+        self.config.fragment_cache.forget()
+
+        self.written_files = []
+        self.unchanged_files = []
+        self.partial_build = bool(rebuild is not None or self.only_page)
+
+        build_pages = []
         for page in pages:
             if page.is_virtual():
                 logger.debug("skipping virtual page: %s" % page)
                 continue
 
-            if self.only_page:
-                if self.match_only_page(page.data):
-                    matched_only = True
-                else:
-                    logger.debug("only_page mode: skipping page %s" % page)
-                    continue
-
-            logger.info("Building page: %s"%page)
-
-            page_context = {"currentpage":page.data, **context}
-
-            if self.mode == "es" or self.es_upload != NO_ES_UP:
-                es_template = self.template_for_page(page, mode="es")
-                es_json_s = page.es_json(es_template, page_context)
-                es_page_id = self.target.name+"."+page.data["html"]
-                es_data[es_page_id] = es_json_s
-
-            if self.mode == "html" or self.mode == "pdf":
-                use_template = self.template_for_page(page)
-                logger.debug("use_template is: %s" % use_template)
-                page_text = page.render(use_template, page_context)
-            elif self.mode == "md":
-                if "md" not in page.data and "__md_generator" not in page.data:
-                    logger.info("... md mode: Skipping page (no md): %s" % page)
-                    continue
-                page_text = page.md_content(page_context)
-            elif self.mode == "es":
-                page_text = es_json_s
-            else:
-                exit("build() error: unknown mode: %s" % self.mode)
+            if self.only_page and not self.match_only_page(page.data):
+                logger.debug("only_page mode: skipping page %s" % page)
+                continue
 
-            if page_text:
-                self.write_page(page_text, page.filepath(self.mode))
-            else:
-                logger.warning("not writing empty page '%s'"%page.data["name"])
+            if rebuild is not None and id(page) not in rebuild:
+                continue
+
+            build_pages.append(page)
 
-        if self.only_page and not matched_only:
+        if self.only_page and not build_pages and rebuild is None:
             exit("Didn't find requested 'only' page '%s'" % self.only_page)
 
-        if self.es_upload != NO_ES_UP:
-            self.upload_es(es_data)
+        manifest = None
+        if self.incremental:
+            if self.mode == "pdf":
+                logger.info("Incremental builds don't apply to PDFs; "+
+                            "building all pages.")
+            elif self.es_upload != NO_ES_UP:
+                logger.info("Uploading to ElasticSearch requires all pages; "+
+                            "building all pages.")
+            else:
+                manifest = BuildManifest(self)
+
+        # Pages whose outputs are up-to-date, mapped by index to the fields
+        # they saved in the manifest when they were last built
+        reused = {}
+        page_inputs = {}
+        if manifest:
+            for i, page in enumerate(build_pages):
+                page_inputs[i] = manifest.page_inputs(page)
+                if manifest.is_current(page, page_inputs[i]):
+                    reused[i] = manifest.restored_fields(page)
+            logger.info("incremental build: %d of %d pages unchanged" %
+                        (len(reused), len(build_pages)))
+
+        if self.jobs > 1 and len(build_pages) - len(reused) > 1:
+            if "fork" in multiprocessing.get_all_start_methods():
+                built = self.build_parallel(build_pages, context, reused)
+            else:
+                logger.warning("Parallel builds aren't supported on this "+
+                               "platform; building pages one at a time.")
+                built = self.build_serial(build_pages, context, reused)
+        else:
+            built = self.build_serial(build_pages, context, reused)
+
+        if manifest:
+            for i in built:
+                manifest.record(build_pages[i], page_inputs[i])
+            manifest.save()
+            for i in reused.keys():
+                self.unchanged_files.append(self.out_file_path(
+                        build_pages[i].filepath(self.mode)))
+
+        for cache in (self.config.html_cache, self.config.highlight_cache,
+                      self.config.fragment_cache):
+            if cache:
+                cache.report()
+                cache.trim()
 
         if self.mode == "pdf":
             self.assemble_pdf()
 
 
+    def build_serial(self, pages, context, reused={}):
+        """
+        Build the given pages one at a time, in order, except the ones in
+        reused, which get their saved fields instead. Returns the indexes of
+        the built pages.
+        """
+        built = []
+        for i, page in enumerate(pages):
+            if i in reused:
+                logger.info("Unchanged page: %s" % page)
+                page.data.update(reused[i])
+                continue
+            self.check_cancelled()
+            es_json_s = self.build_page(page, context)
+            self.finish_page(page, es_json_s)
+            built.append(i)
+        return built
+
+    def build_parallel(self, pages, context, reused={}):
+        """
+        Build the given pages across a pool of self.jobs worker processes,
+        except the ones in reused, which get their saved fields instead.
+        Returns the indexes of the built pages.
+
+        When building HTML or PDF, this runs in two stages. First, the workers
+        parse each page's contents (preprocessing, Markdown, and filters) and
+        send back the results, including the fields that parsing adds to the
+        page's metadata, such as "blurb". Then a fresh set of workers renders
+        the templates and writes the pages in contiguous runs. Before rendering
+        a page, a worker applies the stage-one metadata of that page and every
+        page before it, but not the pages after it, so templates see the same
+        metadata they would see in a serial build. Pages whose preprocessing
+        or filters read the "pages" list are parsed in the second stage
+        instead, for the same reason.
+
+        If self.max_inflight_pages is set, the pages go through both stages
+        in batches of that many, so that only one batch's parsed contents are
+        in memory at a time.
+        """
+        global _pool_state
+
+        # Workers are forked when each pool starts, so the second stage's
+        # workers inherit the first stage's results in the prepared list.
+        prepared = [None] * len(pages)
+        _pool_state = (self, pages, context, prepared, reused)
+        todo = [i for i in range(len(pages)) if i not in reused]
+        batch_size = self.max_inflight_pages or len(todo)
+        built = []
+        done = 0 # Pages before this index are finished in this process
+        try:
+            for b in range(0, len(todo), batch_size):
+                batch = todo[b:b+batch_size]
+                results = {}
+                if self.mode == "html" or self.mode == "pdf":
+                    logger.info("parsing %d pages with %d workers..." %
+                                (len(batch), self.jobs))
+                    tasks = [(i,) for i in batch]
+                    for i, result in self.run_pool(_prepare_page_worker, tasks):
+                        prepared[i] = result
+
+                logger.info("rendering %d pages with %d workers..." %
+                            (len(batch), self.jobs))
+                num_runs = min(len(batch), self.jobs * 4)
+                bounds = [round(n * len(batch) / num_runs)
+                          for n in range(num_runs+1)]
+                tasks = [(batch[a], batch[c-1]+1)
+                         for a,c in zip(bounds[:-1], bounds[1:])]
+                for run_results, written, unchanged in self.run_pool(
+                        _build_pages_worker, tasks):
+                    results.update(run_results)
+                    self.written_files += written
+                    self.unchanged_files += unchanged
+
+                # Keep the parsed results in this process, too, as a serial
+                # build would, so the next batch's workers inherit them.
+                stop = batch[-1] + 1
+                for i in range(done, stop):
+                    page = pages[i]
+                    if i in reused:
+                        page.data.update(reused[i])
+                        continue
+                    apply_prepared_page(page, prepared[i],
+                                        data_only=self.release_pages)
+                    prepared[i] = None
+                    if i in results:
+                        es_json_s, new_data = results[i]
+                        page.data.update(new_data)
+                        self.finish_page(page, es_json_s)
+                        built.append(i)
+                done = stop
+        finally:
+            _pool_state = None
+
+        for i in range(done, len(pages)):
+            if i in reused:
+                pages[i].data.update(reused[i])
+        return built
+
+    def run_pool(self, worker, tasks):
+        """
+        Run a worker function on each set of arguments in tasks, using a new
+        pool of forked processes, and yield the results as they finish.
+        """
+        executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(self.jobs, len(tasks)),
+                mp_context=multiprocessing.get_context("fork"))
+        try:
+            futures = [executor.submit(worker, *args) for args in tasks]
+            for future in concurrent.futures.as_completed(futures):
+                self.check_cancelled()
+                yield future.result()
+        except BuildCancelled:
+            # Let the running workers finish so they don't write files after
+            # the next build starts.
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        except BaseException:
+            # Includes the SystemExit from a non-bypassed recoverable_error()
+            # in a worker. Don't wait for the rest of the pages.
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+    def check_cancelled(self):
+        """
+        Raise BuildCancelled if something asked to stop the current build.
+        """
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise BuildCancelled()
+
+    def build_page(self, page, context):
+        """
+        Build and write a single page according to the set mode. Returns the
+        page's ES JSON if the build needs it, or None otherwise.
+        """
+        logger.info("Building page: %s"%page)
+
+        page_context = {"currentpage":page.data, **context}
+
+        es_json_s = None
+        if self.mode == "es" or self.es_upload != NO_ES_UP:
+            es_template = self.template_for_page(page, mode="es")
+            es_json_s = page.es_json(es_template, page_context)
+
+        if self.mode == "html" or self.mode == "pdf":
+            use_template = self.template_for_page(page)
+            logger.debug("use_template is: %s" % use_template)
+            page_text = page.render(use_template, page_context)
+        elif self.mode == "md":
+            if "md" not in page.data and "__md_generator" not in page.data:
+                logger.info("... md mode: Skipping page (no md): %s" % page)
+                return es_json_s
+            page_text = page.md_content(page_context)
+        elif self.mode == "es":
+            page_text = es_json_s
+        else:
+            exit("build() error: unknown mode: %s" % self.mode)
+
+        if page_text:
+            self.write_page(page_text, page.filepath(self.mode))
+        else:
+            logger.warning("not writing empty page '%s'"%page.data["name"])
+        return es_json_s
+
+    def finish_page(self, page, es_json_s):
+        """
+        Upload a built page to ElasticSearch if requested, then release its
+        contents if the builder is set to.
+        """
+        if es_json_s is not None and self.es_upload != NO_ES_UP:
+            self.upload_es({self.es_page_id(page): es_json_s})
+        if self.release_pages:
+            page.release()
+
+    def es_page_id(self, page):
+        return self.target.name+"."+page.data["html"]
+
     def template_for_page(self, page, mode=None):
         """
         Return the preferred template for the given page and mode, based on
@@ -205,9 +456,9 @@ class DactylBuilder:
         else:
             return default_template
 
-    def write_page(self, page_text, filepath):
+    def out_file_path(self, filepath):
         """
-        Writes HTML/MD/ES JSON out to the filesystem.
+        Returns the path where the output file for the given filepath goes.
         """
         if self.mode == "pdf":
             # only the final pdf goes to out_path
@@ -215,18 +466,224 @@ class DactylBuilder:
         else:
             base_folder = self.out_path
 
-        # Join folders in case the filepath is not just a flat file
-        out_folder = os.path.join(base_folder, os.path.dirname(filepath))
-        if not os.path.isdir(out_folder):
-            logger.debug("creating output folder %s" % out_folder)
-            os.makedirs(out_folder)
         fileout = os.path.join(base_folder, filepath)
         if os.path.isdir(fileout):
-            logger.debug("Writing index file for out-file '%s'" % fileout)
             fileout = fileout+"index.html"
-        with open(fileout, "w", encoding="utf-8") as f:
+        return fileout
+
+    def write_page(self, page_text, filepath):
+        """
+        Writes HTML/MD/ES JSON out to the filesystem, unless the file already
+        has exactly that contents. Leaving unchanged files alone keeps their
+        modification times, so tools that sync or deploy the output only see
+        the pages that actually changed.
+        """
+        fileout = self.out_file_path(filepath)
+        data = page_text.replace("\n", os.linesep).encode("utf-8")
+
+        if self.file_has_contents(fileout, data):
+            logger.debug("file unchanged: %s" % fileout)
+            self.unchanged_files.append(fileout)
+            return
+
+        # Make folders in case the filepath is not just a flat file
+        out_folder = os.path.dirname(fileout)
+        if not os.path.isdir(out_folder):
+            logger.debug("creating output folder %s" % out_folder)
+            # Another worker process may create it first
+            os.makedirs(out_folder, exist_ok=True)
+        # Write a new file and move it into place rather than writing into
+        # the existing one, which may be hardlinked to the previous output.
+        tmp_path = "%s.%d.tmp" % (fileout, os.getpid())
+        with open(tmp_path, "wb") as f:
             logger.debug("writing to file: %s..." % fileout)
-            f.write(page_text)
+            f.write(data)
+        os.replace(tmp_path, fileout)
+        self.written_files.append(fileout)
+
+    @staticmethod
+    def file_has_contents(path, data):
+        """
+        Report whether the file at the given path exists and contains exactly
+        the given bytes. Checks the size first so most changed files don't
+        need to be read.
+        """
+        try:
+            if os.path.getsize(path) != len(data):
+                return False
+            with open(path, "rb") as f:
+                return f.read() == data
+        except OSError:
+            return False
+
+    def report_output(self):
+        """
+        Log a summary of the files the latest build wrote or left unchanged,
+        and of stale files in the output folder that the build didn't produce.
+        Delete the stale files if the builder is set to. Stale files are only
+        checked after full builds of HTML, Markdown, or ES JSON.
+        """
+        logger.info("output: %d files written, %d unchanged" %
+                    (len(self.written_files), len(self.unchanged_files)))
+        for path in self.written_files:
+            logger.debug("written: %s" % path)
+        for path in self.unchanged_files:
+            logger.debug("unchanged: %s" % path)
+
+        if self.partial_build or self.mode == "pdf":
+            return
+        stale = self.stale_files()
+        if not stale:
+            return
+        if self.delete_stale:
+            logger.info("deleting %d stale files:" % len(stale))
+        else:
+            logger.info(("%d stale files in the output folder (use "+
+                        "--delete_stale to delete them):") % len(stale))
+        for path in stale:
+            logger.info("  %s" % os.path.relpath(path, self.out_path))
+            if self.delete_stale:
+                self.delete_output_file(path)
+
+    def stale_files(self):
+        """
+        Return a sorted list of the files in the output folder that the latest
+        build didn't write, leave unchanged, or copy as static files.
+        """
+        produced = set(os.path.abspath(p) for p in
+                       self.written_files + self.unchanged_files +
+                       self.static_files)
+        stale = []
+        for dirpath, dirnames, filenames in os.walk(self.out_path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.path.abspath(path) not in produced:
+                    stale.append(path)
+        return sorted(stale)
+
+    def delete_output_file(self, path):
+        """
+        Delete a file from the output folder, and any folders that deleting it
+        leaves empty.
+        """
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning("Couldn't delete stale file %s: %s" % (path, e))
+            return
+        out_path = os.path.abspath(self.out_path)
+        folder = os.path.dirname(os.path.abspath(path))
+        while folder != out_path and folder.startswith(out_path+os.sep):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break # Not empty
+            folder = os.path.dirname(folder)
+
+    def start_staging(self):
+        """
+        Point the build at a staging folder next to the output folder, so the
+        output folder stays as it was until finish_staging(). The staging
+        folder starts with hardlinks to the current output's files, so files
+        that don't change don't need to be copied.
+        """
+        if self.mode == "pdf":
+            logger.info("Staged output doesn't apply to PDFs; writing the "+
+                        "PDF directly.")
+            return
+        live_path = os.path.normpath(self.config["out_path"])
+        staging_path = live_path + STAGING_SUFFIX
+        # Clear out leftovers from a build that failed
+        if os.path.isdir(staging_path):
+            rmtree(staging_path)
+        remove_if_exists(staging_path + MANIFEST_SUFFIX)
+
+        logger.info("staging output in %s" % staging_path)
+        if os.path.isdir(live_path):
+            link_tree(live_path, staging_path)
+        else:
+            os.makedirs(staging_path)
+        self.out_path = staging_path
+
+    def finish_staging(self):
+        """
+        Replace the output folder with the staging folder from a successful
+        build, and keep the old output folder as a sibling ending in
+        PREVIOUS_SUFFIX, for rollback().
+        """
+        live_path = os.path.normpath(self.config["out_path"])
+        staging_path = os.path.normpath(self.out_path)
+        if staging_path == live_path:
+            return # Not staged
+        previous_path = live_path + PREVIOUS_SUFFIX
+
+        if os.path.isdir(previous_path):
+            rmtree(previous_path)
+        remove_if_exists(previous_path + MANIFEST_SUFFIX)
+        # Each manifest moves along with the output it describes. The live
+        # manifest goes first, so an interrupted swap leads to a full rebuild
+        # rather than an incremental build against the wrong output.
+        if os.path.exists(live_path + MANIFEST_SUFFIX):
+            os.rename(live_path + MANIFEST_SUFFIX,
+                      previous_path + MANIFEST_SUFFIX)
+        if not os.path.exists(live_path):
+            os.rename(staging_path, live_path)
+        elif exchange_paths(staging_path, live_path):
+            os.rename(staging_path, previous_path)
+        else:
+            # Without an atomic exchange, the output folder is missing between
+            # these renames. If that's interrupted, recover_staging() puts the
+            # old output back the next time Dactyl runs.
+            os.rename(live_path, previous_path)
+            os.rename(staging_path, live_path)
+        if os.path.exists(staging_path + MANIFEST_SUFFIX):
+            os.rename(staging_path + MANIFEST_SUFFIX,
+                      live_path + MANIFEST_SUFFIX)
+        logger.info("moved staged output into place at %s" % live_path)
+        self.out_path = self.config["out_path"]
+
+    def recover_staging(self):
+        """
+        Finish or undo a swap of output folders that finish_staging() or
+        rollback() didn't complete, for example because the process was
+        killed, so the output folder isn't left missing.
+        """
+        live_path = os.path.normpath(self.config["out_path"])
+        previous_path = live_path + PREVIOUS_SUFFIX
+        swap_path = live_path + ROLLBACK_SUFFIX
+        if not os.path.exists(live_path):
+            for path in (previous_path, swap_path):
+                if os.path.isdir(path):
+                    logger.warning("Output folder %s is missing; restoring it from %s" %
+                                   (live_path, path))
+                    move_output(path, live_path)
+                    break
+        if os.path.isdir(swap_path) and not os.path.exists(previous_path):
+            move_output(swap_path, previous_path)
+
+    def rollback(self):
+        """
+        Swap the output folder with the output of the previous staged build.
+        Running this again undoes it.
+        """
+        live_path = os.path.normpath(self.config["out_path"])
+        previous_path = live_path + PREVIOUS_SUFFIX
+        if not os.path.isdir(previous_path):
+            exit("FATAL: No previous output to roll back to at %s" %
+                 previous_path)
+        swap_path = live_path + ROLLBACK_SUFFIX
+        for suffix in (MANIFEST_SUFFIX, ""):
+            if (os.path.exists(live_path + suffix) and
+                    os.path.exists(previous_path + suffix) and
+                    exchange_paths(live_path + suffix, previous_path + suffix)):
+                continue
+            if os.path.exists(live_path + suffix):
+                os.rename(live_path + suffix, swap_path + suffix)
+            if os.path.exists(previous_path + suffix):
+                os.rename(previous_path + suffix, live_path + suffix)
+            if os.path.exists(swap_path + suffix):
+                os.rename(swap_path + suffix, previous_path + suffix)
+        logger.info("rolled %s back to the previous output" % live_path)
 
     def copy_static(self, template_static=None, content_static=None, out_path=None):
         """
@@ -238,7 +695,8 @@ class DactylBuilder:
         if content_static is None:
             content_static = self.copy_content_static
         if out_path is None:
-            out_path = self.config["out_path"]
+            out_path = self.out_path
+        self.static_files = []
 
         if template_static:
             template_static_src = self.config["template_static_path"]
@@ -246,7 +704,8 @@ class DactylBuilder:
             if os.path.isdir(template_static_src):
                 template_static_dst = os.path.join(out_path,
                                            os.path.basename(template_static_src))
-                copy_tree(template_static_src, template_static_dst)
+                self.static_files += copy_tree(template_static_src,
+                                               template_static_dst)
             else:
                 logger.warning(("Template static path '%s' doesn't exist; "+
                                 "skipping.") % template_static_src)
@@ -262,13 +721,15 @@ class DactylBuilder:
                     if os.path.isdir(content_static_src):
                         content_static_dst = os.path.join(out_path,
                                             os.path.basename(content_static_src))
-                        copy_tree(content_static_src, content_static_dst)
+                        self.static_files += copy_tree(content_static_src,
+                                                       content_static_dst)
                     elif os.path.isfile(content_static_src):
                         content_static_dst = os.path.join(out_path,
                                             os.path.dirname(content_static_src))
                         logger.debug("Copying single content_static_path file '%s'." %
                                 content_static_src)
-                        copy_file(content_static_src, content_static_dst)
+                        self.static_files.append(copy_new_file(
+                                content_static_src, content_static_dst))
                     else:
                         logger.warning("Content static path '%s' doesn't exist; skipping." %
                                         content_static_src)
@@ -276,6 +737,39 @@ class DactylBuilder:
                 logger.debug("No content_static_path in conf; skipping copy")
 
 
+    def copy_static_file(self, path):
+        """
+        If the file at the given path is in one of the static paths, copy it
+        to the output directory (if this build copies that kind of static
+        files) and return True. Otherwise, return False.
+        """
+        path = os.path.abspath(path)
+        static_dirs = [(self.config["template_static_path"],
+                        self.copy_template_static)]
+        content_static_srcs = self.config.get("content_static_path", [])
+        if type(content_static_srcs) == str:
+            content_static_srcs = [content_static_srcs]
+        static_dirs += [(src, self.copy_content_static)
+                        for src in content_static_srcs]
+
+        for src, copy_it in static_dirs:
+            src_abs = os.path.abspath(src)
+            if path == src_abs:
+                # A single-file content_static_path
+                dst = os.path.join(self.out_path, src)
+            elif path.startswith(src_abs + os.sep):
+                dst = os.path.join(self.out_path, os.path.basename(src_abs),
+                                   os.path.relpath(path, src_abs))
+            else:
+                continue
+
+            if copy_it and os.path.isfile(path):
+                logger.info("copying static file %s" % path)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                copy_new_file(path, dst)
+            return True
+        return False
+
     def setup_html_env(self):
         """
         Set up a Jinja env to load custom templates for HTML / HTML->PDF builds.
@@ -289,8 +783,10 @@ class DactylBuilder:
         if "template_path" in self.config:
             loaderset.insert(0, jinja2.FileSystemLoader(self.config["template_path"]))
         env = jinja2.Environment(undefined=preferred_undefined,
-                    extensions=['jinja2.ext.i18n'],
-                    loader=jinja2.ChoiceLoader(loaderset))
+                    extensions=['jinja2.ext.i18n', FragmentCacheExtension],
+                    loader=jinja2.ChoiceLoader(loaderset),
+                    bytecode_cache=self.config.bytecode_cache("html"))
+        env.fragment_cache = self.config.fragment_cache
 
         # Customize env: add custom tests, lstrip & trim blocks
         def defined_and_equalto(a,b):
@@ -303,6 +799,10 @@ class DactylBuilder:
         env.lstrip_blocks = True
         env.trim_blocks = True
 
+        # Renders tree-nav.html's navigation once and fills it in per page
+        self.tree_nav = TreeNav()
+        env.globals["tree_nav"] = self.tree_nav
+
         # Set up internationalization
         mo_file = self.target.data.get("locale_file", None)
         if mo_file:
@@ -493,14 +993,32 @@ class DactylBuilder:
                 es_upload=cli_args.es_upload,)
         """
 
+        # Rebuilds run on the watcher's threads, and forking worker
+        # processes from a process with other threads can deadlock on locks
+        # those threads hold (for example, logging's).
+        self.jobs = 1
+
         if self.mode == "html" and self.http_port:
             server = subprocess.Popen([sys.executable, "-m", "http.server",
                                       str(self.http_port), "-d", self.out_path])
 
         event_handler = UpdaterHandler(builder=self)
         observer = Observer()
-        observer.schedule(event_handler, self.config["template_path"], recursive=True)
-        observer.schedule(event_handler, self.config["content_path"], recursive=True)
+        watched = [self.config["template_path"], self.config["content_path"]]
+        for path in watched:
+            observer.schedule(event_handler, path, recursive=True)
+        # Also watch static files that aren't in those folders
+        static_paths = [self.config["template_static_path"]]
+        content_static = self.config.get("content_static_path", [])
+        if type(content_static) == str:
+            content_static = [content_static]
+        for path in static_paths + content_static:
+            path = os.path.abspath(path)
+            if not os.path.isdir(path) or any(
+                    (path+os.sep).startswith(os.path.abspath(w)+os.sep)
+                    for w in watched):
+                continue
+            observer.schedule(event_handler, path, recursive=True)
         observer.start()
         # The above starts an observing thread,
         #   so the main thread can just wait
@@ -511,6 +1029,138 @@ class DactylBuilder:
             observer.stop()
         observer.join()
 
+def _prepare_page_worker(i):
+    """
+    Worker process function for the first stage of a parallel build: parse one
+    page's contents. Returns the page's index and its parsed results.
+    """
+    builder, pages, context, prepared, reused = _pool_state
+    page = pages[i]
+    page_context = track_pages({"currentpage":page.data, **context})
+    all_pages = page_context["pages"]
+    old_data = dict(page.data)
+    try:
+        page.html_content(page_context)
+    except Exception as e:
+        recoverable_error("Failed to parse page %s: %s" % (page, e),
+                          builder.config.bypass_errors, error=e)
+        return i, None
+    if all_pages.accessed:
+        # The results may depend on metadata of the pages before this one,
+        # which aren't parsed yet. Parse it again in the second stage instead.
+        logger.debug("page %s uses other pages' metadata; deferring" % page)
+        return i, None
+    new_data = {key: val for key,val in page.data.items()
+                if key not in old_data or old_data[key] is not val}
+    return i, (page.html, page.toc, new_data)
+
+def _build_pages_worker(start, stop):
+    """
+    Worker process function for the second stage of a parallel build: render
+    and write the pages from index start up to (not including) stop. Returns
+    each built page's ES JSON (or None) and the fields that building it added
+    to its metadata, mapped by index, plus the lists of output files written
+    and left unchanged.
+    """
+    builder, pages, context, prepared, reused = _pool_state
+    builder.written_files = []
+    builder.unchanged_files = []
+    for i in range(start):
+        if i in reused:
+            pages[i].data.update(reused[i])
+        else:
+            apply_prepared_page(pages[i], prepared[i], data_only=True)
+
+    results = {}
+    for i in range(start, stop):
+        page = pages[i]
+        if i in reused:
+            page.data.update(reused[i])
+            continue
+        apply_prepared_page(page, prepared[i])
+        old_data = dict(page.data)
+        try:
+            es_json_s = builder.build_page(page, context)
+        except Exception as e:
+            recoverable_error("Failed to build page %s: %s" % (page, e),
+                              builder.config.bypass_errors, error=e)
+            continue
+        new_data = {key: val for key,val in page.data.items()
+                    if key not in old_data or old_data[key] is not val}
+        results[i] = (es_json_s, new_data)
+    return results, builder.written_files, builder.unchanged_files
+
+def apply_prepared_page(page, result, data_only=False):
+    """
+    Apply the results of parsing a page in a different process.
+    """
+    if result is None:
+        return
+    html, toc, new_data = result
+    page.data.update(new_data)
+    if not data_only:
+        page.html = html
+        page.toc = toc
+
+def link_tree(src, dst):
+    """
+    Make a copy of the src folder at dst where the files are hardlinks to the
+    originals, or regular copies where hardlinks aren't possible.
+    """
+    for dirpath, dirnames, filenames in os.walk(src):
+        dst_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(dst_dir, exist_ok=True)
+        for filename in filenames:
+            src_file = os.path.join(dirpath, filename)
+            dst_file = os.path.join(dst_dir, filename)
+            try:
+                os.link(src_file, dst_file)
+            except OSError:
+                copy2(src_file, dst_file)
+
+def copy_new_file(src, dst):
+    """
+    Copy a file like shutil.copy(), but replace the destination file instead
+    of writing into it, in case it's hardlinked to another copy of the output.
+    Returns the path of the new file.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    remove_if_exists(dst)
+    return copy_file(src, dst)
+
+def exchange_paths(path_a, path_b):
+    """
+    Swap two existing paths in one step, using renameat2() with
+    RENAME_EXCHANGE. Returns False without changing anything if the platform
+    or filesystem doesn't support that.
+    """
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (AttributeError, OSError):
+        return False
+    if renameat2(AT_FDCWD, os.fsencode(path_a), AT_FDCWD, os.fsencode(path_b),
+                 RENAME_EXCHANGE) == 0:
+        return True
+    err = ctypes.get_errno()
+    if err in (errno.ENOSYS, errno.EINVAL, errno.ENOTSUP):
+        return False
+    raise OSError(err, os.strerror(err), path_a, None, path_b)
+
+def move_output(src, dst):
+    """
+    Rename an output folder along with its manifest, if it has one.
+    """
+    os.rename(src, dst)
+    if os.path.exists(src + MANIFEST_SUFFIX):
+        os.replace(src + MANIFEST_SUFFIX, dst + MANIFEST_SUFFIX)
+
+def remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
 def list_targets(config):
     rows = []
     for t in config["targets"]:
@@ -593,14 +1243,43 @@ def main(cli_args, config):
 
     builder.http_port = cli_args.http_port
 
+    if cli_args.jobs is None:
+        # Only build in parallel by default where Python forks processes by
+        # default. Elsewhere, such as on macOS, forking can be unsafe.
+        if multiprocessing.get_start_method(allow_none=False) == "fork":
+            builder.jobs = os.cpu_count() or 1
+    elif cli_args.jobs < 1:
+        exit("FATAL: --jobs must be at least 1")
+    else:
+        builder.jobs = cli_args.jobs
+    if cli_args.max_inflight_pages < 0:
+        exit("FATAL: --max_inflight_pages can't be negative")
+    builder.max_inflight_pages = cli_args.max_inflight_pages
+    builder.release_pages = not cli_args.watch
+    builder.incremental = cli_args.incremental
+    if cli_args.delete_stale:
+        builder.delete_stale = True
+    if cli_args.staged:
+        builder.staged = True
+
+    builder.recover_staging()
+    if cli_args.rollback:
+        builder.rollback()
+        exit(0)
+
     if cli_args.only:
         logger.info("building page %s..."%cli_args.only)
     else:
         logger.info("building target %s..."%target.name)
+    if builder.staged:
+        builder.start_staging()
     builder.build()
     logger.info("done building")
 
     builder.copy_static()
+    builder.report_output()
+    if builder.staged:
+        builder.finish_staging()
 
     if cli_args.watch:
         logger.info("watching for changes...")
@@ -21,7 +21,7 @@ def getSoup(in_file):
         soup = soupsCache[in_file]
     else:
         with open(in_file, 'r', encoding="utf-8") as f:
-            soup = BeautifulSoup(f.read(), "html.parser")
+            soup = BeautifulSoup(f.read(), config["html_parser"])
             soupsCache[in_file] = soup
     return soup
 
@@ -159,7 +159,10 @@ class DactylStyleChecker:
     def check_page(self, page, context):
         logger.info("Checking page %s..." % page)
         page_context = {"currentpage":page.data, **context}
-        page.html_content(page_context) # This defines page.soup
+        html = page.html_content(page_context) # This defines page.soup
+        if page.soup is None:
+            # Pages without soup filters skip parsing their HTML when building
+            page.soup = html_soup(html, self.config["html_parser"])
         logger.debug("page.soup is... %s"%page.soup)
         # If the page has no content, soup can be empty and that's OK.
         if not page.soup.find_all():
@@ -0,0 +1,131 @@
+################################################################################
+## Dactyl Disk Cache
+##
+## A size-bounded, least-recently-used cache of JSON values stored as files,
+## so results can be reused from one build to the next.
+################################################################################
+
+import multiprocessing
+import shutil
+
+from dactyl.common import *
+
+class DiskCache:
+    """
+    Cache of JSON-serializable values in a folder on disk, one file per key.
+    Reading an entry marks it as recently used. When the entries add up to
+    more than max_size bytes, trim() deletes the least recently used ones.
+    """
+    def __init__(self, name, path, max_size):
+        self.name = name
+        self.path = path
+        self.max_size = max_size
+        # Shared memory, so the counts include forked worker processes
+        self.hits = multiprocessing.Value("i", 0)
+        self.misses = multiprocessing.Value("i", 0)
+
+    @staticmethod
+    def make_key(*inputs):
+        """
+        Return a cache key for the given JSON-like inputs, or None if they
+        can't be hashed consistently.
+        """
+        return hash_data(inputs)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key+".json")
+
+    def get(self, key):
+        """
+        Return the cached value for the key, or None if it isn't cached.
+        """
+        path = self.entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.count(self.misses)
+            return None
+        self.count(self.hits)
+        return value
+
+    def set(self, key, value):
+        """
+        Save a value to the cache. Failing to write it is only a warning,
+        since the cache is just an optimization.
+        """
+        path = self.entry_path(key)
+        # Write to a temp file and move it into place so other processes
+        # never read a partial entry.
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Couldn't write to %s cache: %s" % (self.name, e))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def count(counter):
+        with counter.get_lock():
+            counter.value += 1
+
+    def trim(self):
+        """
+        Delete the least recently used entries until the cache fits in its
+        maximum size.
+        """
+        entries = []
+        total_size = 0
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        entries.sort()
+        removed = 0
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+        if removed:
+            logger.debug("removed %d old entries from %s cache" %
+                         (removed, self.name))
+
+    def clear(self):
+        """
+        Delete all entries from the cache.
+        """
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+    def reset_stats(self):
+        self.hits.value = 0
+        self.misses.value = 0
+
+    def report(self):
+        """
+        Log how many lookups the cache answered.
+        """
+        hits = self.hits.value
+        total = hits + self.misses.value
+        if not total:
+            return
+        logger.info("%s cache: %d hits, %d misses (%d%% hit rate)" %
+                    (self.name, hits, total - hits, round(100 * hits / total)))
@@ -11,23 +11,27 @@ import re
 import logging
 from urllib.parse import quote as urlescape
 
-BADGE_REGEX = re.compile("BADGE_(BRIGHTGREEN|GREEN|YELLOWGREEN|YELLOW|ORANGE|RED|LIGHTGREY|BLUE|[0-9A-Fa-f]{6})")
+from dactyl.filter_pipeline import walk_soup
+from dactyl.markdown_filters import Element, raw_link, has_raw_html, \
+        headers_contain, tree_string, tree_text, tree_escape
 
-def filter_soup(soup, **kwargs):
-    """replace underscores with dashes in h1,h2,etc. for backwards compatibility"""
+BADGE_REGEX = re.compile("BADGE_(BRIGHTGREEN|GREEN|YELLOWGREEN|YELLOW|ORANGE|RED|LIGHTGREY|BLUE|[0-9A-Fa-f]{6})")
 
-    badge_links = soup.find_all(name="a", title=BADGE_REGEX)
+def soup_visitors(soup, **kwargs):
+    """turn links with a BADGE_<color> title into shields.io badges"""
 
-    for b in badge_links:
+    def make_badge(b):
+        if not BADGE_REGEX.search(b.get("title", "")):
+            return
         badge_label = b.string
         if not badge_label:
             badge_label = "".join(b.strings)
         if not badge_label:
             logging.warning("Badge link with no string: %s" % b)
-            continue
+            return
         if ":" not in badge_label:
             logging.warning("Badge link specified with no ':' in link: %s" % b.string)
-            continue
+            return
 
         badge_color = BADGE_REGEX.match(b["title"]).group(1).lower()
         badge_left, badge_right = [urlescape(s.strip()).replace("-","--")
@@ -42,3 +46,45 @@ def filter_soup(soup, **kwargs):
         b["title"] = badge_label
         if not b["href"]:
             del b["href"]
+    return {"a": make_badge}
+
+def markdown_visitors(root, md, **kwargs):
+    """
+    Like soup_visitors(), for the tree that Python-Markdown makes. Pages
+    with raw <a> elements, or links in headers, use soup_visitors() instead.
+    """
+    if has_raw_html(md, raw_link) or headers_contain(root, "a"):
+        return None
+
+    def make_badge(b):
+        if not BADGE_REGEX.search(b.get("title", "")):
+            return
+        badge_label = tree_string(md, b)
+        if not badge_label:
+            badge_label = tree_text(md, b)
+        if not badge_label:
+            logging.warning("Badge link with no string: %s" % b)
+            return
+        if ":" not in badge_label:
+            logging.warning("Badge link specified with no ':' in link: %s" % tree_string(md, b))
+            return
+
+        badge_color = BADGE_REGEX.match(b.attrib["title"]).group(1).lower()
+        badge_left, badge_right = [urlescape(s.strip()).replace("-","--")
+                                   for s in badge_label.split(":", 1)]
+        badge_url = "https://img.shields.io/badge/%s-%s-%s.svg" % (
+                    badge_left, badge_right, badge_color)
+
+        img = Element("img", src=badge_url, alt=tree_escape(badge_label))
+        img.set("class", "dactyl_badge")
+        del b[:]
+        b.text = None
+        b.append(img)
+        b.set("title", tree_escape(badge_label))
+        if not b.attrib["href"]:
+            del b.attrib["href"]
+    return {"a": make_badge}
+
+def filter_soup(soup, **kwargs):
+    """turn links with a BADGE_<color> title into shields.io badges"""
+    walk_soup(soup, [("badges", soup_visitors(soup, **kwargs))])
@@ -8,14 +8,41 @@
 ################################################################################
 import re
 
-def filter_soup(soup, logger=None, **kwargs):
+from dactyl.filter_pipeline import walk_soup
+from dactyl.markdown_filters import raw_link, has_raw_html, headers_contain, \
+        tree_string, tree_escape, class_list
+
+def soup_visitors(soup, logger=None, **kwargs):
     """make links ending in > render like buttons"""
-    buttonlinks = soup.find_all("a", string=re.compile("(&gt;|>)$"))
-    # logger.debug(f"Button links found: {buttonlinks}")
-    for link in buttonlinks:
+    button_regex = re.compile("(&gt;|>)$")
+    def buttonize(link):
+        if not link.string or not button_regex.search(link.string):
+            return
         link.string=link.string[:-1].strip()
 
         oldclass = link.get('class',[])
         if type(oldclass) == str:
             oldclass = [oldclass]
         link['class'] = oldclass + ['btn', 'btn-primary']
+    return {"a": buttonize}
+
+def markdown_visitors(root, md, **kwargs):
+    """
+    Like soup_visitors(), for the tree that Python-Markdown makes. Pages
+    with raw <a> elements, or links in headers, use soup_visitors() instead.
+    """
+    if has_raw_html(md, raw_link) or headers_contain(root, "a"):
+        return None
+    button_regex = re.compile("(&gt;|>)$")
+    def buttonize(link):
+        string = tree_string(md, link)
+        if not string or not button_regex.search(string):
+            return
+        del link[:]
+        link.text = tree_escape(string[:-1].strip())
+        link.set("class", " ".join(class_list(link) + ['btn', 'btn-primary']))
+    return {"a": buttonize}
+
+def filter_soup(soup, **kwargs):
+    """make links ending in > render like buttons"""
+    walk_soup(soup, [("buttonize", soup_visitors(soup, **kwargs))])
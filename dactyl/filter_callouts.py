@@ -21,7 +21,12 @@ DEFAULT_CALLOUT_CLASS = "dactyl-callout"
 
 from bs4.element import Tag
 
-def filter_soup(soup, currentpage={}, config={}, **kwargs):
+from dactyl.filter_pipeline import walk_soup
+from dactyl.markdown_filters import raw_html, has_raw_html, parent_map, tree_string
+
+RAW_CALLOUT_REGEX = re.compile(r"<(strong|em)\b", re.I)
+
+def soup_visitors(soup, currentpage={}, config={}, **kwargs):
     """
     Find patterns that look like callouts, for example **Note:**, and add
     callout classes to their parent elements (usually <p>)
@@ -35,8 +40,9 @@ def filter_soup(soup, currentpage={}, config={}, **kwargs):
                         config.get(CALLOUT_CLASS_FIELD,
                         DEFAULT_CALLOUT_CLASS))
 
-    callouts = soup.find_all(name=["strong","em"], string=callout_intro)
-    for c in callouts:
+    def mark_callout(c):
+        if not c.string or not callout_intro.search(c.string):
+            return
         if not c.previous_sibling: #This callout starts a block
             callout_type = c.string.replace(":","").lower()
             if callout_type in callout_classes:
@@ -48,3 +54,60 @@ def filter_soup(soup, currentpage={}, config={}, **kwargs):
                 else:
                     callout_el = c.parent
                 callout_el["class"] = [callout_base_class, callout_type]
+    return {"strong": mark_callout, "em": mark_callout}
+
+def markdown_visitors(root, md, currentpage={}, config={}, **kwargs):
+    """
+    Like soup_visitors(), for the tree that Python-Markdown makes. Callouts
+    in raw HTML aren't part of the tree, so pages with any raw <strong> or
+    <em> elements use soup_visitors() instead.
+    """
+    if has_raw_html(md, RAW_CALLOUT_REGEX):
+        return None
+    callout_classes = currentpage.get(CALLOUT_TYPES_FIELD,
+                        config.get(CALLOUT_TYPES_FIELD,
+                        DEFAULT_CALLOUT_TYPES))
+    callout_intro = re.compile(r"("+"|".join(callout_classes)+"):?$", re.I)
+    callout_base_class = currentpage.get(CALLOUT_CLASS_FIELD,
+                        config.get(CALLOUT_CLASS_FIELD,
+                        DEFAULT_CALLOUT_CLASS))
+    parents = None
+
+    def mark_callout(c):
+        nonlocal parents
+        string = tree_string(md, c)
+        if not string or not callout_intro.search(string):
+            return
+        if parents is None:
+            # Not until now, since other filters can move elements first
+            parents = parent_map(root)
+        parent = parents[c]
+        if not parent.text and parent[0] is c: #This callout starts a block
+            callout_type = string.replace(":","").lower()
+            if callout_type in callout_classes:
+                grandparent = parents.get(parent)
+                if grandparent is not None and grandparent.tag == "blockquote":
+                    # Raw HTML comments come before it as placeholders, but
+                    # they aren't elements
+                    siblings = list(grandparent)
+                    before = siblings[:siblings.index(parent)]
+                    starts_bq = all((raw_html(md, el) or "").startswith("<!--")
+                                    for el in before)
+                else:
+                    starts_bq = False
+                if starts_bq:
+                    # Special case for blockquotes, to allow multiline callouts.
+                    # First element of BQ must start with a callout keyword
+                    callout_el = grandparent
+                else:
+                    callout_el = parent
+                callout_el.set("class", "%s %s" % (callout_base_class,
+                                                  callout_type))
+    return {"strong": mark_callout, "em": mark_callout}
+
+def filter_soup(soup, **kwargs):
+    """
+    Find patterns that look like callouts, for example **Note:**, and add
+    callout classes to their parent elements (usually <p>)
+    """
+    walk_soup(soup, [("callouts", soup_visitors(soup, **kwargs))])
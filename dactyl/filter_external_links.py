@@ -11,7 +11,11 @@
 
 import re
 
-def filter_soup(soup, logger=None, **kwargs):
+from dactyl.filter_pipeline import walk_soup
+from dactyl.markdown_filters import Element, raw_link, has_raw_html, \
+        headers_contain, append_text, class_list
+
+def soup_visitors(soup, logger=None, **kwargs):
     """
     Adds an external link marker to external links
     and makes them open in new tabs.
@@ -19,10 +23,9 @@ def filter_soup(soup, logger=None, **kwargs):
 
     extern_regex = re.compile(r"^https?://")
 
-    links = soup.find_all("a", href=True)
-    for link in links:
+    def mark_external(link):
         # logger.debug(f"Link: {link}")
-        if extern_regex.match(link["href"]):
+        if extern_regex.match(link.get("href", "")):
             link["target"] = "_blank"
             ex_link_marker = soup.new_tag("i", attrs={
                     "class":"fa fa-external-link",
@@ -33,3 +36,32 @@ def filter_soup(soup, logger=None, **kwargs):
             if type(oldclass) == str:
                 oldclass = [oldclass]
             link['class'] = oldclass + ['external-link']
+    return {"a": mark_external}
+
+def markdown_visitors(root, md, **kwargs):
+    """
+    Like soup_visitors(), for the tree that Python-Markdown makes. Pages
+    with raw <a> elements, or links in headers, use soup_visitors() instead.
+    """
+    if has_raw_html(md, raw_link) or headers_contain(root, "a"):
+        return None
+
+    extern_regex = re.compile(r"^https?://")
+
+    def mark_external(link):
+        if extern_regex.match(link.get("href", "")):
+            link.set("target", "_blank")
+            ex_link_marker = Element("i", attrib={
+                    "class":"fa fa-external-link",
+                    "aria-hidden": "true"})
+            append_text(link, " ")
+            link.append(ex_link_marker)
+            link.set("class", " ".join(class_list(link) + ['external-link']))
+    return {"a": mark_external}
+
+def filter_soup(soup, **kwargs):
+    """
+    Adds an external link marker to external links
+    and makes them open in new tabs.
+    """
+    walk_soup(soup, [("external_links", soup_visitors(soup, **kwargs))])
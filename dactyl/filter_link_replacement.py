@@ -9,6 +9,8 @@
 
 import re
 
+from dactyl.filter_pipeline import walk_soup
+
 LINK_SUBS_FIELD = "link_subs"
 LINK_RE_SUBS_FIELD = "link_re_subs"
 PARAMETER_REPLACE_FIELD = "replace_parameter_links"
@@ -16,7 +18,11 @@ IMAGE_SUBS_FIELD = "image_subs"
 IMAGE_RE_SUBS_FIELD = "image_re_subs"
 IMAGE_LINK_REGEX = re.compile(r"^[^.]+\.(png|jpg|jpeg|gif|svg)", re.I)
 
-def filter_soup(soup, currentpage={}, target={}, pages=[], logger=None, **kwargs):
+modes = {
+    "filter_markdown": ["md"],
+}
+
+def soup_visitors(soup, currentpage={}, target={}, pages=[], logger=None, **kwargs):
     """
     Replaces links and image hrefs in the current page, based on a substitution
     map in the target or page settings. Also looks into values in the current
@@ -25,89 +31,93 @@ def filter_soup(soup, currentpage={}, target={}, pages=[], logger=None, **kwargs
     """
     globals()["logger"] = logger
     # currentpage already includes link subs inherited from the target
-    if LINK_SUBS_FIELD in currentpage:
-        link_subs = currentpage[LINK_SUBS_FIELD]
-
-        if (PARAMETER_REPLACE_FIELD in currentpage and
-                currentpage[PARAMETER_REPLACE_FIELD]):
-            substitute_parameter_links(currentpage, link_subs)
-        substitute_links(soup, link_subs)
-
-    if LINK_RE_SUBS_FIELD in currentpage:
-        link_re_subs = currentpage[LINK_RE_SUBS_FIELD]
-        re_sub_links(soup, link_re_subs)
-
-    if IMAGE_SUBS_FIELD in currentpage:
-        image_subs = currentpage[IMAGE_SUBS_FIELD]
-        substitute_images(soup, image_subs)
-        substitute_links(soup, image_subs)
-
-    if IMAGE_RE_SUBS_FIELD in currentpage:
-        image_re_subs = currentpage[IMAGE_RE_SUBS_FIELD]
-        re_sub_images(soup, image_re_subs)
-        re_sub_links(soup, image_re_subs)
-
-def substitute_links(soup, link_subs):
+    link_subs = currentpage.get(LINK_SUBS_FIELD)
+    link_re_subs = currentpage.get(LINK_RE_SUBS_FIELD)
+    image_subs = currentpage.get(IMAGE_SUBS_FIELD)
+    image_re_subs = currentpage.get(IMAGE_RE_SUBS_FIELD)
+    if (LINK_SUBS_FIELD in currentpage and
+            PARAMETER_REPLACE_FIELD in currentpage and
+            currentpage[PARAMETER_REPLACE_FIELD]):
+        substitute_parameter_links(currentpage, link_subs)
+
+    def replace_link(link):
+        if link.get("href") is None:
+            return
+        if LINK_SUBS_FIELD in currentpage:
+            substitute_link(link, link_subs)
+        if LINK_RE_SUBS_FIELD in currentpage:
+            re_sub_link(link, link_re_subs)
+        if IMAGE_SUBS_FIELD in currentpage:
+            substitute_link(link, image_subs)
+        if IMAGE_RE_SUBS_FIELD in currentpage:
+            re_sub_link(link, image_re_subs)
+
+    def replace_image(img):
+        if IMAGE_SUBS_FIELD in currentpage:
+            substitute_image(img, image_subs)
+        if IMAGE_RE_SUBS_FIELD in currentpage and img.get("src") is not None:
+            re_sub_image(img, image_re_subs)
+
+    return {"a": replace_link, "img": replace_image}
+
+def filter_soup(soup, **kwargs):
     """
-    Takes a map of needle:replacement strings and changes the href values of
-    <a> tags in the soup, so that any that start with the needle are changed to
-    start with the replacement instead (preserving the remainder).
+    Replaces links and image hrefs in the current page, based on a substitution
+    map in the target or page settings.
     """
-    links = soup.find_all("a", href=True)
-    for link in links:
-        for needle, replacement in link_subs.items():
-            if link["href"][:len(needle)] == needle:
-                new_href = replacement + link["href"][len(needle):]
-                logger.info("... replacing link '%s' with '%s'" %
-                            (link["href"], new_href) )
-                link["href"] = new_href
+    walk_soup(soup, [("link_replacement", soup_visitors(soup, **kwargs))])
 
-def substitute_images(soup, image_subs):
+def substitute_link(link, link_subs):
     """
-    Takes a map of needle:replacement strings and changes the src of <img>
-    tags in the soup so that any that match the needle are changed to use the
-    replacement instead.
+    Takes a map of needle:replacement strings and changes the href value of an
+    <a> tag, so that if it starts with the needle it's changed to start with
+    the replacement instead (preserving the remainder).
     """
-    images = soup.find_all("img")
-    for img in images:
-        for needle, replacement in image_subs.items():
-            if needle == img["src"]:
-                logger.info("... replacing image '%s' with '%s'" %
-                            (img["src"], replacement) )
-                img["src"] = replacement
+    for needle, replacement in link_subs.items():
+        if link["href"][:len(needle)] == needle:
+            new_href = replacement + link["href"][len(needle):]
+            logger.info("... replacing link '%s' with '%s'" %
+                        (link["href"], new_href) )
+            link["href"] = new_href
+
+def substitute_image(img, image_subs):
+    """
+    Takes a map of needle:replacement strings and changes the src of an <img>
+    tag so that if it matches the needle it's changed to use the replacement
+    instead.
+    """
+    for needle, replacement in image_subs.items():
+        if needle == img["src"]:
+            logger.info("... replacing image '%s' with '%s'" %
+                        (img["src"], replacement) )
+            img["src"] = replacement
 
 
-def re_sub_images(soup, image_re_subs):
+def re_sub_image(img, image_re_subs):
     """
     Takes a map of regular expressions to regular-expression replacements and
-    changes the src of any <img> tags in the soup by doing regular-expression
-    match/replace.
+    changes the src of an <img> tag by doing regular-expression match/replace.
     """
-    images = soup.find_all("img", src=True)
-    for img in images:
-        for regex,replace_pattern in image_re_subs.items():
-            m = re.match(regex, img["src"])
-            if m:
-                new_path = re.sub(regex, replace_pattern, img["src"])
-                logger.info("... replacing image '%s' with '%s'" %
-                            (img["src"], new_path) )
-                img["src"] = new_path
-
-def re_sub_links(soup, link_re_subs):
+    for regex,replace_pattern in image_re_subs.items():
+        m = re.match(regex, img["src"])
+        if m:
+            new_path = re.sub(regex, replace_pattern, img["src"])
+            logger.info("... replacing image '%s' with '%s'" %
+                        (img["src"], new_path) )
+            img["src"] = new_path
+
+def re_sub_link(link, link_re_subs):
     """
     Takes a map of regular expressions to regular-expression replacements and
-    changes the href of any <a> tags in the soup by doing regular-expression
-    match/replace.
+    changes the href of an <a> tag by doing regular-expression match/replace.
     """
-    links = soup.find_all("a", href=True)
-    for link in links:
-        for regex,replace_pattern in link_re_subs.items():
-            m = re.match(regex, link["href"])
-            if m:
-                new_path = re.sub(regex, replace_pattern, link["href"])
-                logger.info("... replacing link '%s' with '%s'" %
-                            (link["href"], new_path) )
-                link["href"] = new_path
+    for regex,replace_pattern in link_re_subs.items():
+        m = re.match(regex, link["href"])
+        if m:
+            new_path = re.sub(regex, replace_pattern, link["href"])
+            logger.info("... replacing link '%s' with '%s'" %
+                        (link["href"], new_path) )
+            link["href"] = new_path
 
 RESERVED_PAGE_KEYS = [
     "html",
@@ -180,9 +190,6 @@ def filter_markdown(md, mode="html", currentpage={}, logger=None, **kwargs):
     since we won't have an opportunity to do it on the HTML output.
     """
     globals()["logger"] = logger
-    if mode != "md":
-        return md
-
     if LINK_SUBS_FIELD in currentpage:
         link_subs = currentpage[LINK_SUBS_FIELD]
         md = substitute_md_links(md, link_subs)
@@ -9,32 +9,38 @@
 import re
 import logging
 
+from dactyl.filter_pipeline import walk_soup
+from dactyl.markdown_filters import Element, raw_html, set_raw_html, \
+        parent_map, class_list, tree_text, tree_escape, append_text, \
+        remove_element
+
 MC_START_REGEX = re.compile(r"<!--\s*MULTICODE_BLOCK_START\s*-->")
 MC_END_REGEX = re.compile(r"<!--\s*MULTICODE_BLOCK_END\s*-->")
 
+modes = {
+    "filter_html": ["html", "pdf", "es"],
+    "markdown_visitors": ["html", "pdf", "es"],
+    "soup_visitors": ["html"],
+}
+
 def filter_html(html, mode="html", **kwargs):
     """
     Turn multicode comments into a div (after markdown inside is parsed). You
     can use this div for styling even in PDF format. Doesn't apply to Markdown
     since most parsers won't parse markdown inside HTML blocks.
     """
-
-    if mode == "md":
-        return html
-
     html = re.sub(MC_START_REGEX, "<div class='multicode'>", html)
     html = re.sub(MC_END_REGEX, "</div>", html)
     return html
 
-def filter_soup(soup, mode="html", **kwargs):
+def soup_visitors(soup, mode="html", **kwargs):
     """Turn a multicode block into the correct syntax for minitabs, but only
        in the HTML version."""
-    if mode != "html":
-        return
-
-    multicodes = soup.find_all(class_="multicode")
     index1 = 0
-    for cb_area in multicodes:
+    def make_tabs(cb_area):
+        nonlocal index1
+        if "multicode" not in cb_area.get("class", []):
+            return
         cb_area["id"] = "code-%d" % index1
 
         codetabs_ul = soup.new_tag("ul")
@@ -71,3 +77,149 @@ def filter_soup(soup, mode="html", **kwargs):
             index2 += 1
 
         index1 += 1
+    return {"[class]": make_tabs}
+
+def markdown_visitors(root, md, mode="html", **kwargs):
+    """
+    Like filter_html() and soup_visitors() together, for the tree that
+    Python-Markdown makes. The multicode comments and highlighted code blocks
+    are raw HTML, so they're placeholders in the tree. Pages with other raw
+    HTML in multicode blocks, or with multicode comments or classes in other
+    raw HTML, use filter_html() and soup_visitors() instead.
+    """
+    # Find the comments' placeholders, which have to be in pairs, in order
+    blocks = []
+    parents = parent_map(root)
+    start = None
+    num_comments = 0
+    for el in root.iter():
+        html = raw_html(md, el)
+        if html is None:
+            continue
+        if MC_START_REGEX.fullmatch(html.strip()):
+            if start is not None:
+                return None
+            start = el
+        elif MC_END_REGEX.fullmatch(html.strip()):
+            if start is None or parents[start] is not parents[el]:
+                return None
+            blocks.append((parents[el], start, el))
+            start = None
+        else:
+            continue
+        num_comments += 1
+    if start is not None:
+        return None
+    for html in md.htmlStash.rawHtmlBlocks:
+        html = str(html)
+        if MC_START_REGEX.search(html) or MC_END_REGEX.search(html):
+            num_comments -= 1
+        elif "multicode" in html or ("codehilite" in html and
+                not html.startswith('<div class="codehilite">')):
+            return None
+    if num_comments:
+        return None
+    for parent, start, end in blocks:
+        siblings = list(parent)
+        contents = siblings[siblings.index(start)+1:siblings.index(end)]
+        for el in contents:
+            for child in el.iter():
+                html = raw_html(md, child)
+                if html is not None and not is_codehilite(md, child):
+                    return None
+
+    # Turn each pair of comments into a div
+    for parent, start, end in blocks:
+        siblings = list(parent)
+        contents = siblings[siblings.index(start)+1:siblings.index(end)]
+        start_html = raw_html(md, start)
+        end_html = raw_html(md, end)
+        start_m = MC_START_REGEX.search(start_html)
+        end_m = MC_END_REGEX.search(end_html)
+
+        div = Element("div", attrib={"class": "multicode"})
+        div.text = start_html[start_m.end():] + (start.tail or "")
+        for el in contents:
+            parent.remove(el)
+            div.append(el)
+        append_text(div, end_html[:end_m.start()])
+        div.tail = end_html[end_m.end():] + (end.tail or "")
+        # Anything before the start comment stays before the div
+        start.tail = start_html[:start_m.start()]
+        remove_element(parent, start)
+        parent.insert(siblings.index(start), div)
+        parent.remove(end)
+
+    if mode != "html":
+        return {}
+
+    index1 = 0
+    def make_tabs(cb_area):
+        nonlocal index1
+        if "multicode" not in class_list(cb_area):
+            return
+        cb_area.set("id", "code-%d" % index1)
+
+        codetabs_ul = Element("ul")
+        codetabs_ul.set("class", "codetabs")
+        codetabs_ul.tail = cb_area.text
+        cb_area.text = None
+        cb_area.insert(0,codetabs_ul)
+
+        area_parents = parent_map(cb_area)
+        pres = [el for el in cb_area.iter() if el is not cb_area and
+                ("codehilite" in class_list(el) or is_codehilite(md, el))]
+        index2 = 0
+        for pre in pres:
+            #make a unique ID for this code sample
+            linkid = "code-%d-%d" % (index1, index2)
+
+            #wrap this code sample in an ID'd div
+            code_sample_wrapper = Element("div", id=linkid)
+            code_sample_wrapper.set("class", "code_sample")
+            code_sample_wrapper.set("style", "position: static;")
+            pre_parent = area_parents[pre]
+            siblings = list(pre_parent)
+            code_sample_wrapper.tail = pre.tail
+            html = raw_html(md, pre)
+            if html is not None:
+                # The whitespace after the code block goes after the wrapper
+                set_raw_html(md, pre, html.rstrip())
+                code_sample_wrapper.tail = (html[len(html.rstrip()):] +
+                                            (pre.tail or ""))
+            pre.tail = None
+            pre_parent[siblings.index(pre)] = code_sample_wrapper
+            code_sample_wrapper.append(pre)
+
+            #add a link to the tabs ul
+            linkback = Element("a", href=("#%s" % linkid))
+            linkback_li = Element("li")
+            linkback_li.append(linkback)
+            codetabs_ul.append(linkback_li)
+
+            #find the text label for this sample
+            prev_p = None
+            for sibling in reversed(siblings[:siblings.index(pre)]):
+                if sibling.tag == "p" and raw_html(md, sibling) is None:
+                    prev_p = sibling
+                    break
+            try:
+                label = tree_text(md, next(prev_p.iter("em")))
+            except (AttributeError, StopIteration):
+                label = "Code Sample %d-%d" % (index1, index2)
+            linkback.text = tree_escape(label)
+            remove_element(pre_parent, prev_p)
+
+            index2 += 1
+
+        index1 += 1
+    return {"[class]": make_tabs}
+
+def is_codehilite(md, el):
+    """True if el is a placeholder for a highlighted code block"""
+    html = raw_html(md, el)
+    return html is not None and html.startswith('<div class="codehilite">')
+
+def filter_soup(soup, **kwargs):
+    """Turn a multicode block into the correct syntax for minitabs."""
+    walk_soup(soup, [("multicode_tabs", soup_visitors(soup, **kwargs))])
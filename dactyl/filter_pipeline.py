@@ -0,0 +1,153 @@
+################################################################################
+## Dactyl Filter Pipeline
+##
+## The functions and exports of a list of filters, looked up once and shared
+## by all the pages that use the same filters.
+################################################################################
+
+from dactyl.common import *
+
+# Functions that filters can define, in the order Dactyl runs them. A filter
+# with soup_visitors doesn't need its filter_soup, if it has one.
+FILTER_HOOKS = ("filter_markdown", "markdown_visitors", "filter_html",
+                "soup_visitors", "filter_soup")
+
+class FilterPipeline:
+    """
+    The filter functions to run on a page, resolved from a list of
+    (name, module) pairs for loaded filters. A filter can limit the modes its
+    functions apply to with a "modes" dictionary, for example:
+
+        modes = {"filter_soup": ["html"]}
+
+    Functions that aren't in the dictionary apply in all modes.
+    """
+    def __init__(self, filters):
+        self.names = [name for name, module in filters]
+        self.hooks = {hook: [] for hook in FILTER_HOOKS}
+        # Filters' soup_visitors and filter_soup functions, in filter order
+        self.soup_hooks = []
+        self.exports = {}
+        for name, module in filters:
+            modes = getattr(module, "modes", {})
+            for hook in FILTER_HOOKS:
+                func = getattr(module, hook, None)
+                if func is None:
+                    continue
+                if hook == "filter_soup" and hasattr(module, "soup_visitors"):
+                    continue
+                self.hooks[hook].append((name, func, modes.get(hook)))
+                if hook in ("soup_visitors", "filter_soup"):
+                    self.soup_hooks.append((name, hook, func, modes.get(hook)))
+            for key, val in getattr(module, "export", {}).items():
+                if key in self.exports:
+                    logger.warning("Export '{key}' from filter {filter_name} overwrites previous value. Another filter exported the same key?".format(key=key, filter_name=name))
+                self.exports[key] = val
+        # (hook, mode) -> [(name, function), ...]
+        self.stages = {}
+
+    def stage(self, hook, mode, skip=()):
+        """
+        Return (name, function) pairs for the filters' functions of one kind
+        (such as "filter_html") that apply in the given mode, leaving out the
+        filters named in skip.
+        """
+        key = (hook, mode, tuple(skip))
+        if key not in self.stages:
+            self.stages[key] = [(name, func) for name, func, modes
+                                in self.hooks[hook]
+                                if (modes is None or mode in modes)
+                                and name not in skip]
+        return self.stages[key]
+
+    def markdown_stage(self, mode, selected):
+        """
+        Return (name, function) pairs for the markdown_visitors of filters
+        that can run while converting Markdown: those named in selected that
+        come before any filter with other HTML or soup functions to run in
+        this mode, so that filters still run in the same order.
+        """
+        key = ("markdown", mode, tuple(selected))
+        if key not in self.stages:
+            visitors = dict(self.stage("markdown_visitors", mode))
+            later = set(name for hook in ("filter_html", "soup_visitors",
+                                          "filter_soup")
+                        for name, func in self.stage(hook, mode))
+            stage = []
+            for name in self.names:
+                if name in selected and name in visitors:
+                    stage.append((name, visitors[name]))
+                elif name in later:
+                    break
+            self.stages[key] = stage
+        return self.stages[key]
+
+    def soup_steps(self, mode, skip=()):
+        """
+        Return the steps for running soup filters in the given mode, as a list
+        of (hook, [(name, function), ...]) pairs, leaving out the filters
+        named in skip. Filters with soup_visitors that come one after another
+        share a step, so the soup is only walked once for all of them. Each
+        filter_soup function is a step by itself.
+        """
+        key = ("soup", mode, tuple(skip))
+        if key not in self.stages:
+            steps = []
+            for name, hook, func, modes in self.soup_hooks:
+                if (modes is not None and mode not in modes) or name in skip:
+                    continue
+                if hook == "soup_visitors" and steps and steps[-1][0] == hook:
+                    steps[-1][1].append((name, func))
+                else:
+                    steps.append((hook, [(name, func)]))
+            self.stages[key] = steps
+        return self.stages[key]
+
+def walk_soup(soup, visitors, on_error=None):
+    """
+    Walk a soup once, calling filters' visitor functions on its elements.
+    visitors is a list of (filter name, {selector: function}) pairs, in the
+    order to call them. A selector is a tag name, such as "a", or an attribute
+    name in brackets, such as "[href]", for elements with that attribute.
+
+    The elements that are in the soup when the walk starts are visited in
+    document order, and each one is passed to every matching function before
+    the next one, unless a function removes it from the soup. If a function
+    raises an exception, the walk calls on_error(filter name, exception) and
+    skips the rest of that filter's functions, or raises it if on_error is
+    None.
+    """
+    by_tag = {}
+    by_attr = []
+    for i, (name, selectors) in enumerate(visitors):
+        for selector, func in selectors.items():
+            if selector[:1] == "[" and selector[-1:] == "]":
+                by_attr.append((selector[1:-1], i, name, func))
+            else:
+                by_tag.setdefault(selector, []).append((i, name, func))
+
+    failed = set()
+    removed = set() # ids of elements that functions took out of the soup
+    for el in soup.find_all(True):
+        if el.parent is None:
+            continue
+        if removed and any(id(parent) in removed for parent in el.parents):
+            continue
+        calls = by_tag.get(el.name, [])
+        attr_calls = [(i, name, func) for attr, i, name, func in by_attr
+                      if attr in el.attrs]
+        if attr_calls:
+            calls = sorted(calls + attr_calls, key=lambda call: call[0])
+        for i, name, func in calls:
+            if name in failed:
+                continue
+            try:
+                func(el)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                failed.add(name)
+                on_error(name, e)
+            if el.parent is None:
+                removed.add(id(el))
+                break
@@ -9,9 +9,16 @@
 ################################################################################
 import re
 
-def filter_soup(soup, **kwargs):
+from dactyl.filter_pipeline import walk_soup
+
+def soup_visitors(soup, **kwargs):
     """replace underscores with dashes in h1,h2,etc. for backwards compatibility"""
-    headers = soup.find_all(name=re.compile("h[0-9]"), id=True)
-    for h in headers:
-        if "_" in h["id"]:
+    header_regex = re.compile("h[0-9]")
+    def standardize_id(h):
+        if header_regex.search(h.name) and "_" in h["id"]:
             h["id"] = h["id"].replace("_", "-")
+    return {"[id]": standardize_id}
+
+def filter_soup(soup, **kwargs):
+    """replace underscores with dashes in h1,h2,etc. for backwards compatibility"""
+    walk_soup(soup, [("standardize_header_ids", soup_visitors(soup, **kwargs))])
@@ -19,6 +19,8 @@
 import re
 from logging import warning
 
+from dactyl.filter_pipeline import walk_soup
+
 # match anything starting with XREF:/xref:, split by the # if there is one
 # dropping any excess whitespace
 xref_regex = re.compile(r"^\s*xref:\s*(?P<xref_file>[^#]+)(?P<xref_frag>#\S+)?\s*?$", re.I)
@@ -26,86 +28,109 @@ xref_regex = re.compile(r"^\s*xref:\s*(?P<xref_file>[^#]+)(?P<xref_frag>#\S+)?\s
 class BadXref(Exception):
     pass
 
-def find_file_in_target(fname, targetname, config):
-    if fname[-3:] == ".md":
-        # look by markdown file first
+class XrefIndex:
+    """
+    Lookups of pages by md path, md filename, and html filename, and of
+    targets by name, so resolving an xref doesn't search every page in the
+    config. Built once per config load; see xref_index().
+    """
+    def __init__(self, config):
+        self.by_md = {}
+        self.by_md_name = {}
+        self.by_html = {}
         for page in config["pages"]:
-            if "md" not in page:
-                continue
-            elif ("/" in fname and page["md"] == fname # try to match md file by exact path
-                    and targetname in page.get("targets",[]) # the page appears in this target
-                    and page.get("html","") ): # and finally, the page has an html filename
-                return page
-            elif ( page["md"].split("/")[-1] == fname # match md filename in any directory
-                    and targetname in page.get("targets",[])
-                    and page.get("html","") ):
-                return page
+            if "md" in page:
+                self.by_md.setdefault(page["md"], []).append(page)
+                self.by_md_name.setdefault(page["md"].split("/")[-1],
+                                           []).append(page)
+            if "html" in page:
+                self.by_html.setdefault(page["html"], []).append(page)
 
-    for page in config["pages"]:
-        if "html" not in page:
-            continue
-        elif page["html"] != fname:
-            continue
-        if targetname in page.get("targets", []):
-            return page
-    else:
-        return False
+        self.targets = {}
+        for t in config.get("targets", []):
+            if "name" in t:
+                self.targets.setdefault(t["name"], t)
 
-def find_file_in_any_target(fname, config):
-    if fname[-3:] == ".md":
-        #print("finding in any target by md")
-        # look by markdown file first
-        for page in config["pages"]:
-            if "md" not in page:
-                continue
-            elif ("/" in fname and page["md"] == fname # try to match md file by exact path
-                   and page.get("targets",[]) # page must appear in some target
-                   and page.get("html","") ): # and page must have an html filename
-                return page
-            elif ( page["md"].split("/")[-1] == fname # match md filename in any folder
-                   and page.get("targets",[])
-                   and page.get("html","") ):
-                return page
+        # Results by (fname, targetname), with None for any target
+        self.found = {}
 
-    # look by HTML file if it didn't end in .md or if we didn't find it yet
-    for page in config["pages"]:
-        if "html" not in page:
-            continue
-        elif page["html"] == fname and page.get("targets", []):
-            #page has to have "some" target(s) for it to be worthwhile
-            return page
-    else:
+    def find(self, fname, targetname=None):
+        """
+        Return the first page, in config order, that matches fname and is in
+        the named target (or any target, if targetname is None), or False.
+        """
+        key = (fname, targetname)
+        if key not in self.found:
+            self.found[key] = self.search(fname, targetname)
+        return self.found[key]
+
+    def search(self, fname, targetname):
+        if targetname is None:
+            in_target = lambda page: page.get("targets", [])
+        else:
+            in_target = lambda page: targetname in page.get("targets", [])
+
+        if fname[-3:] == ".md":
+            # look by markdown file first: by exact path if fname has a
+            # folder, or else by filename in any folder
+            by_md = self.by_md if "/" in fname else self.by_md_name
+            for page in by_md.get(fname, []):
+                if in_target(page) and page.get("html", ""):
+                    return page
+
+        # look by HTML file if it didn't end in .md or if we didn't find it yet
+        for page in self.by_html.get(fname, []):
+            if in_target(page):
+                return page
         return False
 
+def xref_index(config):
+    """
+    Return the XrefIndex for the config, building it the first time.
+    """
+    if not hasattr(config, "xref_index"):
+        # Not a DactylConfig; nowhere to keep it
+        return XrefIndex(config)
+    if config.xref_index is None:
+        config.xref_index = XrefIndex(config)
+    return config.xref_index
+
+def find_file_in_target(fname, targetname, config):
+    return xref_index(config).find(fname, targetname)
+
+def find_file_in_any_target(fname, config):
+    # page has to have "some" target(s) for it to be worthwhile
+    return xref_index(config).find(fname)
+
 def lookup_display_name(targetname, config):
-    for t in config["targets"]:
-        if "name" in t and t["name"] == targetname:
-            display_name = "%s %s %s %s %s" % (
-                t.get("display_name", ""),
-                t.get("product", ""),
-                t.get("version", ""),
-                t.get("guide", ""),
-                t.get("subtitle", "")
-            )
-            if display_name.strip():
-                return display_name
-            else:
-                warning("Target has no display_name/product/version/guide: %s" % targetname)
-                return targetname
-    else:
+    t = xref_index(config).targets.get(targetname)
+    if t is None:
         warning("Target not found: %s" % targetname)
         return targetname
+    display_name = "%s %s %s %s %s" % (
+        t.get("display_name", ""),
+        t.get("product", ""),
+        t.get("version", ""),
+        t.get("guide", ""),
+        t.get("subtitle", "")
+    )
+    if display_name.strip():
+        return display_name
+    else:
+        warning("Target has no display_name/product/version/guide: %s" % targetname)
+        return targetname
 
-def filter_soup(soup, target={"name":""}, currentpage={},
+def soup_visitors(soup, target={"name":""}, currentpage={},
         config={"pages":[]}, logger=None, **kwargs):
     """Look for cross-references and replace them with not-hyperlinks if they
        don't exist in the current target."""
 
     prefix = target.get("prefix", "")
-    xrefs = soup.find_all(href=xref_regex)
 
-    for xref in xrefs:
+    def resolve_xref(xref):
         m = xref_regex.match(xref.attrs["href"])
+        if not m:
+            return
         xref_file = m.group("xref_file")
         xref_frag = m.group("xref_frag") or ""
 
@@ -164,3 +189,9 @@ def filter_soup(soup, target={"name":""}, currentpage={},
             if not xref_contents:
                 xref_label = xref_page.get("name", "")
                 xref.string = xref_label
+    return {"[href]": resolve_xref}
+
+def filter_soup(soup, **kwargs):
+    """Look for cross-references and replace them with not-hyperlinks if they
+       don't exist in the current target."""
+    walk_soup(soup, [("xrefs", soup_visitors(soup, **kwargs))])
@@ -0,0 +1,124 @@
+################################################################################
+## Template Fragment Cache
+##
+## A Jinja extension that adds a {% cache %} tag, so parts of templates that
+## render the same way on many pages are only rendered once per build, or
+## once across builds.
+################################################################################
+
+import multiprocessing
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from dactyl.common import *
+from dactyl.disk_cache import DiskCache
+from dactyl.version import __version__
+
+class FragmentCache:
+    """
+    Rendered template fragments from {% cache %} tags, kept in memory for the
+    current build and, if disk_cache is a DiskCache, saved there for later
+    builds too. version is a function that returns a hash of the settings,
+    which goes into the keys of saved fragments along with Dactyl's version,
+    so they aren't reused after either changes.
+    """
+    name = "template fragment"
+
+    def __init__(self, disk_cache=None, version=None):
+        self.disk_cache = disk_cache
+        self.version = version
+        self.fragments = {}
+        # Shared memory, so the counts include forked worker processes
+        self.hits = multiprocessing.Value("i", 0)
+        self.misses = multiprocessing.Value("i", 0)
+
+    def get(self, key):
+        """
+        Return the rendered fragment for the key, or None if it isn't cached.
+        """
+        html = self.fragments.get(key)
+        if html is None and self.disk_cache:
+            html = self.disk_cache.get(self.disk_key(key))
+            if html is not None:
+                self.fragments[key] = html
+        DiskCache.count(self.misses if html is None else self.hits)
+        return html
+
+    def set(self, key, html):
+        self.fragments[key] = html
+        if self.disk_cache:
+            self.disk_cache.set(self.disk_key(key), html)
+
+    def disk_key(self, key):
+        # Built-in templates change with new versions of Dactyl
+        version = self.version() if self.version else ""
+        return hash_text(key + version + __version__)
+
+    def forget(self):
+        """
+        Forget the fragments from the last build, since pages and other
+        inputs may have changed. Saved fragments are still on disk.
+        """
+        self.fragments = {}
+
+    def reset_stats(self):
+        self.hits.value = 0
+        self.misses.value = 0
+
+    def report(self):
+        """
+        Log how many {% cache %} tags used an already-rendered fragment.
+        """
+        hits = self.hits.value
+        total = hits + self.misses.value
+        if not total:
+            return
+        logger.info("%s cache: %d hits, %d misses (%d%% hit rate)" %
+                    (self.name, hits, total - hits, round(100 * hits / total)))
+
+    def trim(self):
+        if self.disk_cache:
+            self.disk_cache.trim()
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Adds a {% cache key, vary_on... %}...{% endcache %} tag to templates. The
+    tag renders its contents the first time it's used with a given key and
+    vary_on values, and uses the same HTML after that. The key and vary_on
+    values can be any JSON-like values, such as strings or lists of pages.
+    Fragments are also keyed by the template's name and the tag's contents,
+    so editing a template doesn't reuse fragments from before the change.
+    Set the environment's fragment_cache to a FragmentCache to store the
+    fragments in; otherwise, the tag renders its contents every time.
+    """
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        # The parsed nodes' repr includes all of the block's text and code
+        source = [nodes.Const(parser.name), nodes.Const(hash_text(repr(body)))]
+        return nodes.CallBlock(
+                self.call_method("_cache", source + [nodes.List(args)]),
+                [], [], body).set_lineno(lineno)
+
+    def _cache(self, name, checksum, args, caller):
+        cache = self.environment.fragment_cache
+        key = hash_data([name, checksum, args]) if cache is not None else None
+        if key is None:
+            return caller()
+        html = cache.get(key)
+        if html is None:
+            html = str(caller())
+            cache.set(key, html)
+        return Markup(html)
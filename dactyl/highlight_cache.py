@@ -0,0 +1,137 @@
+################################################################################
+## Highlighted Code Cache
+##
+## A Python-Markdown extension that saves the HTML of code blocks highlighted
+## by the codehilite extension in a disk cache, so that later builds (and other
+## targets with the same pages) don't have to run Pygments on them again.
+################################################################################
+
+import markdown
+import pygments
+from markdown.extensions import Extension
+from markdown.extensions.codehilite import CodeHiliteExtension
+from markdown.preprocessors import Preprocessor
+from markdown.treeprocessors import Treeprocessor
+
+from dactyl.common import *
+
+class HighlightCacheExtension(Extension):
+    """
+    Wraps the processors that the fenced_code and codehilite extensions use
+    to highlight code blocks, so they only highlight blocks that aren't
+    cached. Load it after those extensions.
+    """
+    def __init__(self, cache=None, **kwargs):
+        # Not a config option, since those have to be simple values
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        cache = self.cache
+        codehilite = [ext for ext in md.registeredExtensions
+                      if isinstance(ext, CodeHiliteExtension)]
+        if not cache or not codehilite:
+            return
+
+        # Everything besides a block's source that affects its HTML
+        settings = [
+            codehilite[0].getConfigs(),
+            md.tab_length,
+            sorted(type(ext).__name__ for ext in md.registeredExtensions),
+            [markdown.__version__, pygments.__version__],
+        ]
+        if "fenced_code_block" in md.preprocessors:
+            fenced = md.preprocessors["fenced_code_block"]
+            md.preprocessors.register(
+                    CachedFencedBlockPreprocessor(md, fenced, cache,
+                                                  settings + [fenced.config]),
+                    "cached_fenced_code_block", 26)
+        hiliter = md.treeprocessors["hilite"]
+        md.treeprocessors.register(
+                CachedHiliteTreeprocessor(md, hiliter, cache, settings),
+                "hilite", 30)
+
+
+class CachedFencedBlockPreprocessor(Preprocessor):
+    """
+    Runs before the fenced_code extension's preprocessor and hands it one
+    fenced block at a time, saving the HTML it makes for each block. Blocks
+    that are already cached don't go to it at all.
+    """
+    def __init__(self, md, fenced, cache, settings):
+        super().__init__(md)
+        self.fenced = fenced
+        self.cache = cache
+        self.settings = settings
+
+    def run(self, lines):
+        text = "\n".join(lines)
+        index = 0
+        stash = self.md.htmlStash
+        while True:
+            m = self.fenced.FENCED_BLOCK_RE.search(text, index)
+            if not m:
+                break
+            block = m.group(0)
+            key = self.cache.make_key(block, self.settings)
+            html = self.cache.get(key) if key else None
+            if html is not None:
+                placeholder = stash.store(html)
+            else:
+                stashed = stash.html_counter
+                self.fenced.run(block.split("\n"))
+                if stash.html_counter != stashed + 1:
+                    # Not a code block after all, because its attributes are
+                    # invalid. Skip them, like the fenced_code extension does.
+                    if not m.group("attrs"):
+                        break
+                    index = m.end("attrs")
+                    continue
+                placeholder = stash.get_placeholder(stashed)
+                if key:
+                    self.cache.set(key, stash.rawHtmlBlocks[stashed])
+            # Same replacement as the fenced_code extension makes
+            text = "%s\n%s\n%s" % (text[:m.start()], placeholder, text[m.end():])
+            index = m.start() + 1 + len(placeholder)
+        return text.split("\n")
+
+
+class CachedHiliteTreeprocessor(Treeprocessor):
+    """
+    Replaces the codehilite extension's treeprocessor, which highlights
+    indented code blocks. Uses cached HTML where possible and runs the
+    original treeprocessor for the rest.
+    """
+    def __init__(self, md, hiliter, cache, settings):
+        super().__init__(md)
+        self.hiliter = hiliter
+        self.cache = cache
+        self.settings = settings
+
+    def run(self, root):
+        stash = self.md.htmlStash
+        uncached = []
+        for block in root.iter("pre"):
+            if len(block) != 1 or block[0].tag != "code" or block[0].text is None:
+                continue
+            key = self.cache.make_key(block[0].text, self.settings)
+            html = self.cache.get(key) if key else None
+            if html is None:
+                uncached.append((block, key))
+                continue
+            placeholder = stash.store(html)
+            # Same as the codehilite extension does with a highlighted block
+            block.clear()
+            block.tag = "p"
+            block.text = placeholder
+
+        stashed = stash.html_counter
+        self.hiliter.run(root)
+        # The original stashes the remaining blocks' HTML in document order
+        for i, (block, key) in enumerate(uncached):
+            if key and block.text == stash.get_placeholder(stashed + i):
+                self.cache.set(key, stash.rawHtmlBlocks[stashed + i])
+
+
+def makeExtension(**kwargs):
+    return HighlightCacheExtension(**kwargs)
@@ -0,0 +1,412 @@
+################################################################################
+## Dactyl Build Manifest
+##
+## Tracks which files and settings each page is built from, and records the
+## inputs that went into each output file of a build, so that an incremental
+## build can skip the pages whose inputs haven't changed.
+################################################################################
+
+import jinja2
+from jinja2 import meta
+
+from dactyl.common import *
+from dactyl.version import __version__
+
+MANIFEST_SUFFIX = ".dactyl_manifest.json"
+MANIFEST_VERSION = 1
+
+# Built fields that other pages' templates may use. These are saved in the
+# manifest so they're still available when their page is skipped.
+RESTORED_PAGE_FIELDS = [
+    "blurb",
+    "headermap",
+]
+# Page fields that go into navigation
+NAV_FIELDS = ["html", "name", "parent", "category", "nav_omit"]
+# Template variables that expose all the pages in the target
+SITE_VARIABLES = {"pages", "categories", *PAGE_INDEXES}
+# Stands in for the names of templates that are chosen at render time
+DYNAMIC_TEMPLATE = "*"
+
+class PageDependencies:
+    """
+    Finds the files and other pages that the pages of a build depend on.
+    Results are cached until forget() is called for the files that changed.
+    """
+    def __init__(self, builder):
+        self.builder = builder
+        self.config = builder.config
+        self.template_info = {}
+        self.source_infos = {}
+        self.pages_by_html = None
+        self.site_nav_hash = None
+        self.site_content_hash = None
+        self._pp_env = None
+
+    def forget(self, pages=[], paths=[]):
+        """
+        Clear cached results for the given pages and the templates at the
+        given file paths, as well as any results about the whole site.
+        """
+        for page in pages:
+            self.source_infos.pop(id(page), None)
+        paths = set(paths)
+        for key, info in list(self.template_info.items()):
+            if key[1] == DYNAMIC_TEMPLATE or paths & info[3]:
+                del self.template_info[key]
+        self.pages_by_html = None
+        self.site_nav_hash = None
+        self.site_content_hash = None
+
+    def templates(self, page):
+        """
+        Return a dictionary describing the templates a page uses, with these
+        fields:
+            "templates": the layout template and the templates it uses,
+                         mapped to hashes of their sources
+            "template_files": the file paths of those templates
+            "layout_uses_site": whether those use the list of all pages
+            "pp_templates": the templates the page's Markdown source uses
+                            when preprocessing, mapped to hashes
+            "pp_files": the file paths of the Markdown source and those
+                        templates
+            "pp_uses_site": whether those use the list of all pages
+        Templates whose names are chosen at render time are represented by
+        DYNAMIC_TEMPLATE in the list of file paths.
+        """
+        source_hash, fm_hash, pp_refs, pp_uses_site = self.source_info(page)
+        info = {
+            "templates": {},
+            "template_files": set(),
+            "layout_uses_site": False,
+            "pp_templates": {},
+            "pp_files": set(),
+            "pp_uses_site": pp_uses_site,
+        }
+        if "md" in page.data:
+            info["pp_files"].add(os.path.abspath(os.path.join(
+                                 self.config["content_path"], page.data["md"])))
+
+        layout = self.layout_template_name(page)
+        if layout is not None:
+            info["layout_uses_site"] = self.template_deps(
+                    self.builder.html_env, [layout],
+                    info["templates"], info["template_files"])
+        if pp_refs:
+            info["pp_uses_site"] |= self.template_deps(self.pp_env(page),
+                    pp_refs, info["pp_templates"], info["pp_files"])
+        return info
+
+    def source_info(self, page):
+        """
+        Hash the page's Markdown source and frontmatter, and find the templates
+        the source uses when preprocessing and whether it uses the other pages.
+        The list of templates is None if it can't be determined.
+        """
+        if id(page) not in self.source_infos:
+            self.source_infos[id(page)] = self.read_source(page)
+        return self.source_infos[id(page)]
+
+    def read_source(self, page):
+        if "md" in page.data:
+            md = page.data["md"]
+            if md[:5] == "http:" or md[:6] == "https:":
+                # Don't fetch remote files just to see if they changed
+                return None, None, None, True
+            try:
+                with open(os.path.join(self.config["content_path"], md),
+                          "r", encoding="utf-8") as f:
+                    text = f.read()
+            except OSError:
+                return None, None, None, True
+        elif "__md_generator" in page.data:
+            text = page.data["__md_generator"]()
+        else:
+            return hash_text(""), hash_text(""), [], False
+
+        body, frontmatter = parse_frontmatter(text)
+        if page.skip_pp:
+            pp_refs, uses_site = [], False
+        else:
+            try:
+                ast = self.pp_env(page).parse(body)
+                pp_refs, uses_site = self.template_refs(ast)
+            except jinja2.exceptions.TemplateError:
+                pp_refs, uses_site = None, True
+        return hash_text(text), hash_data(frontmatter), pp_refs, uses_site
+
+    def pp_env(self, page):
+        """
+        Return a preprocessor environment for finding the templates that pages'
+        Markdown sources use.
+        """
+        if self._pp_env is None:
+            self._pp_env = page.shared_pp_env()
+        return self._pp_env
+
+    def layout_template_name(self, page):
+        """
+        Return the name of the template the page is rendered with, if any.
+        """
+        if self.builder.mode == "html":
+            return page.data.get("template", self.config["default_template"])
+        elif self.builder.mode == "pdf":
+            return page.data.get("pdf_template",
+                                 self.config["default_pdf_template"])
+        return None
+
+    @staticmethod
+    def template_refs(ast):
+        """
+        Return the names of templates that a parsed template extends,
+        includes, or imports, including DYNAMIC_TEMPLATE if it chooses any
+        at render time, and whether it uses the site-wide page variables.
+        """
+        refs = [DYNAMIC_TEMPLATE if name is None else name
+                for name in meta.find_referenced_templates(ast)]
+        uses_site = bool(SITE_VARIABLES & meta.find_undeclared_variables(ast))
+        return refs, uses_site
+
+    def template_deps(self, env, names, hashes, files):
+        """
+        Add the named templates and everything they use, recursively, to the
+        hashes dictionary and the files set. Returns True if any of them use
+        the site-wide page variables.
+        """
+        uses_site = False
+        to_check = list(names)
+        while to_check:
+            name = to_check.pop()
+            if name in hashes:
+                continue
+            info = self.template_info.get((id(env), name))
+            if info is None:
+                info = self.read_template(env, name)
+                self.template_info[(id(env), name)] = info
+            hashes[name], refs, template_uses_site, template_files = info
+            uses_site |= template_uses_site
+            files |= template_files
+            to_check += refs
+        return uses_site
+
+    def read_template(self, env, name):
+        """
+        Return the hash of a template's source, the names of the templates it
+        uses, whether it uses the site-wide page variables, and its file path.
+        """
+        if name == DYNAMIC_TEMPLATE:
+            # Could be anything, so depend on all of them
+            all_hashes = {n: self.read_template(env, n)[0]
+                          for n in env.list_templates()}
+            return hash_data(all_hashes), [], True, {DYNAMIC_TEMPLATE}
+        try:
+            source, filename, uptodate = env.loader.get_source(env, name)
+            ast = env.parse(source)
+        except jinja2.exceptions.TemplateError:
+            return None, [], True, set()
+        refs, uses_site = self.template_refs(ast)
+        return hash_text(source), refs, uses_site, {os.path.abspath(filename)}
+
+    def page_by_html(self, html):
+        if self.pages_by_html is None:
+            self.pages_by_html = {p.data["html"]: p
+                                  for p in self.builder.target.pages}
+        return self.pages_by_html.get(html)
+
+    def ancestors(self, page):
+        """
+        Return the pages above the given page in the hierarchy, nearest first.
+        """
+        ancestors = []
+        parent = self.page_by_html(page.data.get("parent"))
+        while parent is not None and parent not in ancestors:
+            ancestors.append(parent)
+            parent = self.page_by_html(parent.data.get("parent"))
+        return ancestors
+
+    def site_nav(self):
+        """
+        Hash the fields of all pages in the target that go into site-wide
+        navigation, for pages whose templates display all the other pages.
+        """
+        if self.site_nav_hash is None:
+            self.site_nav_hash = hash_data([self.nav_fields(p.data)
+                                            for p in self.builder.target.pages])
+        return self.site_nav_hash
+
+    def site_content(self):
+        """
+        Hash the navigation fields and sources of all pages in the target, for
+        pages whose preprocessing can use anything from the other pages.
+        """
+        if self.site_content_hash is None:
+            self.site_content_hash = hash_data([
+                    [self.nav_fields(p.data), self.source_info(p)[0]]
+                    for p in self.builder.target.pages])
+        return self.site_content_hash
+
+    def local_nav(self, page):
+        """
+        Hash the navigation fields of a page's ancestors and descendants, for
+        pages whose templates don't display the rest of the site. Descendants'
+        sources count too, since a page can show its children's blurbs.
+        """
+        def subtree(p, seen):
+            if id(p) in seen or type(p.data.get("children")) != list:
+                return []
+            seen.add(id(p))
+            tree = []
+            for kid_data in p.data["children"]:
+                kid = self.page_by_html(kid_data.get("html"))
+                if kid is None:
+                    tree.append([self.nav_fields(kid_data)])
+                else:
+                    tree.append([self.nav_fields(kid.data),
+                                 self.source_info(kid)[0], subtree(kid, seen)])
+            return tree
+
+        return hash_data({
+            "ancestors": [self.nav_fields(p.data) for p in self.ancestors(page)],
+            "children": subtree(page, set()),
+        })
+
+    @staticmethod
+    def nav_fields(data):
+        return [data.get(key) for key in NAV_FIELDS]
+
+
+class BuildManifest:
+    """
+    The inputs of each page in a build of one target in one mode, as saved in
+    a JSON file next to the output folder. Incremental builds compare a page's
+    current inputs with the saved ones to decide whether to rebuild it.
+    """
+    def __init__(self, builder, deps=None):
+        self.builder = builder
+        self.config = builder.config
+        self.path = os.path.normpath(self.config["out_path"]) + MANIFEST_SUFFIX
+        # In a staged build, the new manifest goes with the staging folder
+        # until the build succeeds.
+        self.save_path = os.path.normpath(builder.out_path) + MANIFEST_SUFFIX
+        self.build_key = builder.target.name + "/" + builder.mode
+        self.all_builds = {}
+        self.pages = {}
+        if deps is None:
+            deps = PageDependencies(builder)
+        self.deps = deps
+        self.load()
+
+        # Settings that affect every page in this build
+        build_settings = {key: val for key,val in self.config.config.items()
+                          if key not in ("pages", "targets")}
+        self.build_hash = hash_data({
+            "version": __version__,
+            "mode": builder.mode,
+            "settings": build_settings,
+            "es_template": builder.default_es_template,
+        })
+        self.target_hash = hash_data({key: val for key,val in
+                                      builder.target.data.items()
+                                      if key not in RESERVED_KEYS_TARGET})
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            logger.info("No build manifest at %s; building all pages" %
+                        self.path)
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(("Couldn't read build manifest %s (%s); building "+
+                           "all pages") % (self.path, e))
+            return
+        if saved.get("manifest_version") != MANIFEST_VERSION:
+            logger.info("Build manifest is from a different Dactyl version; "+
+                        "building all pages")
+            return
+        self.all_builds = saved.get("builds", {})
+        self.pages = self.all_builds.get(self.build_key, {})
+
+    def save(self):
+        """
+        Write the manifest, replacing the previous file all at once so an
+        interrupted build can't leave a partial manifest behind.
+        """
+        self.all_builds[self.build_key] = self.pages
+        tmp_path = self.save_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"manifest_version": MANIFEST_VERSION,
+                       "builds": self.all_builds}, f)
+        os.replace(tmp_path, self.save_path)
+        logger.debug("wrote build manifest %s" % self.save_path)
+
+    def page_inputs(self, page):
+        """
+        Return a dictionary of hashes of everything that goes into the given
+        page's output.
+        """
+        deps = self.deps
+        inputs = {"build": self.build_hash, "target": self.target_hash}
+        inputs["source"], inputs["frontmatter"] = deps.source_info(page)[:2]
+
+        page_fields = {key: val for key,val in page.data.items()
+                       if key not in BUILT_PAGE_FIELDS}
+        inputs["metadata"] = hash_data(page_fields)
+
+        inputs["filters"] = {f: self.config.filter_version(f)
+                             for f in page.filters()}
+
+        templates = deps.templates(page)
+        inputs["templates"] = templates["templates"]
+        inputs["pp_templates"] = templates["pp_templates"]
+
+        # The preprocessor can output anything about the other pages, but
+        # templates are assumed to use them only for navigation.
+        if templates["pp_uses_site"]:
+            inputs["nav"] = deps.site_content()
+        elif templates["layout_uses_site"]:
+            inputs["nav"] = deps.site_nav()
+        else:
+            inputs["nav"] = deps.local_nav(page)
+        return inputs
+
+    def is_current(self, page, inputs):
+        """
+        Report whether the page's output exists and was built from the same
+        inputs as now.
+        """
+        filepath = page.filepath(self.builder.mode)
+        saved = self.pages.get(filepath)
+        if saved is None:
+            logger.debug("incremental: %s wasn't built before" % page)
+            return False
+        if not os.path.isfile(self.builder.out_file_path(filepath)):
+            logger.debug("incremental: output of %s is missing" % page)
+            return False
+        for key, val in inputs.items():
+            if val is None or saved["inputs"].get(key) != val:
+                logger.debug("incremental: %s changed for page %s" % (key, page))
+                return False
+            if type(val) == dict and None in val.values():
+                logger.debug("incremental: %s of page %s can't be compared" %
+                             (key, page))
+                return False
+        return True
+
+    def restored_fields(self, page):
+        """
+        Return the built fields saved for a page the last time it was built.
+        """
+        return self.pages[page.filepath(self.builder.mode)]["fields"]
+
+    def record(self, page, inputs):
+        """
+        Note that the page was just built from the given inputs.
+        """
+        fields = {key: page.data[key] for key in RESTORED_PAGE_FIELDS
+                  if key in page.data}
+        self.pages[page.filepath(self.builder.mode)] = {
+            "inputs": inputs,
+            "fields": fields,
+        }
@@ -0,0 +1,177 @@
+################################################################################
+## Markdown Filters
+##
+## A Python-Markdown extension that lets filters work on the ElementTree that
+## Python-Markdown builds for a page, plus helpers for filters'
+## markdown_visitors functions. Pages whose filters all work this way don't
+## have to be parsed into a soup after converting their Markdown.
+################################################################################
+
+from xml.etree.ElementTree import Element
+
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from markdown.util import AMP_SUBSTITUTE, HTML_PLACEHOLDER_RE
+
+from dactyl.common import *
+
+class MarkdownFiltersExtension(Extension):
+    """
+    Calls the converter's visit_tree function, if it has one, on each
+    document's tree after Python-Markdown's own tree processors have run.
+    Dactyl sets visit_tree for each page that has filters to run this way.
+    """
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        self.md = md
+        md.visit_tree = None
+        # After attr_list and unescape, so attributes and text are final
+        md.treeprocessors.register(VisitTreeprocessor(md), "dactyl_filters", -10)
+
+    def reset(self):
+        self.md.visit_tree = None
+
+class VisitTreeprocessor(Treeprocessor):
+    def run(self, root):
+        if self.md.visit_tree is not None:
+            self.md.visit_tree(root)
+
+def makeExtension(**kwargs):
+    return MarkdownFiltersExtension(**kwargs)
+
+def walk_tree(root, visitors, on_error=None):
+    """
+    Walk a Markdown tree once, calling filters' visitor functions on its
+    elements, the same way walk_soup() does for a soup. Functions can change
+    the element they're called on and its contents, but not other elements.
+    Elements that they add aren't visited, and elements that they remove
+    from inside the current one aren't either.
+    """
+    by_tag = {}
+    by_attr = []
+    for i, (name, selectors) in enumerate(visitors):
+        for selector, func in selectors.items():
+            if selector[:1] == "[" and selector[-1:] == "]":
+                by_attr.append((selector[1:-1], i, name, func))
+            else:
+                by_tag.setdefault(selector, []).append((i, name, func))
+
+    failed = set()
+    original = set(root.iter())
+    stack = list(reversed(root))
+    while stack:
+        el = stack.pop()
+        if el in original and isinstance(el.tag, str):
+            calls = by_tag.get(el.tag, [])
+            attr_calls = [(i, name, func) for attr, i, name, func in by_attr
+                          if attr in el.attrib]
+            if attr_calls:
+                calls = sorted(calls + attr_calls, key=lambda call: call[0])
+            for i, name, func in calls:
+                if name in failed:
+                    continue
+                try:
+                    func(el)
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    failed.add(name)
+                    on_error(name, e)
+        stack.extend(reversed(el))
+
+# Raw HTML that filters would find elements in, if it were in the tree
+raw_link = re.compile(r"<a\b", re.I)
+
+def raw_html(md, el):
+    """
+    If el is a placeholder for a block of raw HTML, return the HTML.
+    Python-Markdown sets raw HTML aside and puts it back after converting
+    the rest of the document, so it isn't in the tree.
+    """
+    if el.tag == "p" and len(el) == 0 and el.text:
+        m = HTML_PLACEHOLDER_RE.fullmatch(el.text)
+        if m and int(m.group(1)) < len(md.htmlStash.rawHtmlBlocks):
+            return str(md.htmlStash.rawHtmlBlocks[int(m.group(1))])
+    return None
+
+def set_raw_html(md, el, html):
+    """Change the raw HTML that a placeholder from raw_html() stands for"""
+    m = HTML_PLACEHOLDER_RE.fullmatch(el.text)
+    md.htmlStash.rawHtmlBlocks[int(m.group(1))] = html
+
+def has_raw_html(md, regex):
+    """Return True if any of the document's raw HTML matches a regex"""
+    return any(regex.search(str(html)) for html in md.htmlStash.rawHtmlBlocks)
+
+def headers_contain(root, tag):
+    """
+    Return True if any header has an element with the given tag in it.
+    Dactyl makes the Table of Contents from the headers' text after the tree
+    filters run, but before soup filters do, so filters that change the text
+    of elements in headers shouldn't run on the tree.
+    """
+    return any(next(h.iter(tag), None) is not None for h in root.iter()
+               if h.tag in ("h1", "h2", "h3", "h4", "h5", "h6"))
+
+# Python-Markdown writes text with entities like these as-is, so they're
+# still entities in the HTML
+tree_entity = re.compile(r"&(?:#[0-9]+|#x[0-9a-f]+|[0-9a-z]+);", re.I)
+
+def tree_text(md, el):
+    """Return the text in an element, like Beautiful Soup's get_text()."""
+    text = "".join(el.itertext())
+    strings = []
+    pos = 0
+    for m in HTML_PLACEHOLDER_RE.finditer(text):
+        strings.append(text[pos:m.start()])
+        strings.append(html_text(str(md.htmlStash.rawHtmlBlocks[int(m.group(1))])))
+        pos = m.end()
+    strings.append(text[pos:])
+    for i in range(0, len(strings), 2):
+        strings[i] = tree_entity.sub(lambda m: html_unescape(m.group(0)),
+                                     strings[i].replace(AMP_SUBSTITUTE, "&"))
+    return "".join(strings)
+
+def tree_escape(text):
+    """Escape text, such as from tree_text(), to put it in the tree"""
+    return text.replace("&", "&amp;")
+
+def tree_string(md, el):
+    """
+    Return an element's text if it has no other elements in it, or if its
+    only contents are an element like that, or else None. This is like
+    Beautiful Soup's .string, where raw HTML such as <b> in the Markdown
+    counts as an element.
+    """
+    if len(el) == 1 and not el.text and not el[0].tail:
+        return tree_string(md, el[0])
+    if len(el) or not el.text:
+        return None
+    for m in HTML_PLACEHOLDER_RE.finditer(el.text):
+        if "<" in str(md.htmlStash.rawHtmlBlocks[int(m.group(1))]):
+            return None
+    return tree_text(md, el)
+
+def parent_map(root):
+    """Return a dictionary of each element in the tree to its parent"""
+    return {child: parent for parent in root.iter() for child in parent}
+
+def class_list(el):
+    return el.get("class", "").split()
+
+def append_text(el, text):
+    """Add text to the end of an element's contents"""
+    if len(el):
+        el[-1].tail = (el[-1].tail or "") + text
+    else:
+        el.text = (el.text or "") + text
+
+def remove_element(parent, el):
+    """Remove an element from its parent, keeping the text after it"""
+    i = list(parent).index(el)
+    if el.tail:
+        if i:
+            parent[i-1].tail = (parent[i-1].tail or "") + el.tail
+        else:
+            parent.text = (parent.text or "") + el.tail
+    parent.remove(el)
@@ -0,0 +1,277 @@
+################################################################################
+## markdown-it Converter
+##
+## Converts Markdown to HTML using markdown-it-py, which is much faster than
+## Python-Markdown. Adds a compatibility layer so that the features Dactyl
+## relies on make the same HTML as Python-Markdown with the extra and
+## codehilite extensions.
+################################################################################
+
+import xml.etree.ElementTree as etree
+
+import markdown
+import pygments
+from markdown.extensions.attr_list import (AttrListTreeprocessor,
+                                           get_attrs_and_remainder)
+from markdown.extensions.codehilite import (CodeHilite, CodeHiliteExtension,
+                                            parse_hl_lines)
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from markdown_it import MarkdownIt
+from markdown_it import __version__ as markdown_it_version
+from markdown_it.common.utils import escapeHtml, unescapeAll
+from mdit_py_plugins.deflist import deflist_plugin
+from mdit_py_plugins.footnote import footnote_plugin
+
+from dactyl.common import *
+
+# Block-level HTML tags whose contents Python-Markdown parses as Markdown if
+# they have a markdown="1" attribute
+MD_IN_HTML_TAGS = ["div", "section", "article", "aside", "blockquote",
+                   "details", "figure", "footer", "header", "main", "nav"]
+MD_IN_HTML_OPEN = re.compile(r'^([ ]{0,3})<(%s)\b([^>]*?)[ ]+markdown=["\']?'
+                             r'(?:1|block)["\']?([^>]*)>[ ]*$' %
+                             "|".join(MD_IN_HTML_TAGS))
+
+# A fenced code block's info string in the forms that Python-Markdown allows
+FENCE_INFO = re.compile(r"""^(?:\{(?P<attrs>.*)\}|\.?(?P<lang>[\w#.+-]*)[ ]*"""
+                        r"""(?:hl_lines=(?P<quot>"|')(?P<hl_lines>.*?)(?P=quot)[ ]*)?)$""")
+# Code spans, which are left alone, or link URLs
+CODE_OR_LINK_URL = re.compile(r"(?P<code>(?P<ticks>`+).+?(?<!`)(?P=ticks)(?!`))|"
+                              r"\]\((?P<url>[^()<>\n]*)\)", re.S)
+# A link title at the end of a link URL
+LINK_TITLE = re.compile(r"""\s("[^"]*"|'[^']*')$""")
+
+class MarkdownItConverter:
+    """
+    Converts Markdown to HTML with markdown-it-py. Supports tables, fenced
+    code, attribute lists on headers and paragraphs, footnotes, definition
+    lists, HTML blocks with markdown="1", and syntax highlighting with the
+    same HTML as Python-Markdown's codehilite extension. Other Python-Markdown
+    extensions, such as abbreviations, aren't supported.
+    """
+    def __init__(self, highlight=True, guess_lang=True, highlight_cache=None):
+        self.highlight = highlight
+        self.highlight_cache = highlight_cache
+        self.codehilite_config = CodeHiliteExtension(
+                guess_lang=guess_lang).getConfigs()
+        # Everything besides a block's code and options that affects its HTML
+        self.highlight_settings = ["markdown-it", self.codehilite_config,
+                [markdown.__version__, pygments.__version__]]
+        # Only used for their methods that parse attribute lists
+        self.attr_list = AttrListTreeprocessor()
+        self.fenced = FencedBlockPreprocessor(None, {})
+
+        self.md = MarkdownIt("commonmark").enable("table")
+        self.md.use(footnote_plugin, inline=False)
+        self.md.use(deflist_plugin)
+        self.md.core.ruler.before("inline", "attr_list", self.apply_attr_lists)
+        self.md.core.ruler.before("inline", "link_spaces", self.quote_link_spaces)
+        # Like Python-Markdown, use links' URLs as written, without
+        # percent-encoding them or dropping javascript: URLs
+        self.md.validateLink = lambda url: True
+        self.md.normalizeLink = lambda url: url
+        self.md.core.ruler.push("table_align", self.fix_table_align)
+        # Not add_render_rule(), which would bind these to the renderer
+        rules = self.md.renderer.rules
+        rules["fence"] = self.render_fence
+        rules["code_block"] = self.render_code_block
+        rules["footnote_ref"] = self.render_footnote_ref
+        rules["footnote_block_open"] = self.render_footnote_block_open
+        rules["footnote_block_close"] = self.render_footnote_block_close
+        rules["footnote_open"] = self.render_footnote_open
+        rules["footnote_anchor"] = self.render_footnote_anchor
+
+    def reset(self):
+        """
+        Nothing carries over from one document to the next. This is here so
+        the converter works the same as a Python-Markdown instance.
+        """
+        return self
+
+    def convert(self, text):
+        return self.md.render(self.open_md_in_html(text))
+
+    @staticmethod
+    def open_md_in_html(text):
+        """
+        Put blank lines inside block-level HTML elements that have the
+        markdown="1" attribute (removing the attribute), so that their
+        contents are parsed as Markdown. Only applies to elements whose
+        start and end tags are on lines by themselves.
+        """
+        lines = text.split("\n")
+        out = []
+        open_tags = [] # [tag name, nesting depth] of elements being opened
+        for line in lines:
+            if open_tags:
+                tag, depth = open_tags[-1]
+                depth += len(re.findall(r"<%s\b" % tag, line))
+                depth -= len(re.findall(r"</%s\s*>" % tag, line))
+                if depth <= 0 and re.match(r"^[ ]{0,3}</%s\s*>[ ]*$" % tag, line):
+                    out += ["", line]
+                    open_tags.pop()
+                    continue
+                open_tags[-1][1] = depth
+            m = MD_IN_HTML_OPEN.match(line)
+            if m:
+                out += ["%s<%s%s%s>" % m.groups(), ""]
+                open_tags.append([m.group(2), 1])
+            else:
+                out.append(line)
+        return "\n".join(out)
+
+    def apply_attr_lists(self, state):
+        """
+        Core rule: apply attribute lists ({: #id .class key=value }) at the end
+        of headers and on the last line of paragraphs, like Python-Markdown.
+        """
+        tokens = state.tokens
+        for i, token in enumerate(tokens[:-1]):
+            if token.type == "heading_open":
+                regex = AttrListTreeprocessor.HEADER_RE
+            elif token.type == "paragraph_open":
+                regex = AttrListTreeprocessor.BLOCK_RE
+            else:
+                continue
+            inline = tokens[i+1]
+            m = regex.search(inline.content)
+            if not m:
+                continue
+            elem = etree.Element("x", dict(token.attrs))
+            if self.attr_list.assign_attrs(elem, m.group(1), strict=True):
+                continue
+            token.attrs = dict(elem.attrib)
+            content = inline.content[:m.start()]
+            if token.type == "heading_open":
+                content = content.rstrip("#").rstrip()
+            inline.content = content
+
+    @staticmethod
+    def quote_link_spaces(state):
+        """
+        Core rule: put angle brackets around link URLs that contain spaces,
+        such as cross-references (XREF: page.html), so that they're parsed as
+        links the way Python-Markdown does. Leaves code spans alone.
+        """
+        def quote_url(m):
+            url = (m.group("url") or "").strip()
+            if " " not in url or LINK_TITLE.search(url):
+                return m.group(0)
+            return "](<%s>)" % url
+        for token in state.tokens:
+            if token.type != "inline" or "](" not in token.content:
+                continue
+            token.content = CODE_OR_LINK_URL.sub(quote_url, token.content)
+
+    @staticmethod
+    def fix_table_align(state):
+        """
+        Core rule: write table cells' alignment the way Python-Markdown does.
+        """
+        for token in state.tokens:
+            if token.type in ("th_open", "td_open"):
+                style = token.attrGet("style")
+                if style and style.startswith("text-align:"):
+                    token.attrSet("style", "text-align: %s;" %
+                                  style[len("text-align:"):])
+
+    def hilite(self, code, shebang, **options):
+        """
+        Return the HTML of a code block, highlighted the same as by the
+        codehilite extension.
+        """
+        if self.highlight_cache:
+            key = self.highlight_cache.make_key(code, shebang, options,
+                                                self.highlight_settings)
+            html = self.highlight_cache.get(key) if key else None
+            if html is not None:
+                return html
+        config = self.codehilite_config.copy()
+        config.update(options)
+        style = config.pop("pygments_style", "default")
+        html = CodeHilite(code, style=style, **config).hilite(shebang=shebang)
+        if self.highlight_cache and key:
+            self.highlight_cache.set(key, html)
+        return html
+
+    def render_fence(self, tokens, idx, options, env):
+        """
+        Render a fenced code block the same way as Python-Markdown's
+        fenced_code extension, including {attributes} and hl_lines.
+        """
+        token = tokens[idx]
+        m = FENCE_INFO.match(unescapeAll(token.info).strip())
+        id, lang, classes, config = "", None, [], {}
+        if not m:
+            # Python-Markdown wouldn't recognize this as a code block
+            lang = token.info.split()[0]
+        elif m.group("attrs") is not None:
+            attrs = get_attrs_and_remainder(m.group("attrs"))[0]
+            id, classes, config = self.fenced.handle_attrs(attrs)
+            if classes:
+                lang = classes.pop(0)
+        else:
+            lang = m.group("lang") or None
+            if m.group("hl_lines"):
+                config["hl_lines"] = parse_hl_lines(m.group("hl_lines"))
+
+        if self.highlight and config.get("use_pygments", True):
+            if classes:
+                config["css_class"] = "%s %s" % (" ".join(classes),
+                        self.codehilite_config["css_class"])
+            return self.hilite(token.content, False, lang=lang, **config) + "\n"
+
+        id_attr = lang_attr = class_attr = kv_pairs = ""
+        if lang:
+            lang_attr = ' class="language-%s"' % escapeHtml(lang)
+        if classes:
+            class_attr = ' class="%s"' % escapeHtml(" ".join(classes))
+        if id:
+            id_attr = ' id="%s"' % escapeHtml(id)
+        if config and not config.get("use_pygments", False):
+            kv_pairs = "".join(' %s="%s"' % (k, escapeHtml(str(v)))
+                               for k, v in config.items() if k != "use_pygments")
+        return "<pre%s%s><code%s%s>%s</code></pre>\n" % (id_attr, class_attr,
+                lang_attr, kv_pairs, escapeHtml(token.content))
+
+    def render_code_block(self, tokens, idx, options, env):
+        content = tokens[idx].content
+        if not self.highlight:
+            return "<pre><code>%s</code></pre>\n" % escapeHtml(content)
+        return self.hilite(content, True, tab_length=4) + "\n"
+
+    # Footnotes, with the same HTML as Python-Markdown's footnotes extension
+
+    @staticmethod
+    def footnote_name(token):
+        return token.meta.get("label") or str(token.meta["id"] + 1)
+
+    def render_footnote_ref(self, tokens, idx, options, env):
+        token = tokens[idx]
+        name = escapeHtml(self.footnote_name(token))
+        ref_id = "fnref:%s" % name
+        if token.meta.get("subId", 0) > 0:
+            ref_id = "fnref%d:%s" % (token.meta["subId"] + 1, name)
+        return ('<sup id="%s"><a class="footnote-ref" href="#fn:%s">%d</a></sup>' %
+                (ref_id, name, token.meta["id"] + 1))
+
+    def render_footnote_block_open(self, tokens, idx, options, env):
+        return '<div class="footnote">\n<hr />\n<ol>\n'
+
+    def render_footnote_block_close(self, tokens, idx, options, env):
+        return "</ol>\n</div>\n"
+
+    def render_footnote_open(self, tokens, idx, options, env):
+        return '<li id="fn:%s">\n' % escapeHtml(self.footnote_name(tokens[idx]))
+
+    def render_footnote_anchor(self, tokens, idx, options, env):
+        token = tokens[idx]
+        name = escapeHtml(self.footnote_name(token))
+        ref_id = "fnref:%s" % name
+        space = "&#160;"
+        if token.meta.get("subId", 0) > 0:
+            ref_id = "fnref%d:%s" % (token.meta["subId"] + 1, name)
+            space = ""
+        return ('%s<a class="footnote-backref" href="#%s" title="Jump back to '
+                'footnote %d in the text">&#8617;</a>' %
+                (space, ref_id, token.meta["id"] + 1))
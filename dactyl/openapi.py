@@ -28,7 +28,7 @@ DATA_TYPE_TEMPLATE = "template-openapi_data_type.md"
 class ApiDef:
     cached_specs = {}
     def __init__(self, spec_path, api_slug=None, extra_fields={},
-                template_path=None):
+                template_path=None, bytecode_cache=None):
         self.read_swag(spec_path)
         self.clean_up_swag()
         self.deref_swag()
@@ -44,11 +44,11 @@ class ApiDef:
             self.api_slug = api_slug
 
         self.extra_fields = extra_fields
-        self.setup_jinja_env(template_path)
+        self.setup_jinja_env(template_path, bytecode_cache)
 
     @classmethod
     def from_path(cls, spec_path, api_slug=None, extra_fields={},
-                template_path=None):
+                template_path=None, bytecode_cache=None):
         """
         Instantiate an ApiDef instance only if we haven't done so already. This
         saves the trouble of fetching & parsing API specs more than once.
@@ -57,7 +57,8 @@ class ApiDef:
             return cls.cached_specs[spec_path]
 
         apidef = cls(spec_path, api_slug=api_slug,
-                extra_fields=extra_fields, template_path=template_path)
+                extra_fields=extra_fields, template_path=template_path,
+                bytecode_cache=bytecode_cache)
         cls.cached_specs[spec_path] = apidef
         return apidef
 
@@ -77,9 +78,9 @@ class ApiDef:
                 self.swag = yaml.load(f)
 
 
-    def setup_jinja_env(self, template_path=None):
+    def setup_jinja_env(self, template_path=None, bytecode_cache=None):
         """Sets up the environment used to inject OpenAPI data into Markdown
-        templates"""
+        templates, optionally caching their compiled code"""
         if template_path is None:
             loader = jinja2.PackageLoader(PACKAGE_NAME)
         else:
@@ -88,7 +89,8 @@ class ApiDef:
                 jinja2.FileSystemLoader(template_path),
                 jinja2.PackageLoader(PACKAGE_NAME)
             ])
-        self.env = jinja2.Environment(loader=loader, extensions=['jinja2.ext.i18n'])
+        self.env = jinja2.Environment(loader=loader, extensions=['jinja2.ext.i18n'],
+                                      bytecode_cache=bytecode_cache)
         self.env.lstrip_blocks = True
         self.env.rstrip_blocks = True
 
@@ -8,19 +8,41 @@
 import jinja2
 import requests
 
-from markdown import markdown
-from bs4 import BeautifulSoup
+from copy import copy, deepcopy
+
+import markdown as markdown_module
+import bs4
+import importlib
+import pygments
 
 from dactyl.common import *
+from dactyl.version import __version__
 
+from dactyl.filter_pipeline import FilterPipeline, walk_soup
+from dactyl.markdown_filters import walk_tree
+from dactyl.fragment_cache import FragmentCacheExtension
 from dactyl.jinja_loaders import FrontMatterRemoteLoader, FrontMatterFSLoader
 
 class DactylPage:
     def __init__(self, config, data, skip_pp=False, more_filters=[]):
         self.config = config
         self.data = data
+        # Keep the original definition so the page can be reloaded
+        self.definition = deepcopy(data)
+        self.more_filters = more_filters
+        self.default_skip_pp = skip_pp
+        self.load(skip_pp)
+
+    def load(self, skip_pp):
+        """
+        Load the page's metadata: its definition, frontmatter, and default
+        filename and name. Compiling the Markdown as a preprocessor template
+        waits until the page is built; see load_pp_template().
+        """
         self.rawtext = None
         self.pp_template = None
+        # Name to compile the preprocessor template from, if any
+        self.pp_template_name = None
         self.twolines = None
         self.toc = []
         self.ffp = None
@@ -29,20 +51,62 @@ class DactylPage:
         self.html = None
         self.soup = None
 
-        self.gain_filters(more_filters)
+        self.gain_filters(self.more_filters)
         self.load_content()
         self.provide_default_filename()
         self.provide_name()
 
-    def get_pp_env(self, loader):
+    def reload(self):
+        """
+        Load the page again from its original definition and source, for
+        example after its source file changes. Keeps the fields that describe
+        its place in the target's hierarchy. If loading fails, for example
+        because the source file is missing, the page stays as it was.
+        """
+        hierarchy = {key: self.data[key] for key in ("children", "is_ancestor_of")
+                     if key in self.data}
+        data = self.data
+        state = dict(self.__dict__)
+        self.data = deepcopy(self.definition)
+        self.data.update(hierarchy)
+        try:
+            self.load(self.default_skip_pp)
+        except Exception:
+            self.__dict__.update(state)
+            raise
+        # Update in place, since other pages' "children" refer to this dict
+        data.clear()
+        data.update(self.data)
+        self.data = data
+
+    def release(self):
+        """
+        Drop the page's source and parsed contents to save memory once its
+        output is written, keeping the metadata and plaintext that other pages
+        and templates use. Building the page again after this requires
+        reload().
+        """
+        self.rawtext = None
+        self.pp_template = None
+        self.md = None
+        self.html = None
+        self.soup = None
+        self.toc = []
+
+    def get_pp_env(self, loader, cache_templates=True):
         if (self.config["preprocessor_allow_undefined"] or
                 self.config.bypass_errors):
             preferred_undefined = jinja2.Undefined
         else:
             preferred_undefined = jinja2.StrictUndefined
 
+        bytecode_cache = None
+        if cache_templates:
+            bytecode_cache = self.config.bytecode_cache("preprocessor")
         pp_env = jinja2.Environment(undefined=preferred_undefined,
-                extensions=['jinja2.ext.i18n'], loader=loader)
+                extensions=['jinja2.ext.i18n', FragmentCacheExtension],
+                loader=loader, bytecode_cache=bytecode_cache)
+        pp_env.fragment_cache = self.config.fragment_cache
 
         # Add custom "defined_and_" tests
         def defined_and_equalto(a,b):
@@ -54,9 +118,56 @@ class DactylPage:
 
         return pp_env
 
+    def shared_pp_env(self):
+        """
+        Return the preprocessor environment for Markdown files in the content
+        path. All pages share it, so Jinja compiles each file only once per
+        build, even if many pages include or import it. Its loader still
+        records each file's frontmatter and first two lines.
+        """
+        allow_undefined = bool(self.config["preprocessor_allow_undefined"] or
+                               self.config.bypass_errors)
+        key = (self.config["content_path"], allow_undefined)
+        if key not in self.config.pp_envs:
+            loader = FrontMatterFSLoader(self.config["content_path"])
+            self.config.pp_envs[key] = self.get_pp_env(loader=loader)
+        return self.config.pp_envs[key]
+
+    def md_converter(self, extensions=[]):
+        """
+        Return a Markdown converter with the given extensions, reset so it's
+        ready for a new document. Pages with the same extensions share a
+        converter, since setting one up means loading all its extensions.
+        With the markdown-it engine, the only extension that matters is
+        codehilite, for syntax highlighting.
+        """
+        key = tuple(extensions)
+        if key not in self.config.md_converters:
+            if self.config["markdown_engine"] == "markdown-it":
+                # Optional dependency, so only import it if it's used
+                from dactyl.markdown_it_converter import MarkdownItConverter
+                converter = MarkdownItConverter(
+                        highlight="codehilite" in extensions,
+                        guess_lang=self.config["highlight_guess_lang"],
+                        highlight_cache=self.config.highlight_cache)
+            else:
+                extension_configs = {
+                    "codehilite": {
+                        "guess_lang": self.config["highlight_guess_lang"],
+                    },
+                    "dactyl.highlight_cache": {
+                        "cache": self.config.highlight_cache,
+                    },
+                }
+                converter = markdown_module.Markdown(extensions=extensions,
+                        extension_configs=extension_configs)
+            self.config.md_converters[key] = converter
+        return self.config.md_converters[key].reset()
+
     def load_content(self):
         """
         Dispatcher for loading this page's content based on the "md" field.
+        Except for remote files, this only reads the source and frontmatter.
         """
         logger.debug("Loading page %s" % self)
         if "md" in self.data:
@@ -79,7 +190,10 @@ class DactylPage:
         assert (url[:5] == "http:" or url[:6] == "https:")
         if not self.skip_pp:
             pp_env = self.get_pp_env(loader=FrontMatterRemoteLoader())
+            # Compile now since the loader has to fetch the file anyway, and
+            # fetching it again later would be slow.
             self.pp_template = pp_env.get_template(self.data["md"])
+            self.pp_template_name = self.data["md"]
             frontmatter = pp_env.loader.fm_map[self.data["md"]]
             merge_dicts(frontmatter, self.data)
             # special case: let frontmatter overwrite default "html" vals
@@ -100,53 +214,63 @@ class DactylPage:
 
     def load_from_disk(self):
         """
-        Read the file from the filesystem,
-        as either raw text or as a Jinja template,
-        and load frontmatter, if any, either way.
+        Read the file from the filesystem and load frontmatter, if any. Keep
+        the text as raw text, or note that it should be compiled as a Jinja
+        template later.
         """
         assert "md" in self.data
-        if not self.skip_pp:
-            logger.debug("... loading markdown from filesystem")
-            path = self.config["content_path"]
-            pp_env = self.get_pp_env(loader=FrontMatterFSLoader(path))
-            self.pp_template = pp_env.get_template(self.data["md"])
-            frontmatter = pp_env.loader.fm_map[self.data["md"]]
-            merge_dicts(frontmatter, self.data)
-            # special case: let frontmatter overwrite default "html" vals
-            if PROVIDED_FILENAME_KEY in self.data and "html" in frontmatter:
-                self.data["html"] = frontmatter["html"]
-            # special case: add filters from frontmatter
-            if "filters" in frontmatter:
-                self.gain_filters(frontmatter["filters"])
-            self.twolines = pp_env.loader.twolines[self.data["md"]]
+        logger.debug("... reading markdown from file")
+        fullpath = os.path.join(self.config["content_path"], self.data["md"])
+        with open(fullpath, "r", encoding="utf-8") as f:
+            ftext = f.read()
+        text, frontmatter = parse_frontmatter(ftext)
+        if self.skip_pp:
+            self.rawtext = text
         else:
-            logger.debug("... reading markdown from file")
-            fullpath = os.path.join(self.config["content_path"], self.data["md"])
-            with open(fullpath, "r", encoding="utf-8") as f:
-                ftext = f.read()
-            self.rawtext, frontmatter = parse_frontmatter(ftext)
-            merge_dicts(frontmatter, self.data)
-            # special case: let frontmatter overwrite default "html" vals
-            if PROVIDED_FILENAME_KEY in self.data and "html" in frontmatter:
-                self.data["html"] = frontmatter["html"]
-            if "filters" in frontmatter:
-                self.gain_filters(frontmatter["filters"])
-            self.twolines = self.rawtext.split("\n", 2)[:2]
+            self.pp_template_name = self.data["md"]
+        merge_dicts(frontmatter, self.data)
+        # special case: let frontmatter overwrite default "html" vals
+        if PROVIDED_FILENAME_KEY in self.data and "html" in frontmatter:
+            self.data["html"] = frontmatter["html"]
+        # special case: add filters from frontmatter
+        if "filters" in frontmatter:
+            self.gain_filters(frontmatter["filters"])
+        self.twolines = text.split("\n", 2)[:2]
 
 
     def load_from_generator(self):
         """
-        Load the text from a generator function,
-        as either raw text or a jinja template.
+        Load the text from a generator function as raw text, or note that
+        it should be compiled as a jinja template later.
         Assume no frontmatter in this case.
         """
         if not self.skip_pp:
-            pp_env = self.get_pp_env(
-                loader=jinja2.DictLoader({"_": self.data["__md_generator"]()}) )
-            self.pp_template = pp_env.get_template("_")
+            self.pp_template_name = "_"
         else:
             self.rawtext = self.data["__md_generator"]()
 
+    def load_pp_template(self):
+        """
+        Compile the page's Markdown as a preprocessor template, if it isn't
+        already, and return it.
+        """
+        if self.pp_template is not None:
+            return self.pp_template
+        logger.debug("... compiling preprocessor template for page %s" % self)
+        if "md" in self.data:
+            md = self.data["md"]
+            if md[:5] == "http:" or md[:6] == "https:":
+                pp_env = self.get_pp_env(loader=FrontMatterRemoteLoader())
+            else:
+                pp_env = self.shared_pp_env()
+        else:
+            # Generated pages all use the same template name, so caching
+            # their compiled code would only overwrite the same entry.
+            pp_env = self.get_pp_env(loader=jinja2.DictLoader(
+                    {"_": self.data["__md_generator"]()}), cache_templates=False)
+        self.pp_template = pp_env.get_template(self.pp_template_name)
+        return self.pp_template
+
     def provide_default_filename(self):
         """
         Provide a default "html" filename to a page dictionary if one wasn't
@@ -191,17 +315,22 @@ class DactylPage:
             return
         elif self.twolines:
             logger.debug("Guessing page name from first two lines...")
-            try:
-                soup = BeautifulSoup(markdown("\n".join(self.twolines)), "html.parser")
+            # Most headers are simple enough to read without converting the
+            # Markdown, which is much faster.
+            title = guess_title(self.twolines)
+            if title is False:
+                logger.debug("... converting lines to find the header")
+                html = self.md_converter().convert("\n".join(self.twolines))
+                soup = html_soup(html, self.config["html_parser"])
                 first_h = soup.find(name=re.compile("h[1-6]"))
-                self.data["name"] = first_h.get_text()
+                title = first_h.get_text() if first_h else None
+            if title is not None:
+                self.data["name"] = title
                 logger.debug("... guessed title: '%s'"%self.data["name"])
                 return
-            except Exception as e:
-                traceback.print_tb(e.__traceback__)
-                logger.warning(("Couldn't guess title of page '%s' from its "+
-                                "first two lines:\n%s") % (self,
-                                    "\n".join(self.twolines)))
+            logger.warning(("Couldn't guess title of page '%s' from its "+
+                            "first two lines:\n%s") % (self,
+                                "\n".join(self.twolines)))
 
         if "md" in self.data:
             self.data["name"] = self.data["md"]
@@ -215,7 +344,8 @@ class DactylPage:
 
     def preprocess(self, context):
         try:
-            md = self.pp_template.render(**context, **self.filter_exports())
+            md = self.load_pp_template().render(**context,
+                                                **self.filter_exports())
         except Exception as e:
             recoverable_error("Preprocessor error in page %s: %s."%(self, e),
                               self.config.bypass_errors, error=e)
@@ -224,19 +354,19 @@ class DactylPage:
             self.load_content()
             return self.md_content(context)
         # Apply markdown-based filters here
-        for filter_name in self.filters():
-            if "filter_markdown" in dir(self.config.filters[filter_name]):
-                logger.debug("... applying markdown filter %s" % filter_name)
-                try:
-                    md = self.config.filters[filter_name].filter_markdown(
-                        md,
-                        logger=logger,
-                        **context,
-                    )
-                except Exception as e:
-                    recoverable_error("Markdown filter '%s' failed on page %s: %s" %
-                                  (filter_name, self, e),
-                                  self.config.bypass_errors, error=e)
+        for filter_name, filter_markdown in self.filter_pipeline().stage(
+                "filter_markdown", context.get("mode", "html")):
+            logger.debug("... applying markdown filter %s" % filter_name)
+            try:
+                md = filter_markdown(
+                    md,
+                    logger=logger,
+                    **context,
+                )
+            except Exception as e:
+                recoverable_error("Markdown filter '%s' failed on page %s: %s" %
+                              (filter_name, self, e),
+                              self.config.bypass_errors, error=e)
 
         logger.debug("... markdown is ready")
         self.md = md
@@ -248,7 +378,7 @@ class DactylPage:
             return self.md
         elif self.rawtext is not None:
             return self.rawtext
-        elif not self.skip_pp and self.pp_template is not None:
+        elif not self.skip_pp and self.pp_template_name is not None:
             return self.preprocess(context)
         else:
             logger.debug("page %s has no rawtext or pp_template"%self.data)
@@ -264,76 +394,244 @@ class DactylPage:
             return self.html
 
         md = self.md_content(context)
+        pipeline = self.filter_pipeline()
+        mode = context.get("mode", "html")
+
+        extensions = ["markdown.extensions.extra",
+                      "markdown.extensions.sane_lists"]
+        no_highlighting = self.config.get("no_highlighting", False)
+        if "no_highlighting" in self.data:
+            no_highlighting = self.data["no_highlighting"]
+        if not no_highlighting:
+            extensions.append("codehilite")
+            if self.config.highlight_cache:
+                extensions.append("dactyl.highlight_cache")
+        # Filters to run on the tree that Python-Markdown makes, if they can
+        markdown_filters = []
+        if self.config["markdown_engine"] == "python-markdown":
+            markdown_filters = pipeline.markdown_stage(mode,
+                                        self.config["markdown_filters"])
+            if markdown_filters:
+                extensions.append("dactyl.markdown_filters")
+
+        cache = self.config.html_cache
+        if cache:
+            cache_key = self.html_cache_key(md, extensions, context)
+            cached = cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                logger.debug("... reusing cached HTML")
+                self.toc = cached["toc"]
+                self.data.update(cached["data"])
+                if save:
+                    self.html = cached["html"]
+                return cached["html"]
+
+            # Note what the filters change and whether they use other pages,
+            # so the results can be cached.
+            old_data = dict(self.data)
+            context = track_pages(context)
+            pages = context["pages"]
+            pages_accessed = pages.accessed
+            pages.accessed = False
+        filter_failed = False
+        tree_filters = [] # Filters that ran on the Markdown tree
 
         if md:
             logger.debug("... parsing markdown...")
-            extensions = ["markdown.extensions.extra",
-                          "markdown.extensions.sane_lists"]
-            no_highlighting = self.config.get("no_highlighting", False)
-            if "no_highlighting" in self.data:
-                no_highlighting = self.data["no_highlighting"]
-            if not no_highlighting:
-                extensions.append("codehilite")
-            html = markdown(md, extensions=extensions)
+            converter = self.md_converter(extensions)
+            if markdown_filters:
+                def visit_tree(root):
+                    nonlocal tree_filters, filter_failed
+                    tree_filters, failed = self.visit_tree(root, converter,
+                                                markdown_filters, context)
+                    filter_failed |= failed
+                converter.visit_tree = visit_tree
+            html = converter.convert(md)
         else:
             html = ""
 
         # Apply raw-HTML-string-based filters here
-        for filter_name in self.filters():
-            if "filter_html" in dir(self.config.filters[filter_name]):
-                logger.debug("... applying HTML filter %s" % filter_name)
-                try:
-                    html = self.config.filters[filter_name].filter_html(
-                            html,
-                            logger=logger,
-                            **context,
-                    )
-                except Exception as e:
-                    recoverable_error("HTML filter '%s' failed on page %s: %s" %
-                            (filter_name, self, e), self.config.bypass_errors,
-                            error=e)
-
-        # Some filters would rather operate on a soup than a string.
-        # May as well parse once and re-serialize once.
-        soup = BeautifulSoup(html, "html.parser")
-        self.soup = soup
-
-        # Give each header a unique ID and fill out the Table of Contents
-        self.update_toc()
-
-        # Add a "blurb" attribute to the page
-        self.provide_blurb()
-
-        # Add this page's plaintext field. ElasticSearch upload uses this.
-        self.data["plaintext"] = soup.get_text()
-
-        # Apply soup-based filters here
-        for filter_name in self.filters():
-            if "filter_soup" in dir(self.config.filters[filter_name]):
+        for filter_name, filter_html in pipeline.stage("filter_html", mode,
+                                                       tree_filters):
+            logger.debug("... applying HTML filter %s" % filter_name)
+            try:
+                html = filter_html(
+                        html,
+                        logger=logger,
+                        **context,
+                )
+            except Exception as e:
+                filter_failed = True
+                recoverable_error("HTML filter '%s' failed on page %s: %s" %
+                        (filter_name, self, e), self.config.bypass_errors,
+                        error=e)
+
+        soup_steps = pipeline.soup_steps(mode, tree_filters)
+        soup_html = None
+        if not soup_steps and self.config["html_parser"] == "html.parser":
+            # Write the HTML the way the soup would, so the output doesn't
+            # depend on whether the page's filters use the soup
+            soup_html = soup_form(html)
+        if soup_html is not None:
+            # Nothing needs a soup, so work with the HTML string as-is:
+            # add header IDs, the Table of Contents, blurb, and plaintext
+            self.soup = None
+            html2 = self.update_toc_html(soup_html)
+            self.provide_blurb(html2)
+            self.data["plaintext"] = html_text(html2)
+        else:
+            # Some filters would rather operate on a soup than a string.
+            # May as well parse once and re-serialize once.
+            soup = html_soup(html, self.config["html_parser"])
+            self.soup = soup
+
+            # Give each header a unique ID and fill out the Table of Contents
+            self.update_toc()
+
+            # Add a "blurb" attribute to the page
+            self.provide_blurb()
+
+            # Add this page's plaintext field. ElasticSearch upload uses this.
+            self.data["plaintext"] = soup.get_text()
+
+            # Apply soup-based filters here
+            for hook, step_filters in soup_steps:
+                if hook == "soup_visitors":
+                    filter_failed |= self.visit_soup(soup, step_filters, context)
+                    continue
+                filter_name, filter_soup = step_filters[0]
                 logger.debug("... applying soup filter %s" % filter_name)
                 try:
-                    self.config.filters[filter_name].filter_soup(
+                    filter_soup(
                             soup,
                             logger=logger,
                             **context,
                     )
                     # ^ the soup filters apply to the same object, passed by reference
                 except Exception as e:
+                    filter_failed = True
                     recoverable_error("Soup filter '%s' failed on page %s: %s" %
                                   (filter_name, self, e),
                                   self.config.bypass_errors, error=e)
 
-        logger.debug("... re-rendering HTML from soup...")
-        html2 = str(soup)
+            logger.debug("... re-rendering HTML from soup...")
+            html2 = str(soup)
         if save:
             self.html = html2
+
+        if cache:
+            if pages.accessed:
+                logger.debug("... not caching HTML that uses other pages")
+            elif cache_key and not filter_failed:
+                new_data = {key: val for key,val in self.data.items()
+                            if key not in old_data or old_data[key] is not val}
+                cache.set(cache_key, {
+                    "html": html2,
+                    "toc": self.toc,
+                    "data": new_data,
+                })
+            pages.accessed |= pages_accessed
         return html2
 
+    def visit_soup(self, soup, step_filters, context):
+        """
+        Apply filters' soup visitors to the soup, walking it only once for
+        all of them. Returns True if any of the filters failed.
+        """
+        visitors = []
+        failed = []
+        def on_error(filter_name, e):
+            failed.append(filter_name)
+            recoverable_error("Soup filter '%s' failed on page %s: %s" %
+                          (filter_name, self, e),
+                          self.config.bypass_errors, error=e)
+        for filter_name, soup_visitors in step_filters:
+            logger.debug("... applying soup filter %s" % filter_name)
+            try:
+                visitors.append((filter_name, soup_visitors(
+                        soup,
+                        logger=logger,
+                        **context,
+                )))
+            except Exception as e:
+                on_error(filter_name, e)
+        walk_soup(soup, visitors, on_error)
+        return bool(failed)
+
+    def visit_tree(self, root, md, markdown_filters, context):
+        """
+        Apply filters' Markdown visitors to the tree that Python-Markdown made
+        for this page, walking it only once for all of them. A filter's
+        markdown_visitors returns None if it can't handle the page, and then
+        that filter and the ones after it run on the HTML as usual instead.
+        Returns the names of the filters that ran and whether any failed.
+        """
+        visitors = []
+        ran = []
+        failed = []
+        def on_error(filter_name, e):
+            failed.append(filter_name)
+            recoverable_error("Markdown filter '%s' failed on page %s: %s" %
+                          (filter_name, self, e),
+                          self.config.bypass_errors, error=e)
+        for filter_name, markdown_visitors in markdown_filters:
+            try:
+                selectors = markdown_visitors(
+                        root,
+                        md,
+                        logger=logger,
+                        **context,
+                )
+            except Exception as e:
+                ran.append(filter_name)
+                on_error(filter_name, e)
+                continue
+            if selectors is None:
+                logger.debug("... can't apply filter %s to the Markdown" %
+                             filter_name)
+                break
+            logger.debug("... applying filter %s to the Markdown" % filter_name)
+            ran.append(filter_name)
+            visitors.append((filter_name, selectors))
+        walk_tree(root, visitors, on_error)
+        return ran, bool(failed)
+
+    def html_cache_key(self, md, extensions, context):
+        """
+        Return the key for this page's parsed and filtered HTML in the HTML
+        cache, based on everything that goes into it, or None if some of
+        those inputs can't be hashed.
+        """
+        page_fields = {key: val for key,val in self.data.items()
+                       if key not in BUILT_PAGE_FIELDS}
+        filter_versions = [(f, self.config.filter_version(f))
+                           for f in self.filters()]
+        if None in [v for f,v in filter_versions]:
+            return None
+        versions = [__version__, markdown_module.__version__,
+                    pygments.__version__, bs4.__version__]
+        if self.config["markdown_engine"] == "markdown-it":
+            from dactyl.markdown_it_converter import markdown_it_version
+            versions.append(markdown_it_version)
+        if self.config["html_parser"] != "html.parser":
+            parser_module = importlib.import_module(self.config["html_parser"])
+            versions.append(parser_module.__version__)
+        return self.config.html_cache.make_key(
+            md,
+            extensions,
+            filter_versions,
+            versions,
+            context.get("mode"),
+            context.get("target"),
+            page_fields,
+            self.config.html_settings_hash(),
+        )
+
     @staticmethod
     def idify(utext):
         """Make a string ID-friendly (but more unicode-friendly)"""
-        utext = re.sub(r'[^\w\s-]', '', utext).strip().lower()
-        utext = re.sub(r'[\s-]+', '-', utext)
+        utext = id_unsafe_chars.sub('', utext).strip().lower()
+        utext = id_separators.sub('-', utext)
         if not len(utext):
             # Headers must be non-empty
             return '_'
@@ -360,9 +658,10 @@ class DactylPage:
         uniqIDs = {}
         headermap = {}
         headers = self.soup.find_all(name=re.compile("h[1-6]"))
-        hoveranchor_contents = self.data.get("hover_anchors", False)
+        hover_anchor = self.hover_anchor()
         for h in headers:
-            h_id = self.idify(h.get_text())
+            text = h.get_text()
+            h_id = self.idify(text)
             if h_id not in uniqIDs.keys():
                 uniqIDs[h_id] = 0
             else:
@@ -372,53 +671,140 @@ class DactylPage:
 
             h["id"] = h_id
             self.toc.append({
-                "text": h.get_text(),
+                "text": text,
                 "id": h_id,
                 "level": int(h.name[1])
             })
 
-            if hoveranchor_contents:
+            if hover_anchor:
                 hoverlink = self.soup.new_tag("a", attrs={
                         "href": "#"+h_id,
                         "class": "hover_anchor",
                         "aria-hidden": "true"})
-                # parse & insert the configured text/HTML contents for the anchors
-                hoverlink.append(BeautifulSoup(hoveranchor_contents, "html.parser"))
+                # insert copies of the configured text/HTML contents
+                contents, hover_text = hover_anchor[:2]
+                for el in contents:
+                    hoverlink.append(copy(el))
                 h.append(hoverlink)
+                text += hover_text
 
+            # ElasticSearch doesn't like dots in keys, so escape those
+            escaped_name = text.replace(".","-")
+            headermap[escaped_name] = "#"+h_id
+        self.data["headermap"] = headermap
+
+    def hover_anchor(self):
+        """
+        Return the parsed contents of this page's hover anchors, as a list of
+        elements to copy into each anchor, their text, and the HTML of an
+        anchor as the soup writes it, with "%s" for the header's ID. Pages with
+        the same hover_anchors setting (usually from their target) share
+        these, so the HTML is only parsed once. Returns None if the page has
+        no hover anchors.
+        """
+        hoveranchor_contents = self.data.get("hover_anchors", False)
+        if not hoveranchor_contents:
+            return None
+        key = (hoveranchor_contents, self.config["html_parser"])
+        if key not in self.config.hover_anchors:
+            soup = html_soup(hoveranchor_contents, self.config["html_parser"])
+            hoverlink = soup.new_tag("a", attrs={
+                    "href": "#\x00",
+                    "class": "hover_anchor",
+                    "aria-hidden": "true"})
+            contents = list(soup.contents)
+            for el in contents:
+                hoverlink.append(copy(el))
+            hover_html = str(hoverlink).replace("%", "%%").replace("\x00", "%s")
+            self.config.hover_anchors[key] = (contents, soup.get_text(),
+                                              hover_html)
+        return self.config.hover_anchors[key]
+
+    def update_toc_html(self, html):
+        """
+        Like update_toc(), but for an HTML string instead of the soup, so the
+        HTML doesn't have to be parsed. Returns the HTML with the headers'
+        IDs and hover anchors added. If the HTML is written the way the soup
+        writes it (see soup_form()), so is the result.
+        """
+        self.toc = []
+        uniqIDs = {}
+        headermap = {}
+        hover_anchor = self.hover_anchor()
+        def update_header(m):
+            if m.group("skip"):
+                return m.group(0)
+            text = html_text(m.group("contents"))
+            h_id = self.idify(text)
+            if h_id not in uniqIDs.keys():
+                uniqIDs[h_id] = 0
+            else:
+                # not unique, append -1, -2, etc. to this instance
+                uniqIDs[h_id] += 1
+                h_id = "{id}-{n}".format(id=h_id, n=uniqIDs[h_id])
+
+            # Replace the header's ID, if it has one, or add one, keeping the
+            # attributes in order like the soup does
+            attrs = {name.lower(): value for name, value
+                     in html_attr.findall(m.group("attrs"))}
+            attrs["id"] = '="%s"' % h_id
+            attrs = "".join(" %s%s" % (name, attrs[name])
+                            for name in sorted(attrs))
+            self.toc.append({
+                "text": text,
+                "id": h_id,
+                "level": int(m.group("tag")[1])
+            })
+
+            contents = m.group("contents")
+            if hover_anchor:
+                contents += hover_anchor[2] % h_id
+                text += hover_anchor[1]
 
             # ElasticSearch doesn't like dots in keys, so escape those
-            escaped_name = h.get_text().replace(".","-")
+            escaped_name = text.replace(".","-")
             headermap[escaped_name] = "#"+h_id
+            return "<%s%s>%s%s" % (m.group("tag"), attrs, contents,
+                                   m.group("close"))
+
+        html = html_header_element.sub(update_header, html)
         self.data["headermap"] = headermap
+        return html
 
     def legacy_toc(self):
         """
         Return an HTML table of contents in the legacy format from the internal
         table of contents list.
         """
-        soup = BeautifulSoup("", "html.parser")
-        for h in self.toc:
-            if h["level"] > 3:
-                # legacy toc only goes down to h3
-                continue
-            a = soup.new_tag("a", href="#"+h["id"])
-            a.string = h["text"]
-            li = soup.new_tag("li")
-            li["class"] = "level-{n}".format(n=h["level"])
-            li.append(a)
-            soup.append(li)
-            soup.append("\n")
-        return str(soup)
+        return "".join('<li class="level-%d"><a href="#%s">%s</a></li>\n' %
+                       (h["level"], h["id"], html_escape(h["text"], quote=False))
+                       for h in self.toc
+                       # legacy toc only goes down to h3
+                       if h["level"] <= 3)
 
-    def provide_blurb(self):
+    def provide_blurb(self, html=None):
         """
         Add a "blurb" field, based on the first paragraph in the page, if one
-        is not already provided.
+        is not already provided. Uses the soup unless the page's HTML is given.
         """
         if "blurb" in self.data:
             return
-        p = self.soup.find("p")
+        soup = self.soup
+        if html is not None:
+            for m in html_paragraph.finditer(html):
+                if m.group("skip"):
+                    continue
+                text = html_text(m.group("contents"))
+                if text.strip():
+                    self.data["blurb"] = text
+                    return
+                # Look for a paragraph with text among the empty one's
+                # siblings, which needs a soup
+                soup = html_soup(html, self.config["html_parser"])
+                break
+            else:
+                soup = html_soup("", self.config["html_parser"])
+        p = soup.find("p")
         while p:
             if p.get_text().strip():
                 self.data["blurb"] = p.get_text()
@@ -437,10 +823,12 @@ class DactylPage:
         # TODO: try block around html_content()?
         html_content = self.html_content(context)
 
+        legacy_toc = self.legacy_toc()
+
         out_html = use_template.render(
             content=html_content,
-            sidebar_content=self.legacy_toc(),
-            page_toc=self.legacy_toc(),
+            sidebar_content=legacy_toc,
+            page_toc=legacy_toc,
             headers=self.toc,
             **context,
             **self.filter_exports(),
@@ -544,19 +932,18 @@ class DactylPage:
         Return a set of values exported by filters to be added to the context
         when preprocessing and rending the page.
         """
+        return self.filter_pipeline(save=False).exports
 
-        exported_vals = {}
-        page_filters = self.filters(save=False)
-        for filter_name in page_filters:
-            if filter_name not in self.config.filters.keys():
-                logger.debug("Skipping unloaded filter '%s'" % filter_name)
-                continue
-            if "export" in dir(self.config.filters[filter_name]):
-                for key,val in self.config.filters[filter_name].export.items():
-                    if key in exported_vals.keys():
-                        logger.warning("Export '{key}' from filter {filter_name} overwrites previous value. Another filter exported the same key?".format(key=key, filter_name=filter_name))
-                    exported_vals[key] = val
-        return exported_vals
+    def filter_pipeline(self, save=True):
+        """
+        Return the compiled pipeline of filters to run on this page. Pages
+        with the same filters share a pipeline.
+        """
+        key = tuple(self.filters(save=save))
+        if key not in self.config.filter_pipelines:
+            self.config.filter_pipelines[key] = FilterPipeline(
+                    [(name, self.config.filters[name]) for name in key])
+        return self.config.filter_pipelines[key]
 
     def is_virtual(self):
         """
@@ -90,7 +90,8 @@ class DactylTarget:
         Create a target from an API spec path.
         """
 
-        openapi = ApiDef.from_path(spec_path)
+        openapi = ApiDef.from_path(spec_path,
+                bytecode_cache=self.config.bytecode_cache("openapi"))
         t = {
             "name": openapi.api_slug,
             "display_name": openapi.api_title,
@@ -166,7 +167,8 @@ class DactylTarget:
 
         template_path = page_data.get(OPENAPI_TEMPLATE_PATH_KEY, None)
         swagger = ApiDef.from_path(page_data[OPENAPI_SPEC_KEY], api_slug,
-                                       extra_fields, template_path)
+                                       extra_fields, template_path,
+                                       self.config.bytecode_cache("openapi"))
         skip_pp = self.config.get("skip_preprocessor", False)
         made_pages = []
         for p in swagger.create_pagelist():
@@ -253,15 +255,40 @@ class DactylTarget:
         self.find_hierarchy()
         return pages
 
+    def reload_page(self, page):
+        """
+        Reload one of this target's pages from its definition and source, and
+        pass on the target's fields again.
+        """
+        page.reload()
+        # The page's filenames may have changed
+        self.config.xref_index = None
+        merge_dicts(self.data, page.data, RESERVED_KEYS_TARGET)
+        if page is not self.cover and "filters" in self.data:
+            page.gain_filters(self.data["filters"])
+
+    def update_hierarchy(self):
+        """
+        Rebuild the "children" arrays after pages' "parent" links change.
+        """
+        for p in self.pages:
+            if type(p.data.get("children")) == list:
+                p.data["children"] = list(p.definition.get("children", []))
+        self.find_hierarchy()
+
     def find_hierarchy(self):
         """
         Adds "children" arrays to pages to mirror "parent" links.
         """
+        # Index pages by html field; the first page wins if there are repeats
+        pages_by_html = {}
+        for p in self.pages:
+            pages_by_html.setdefault(p.data["html"], p)
+
         for p in self.pages:
             if "parent" in p.data.keys():
-                try:
-                    parent = next((pg for pg in self.pages if pg.data["html"] == p.data["parent"]))
-                except StopIteration:
+                parent = pages_by_html.get(p.data["parent"])
+                if parent is None:
                     logger.warning("parent '%s' value not found in this target"%p.data["parent"])
                     continue
 
@@ -272,7 +299,7 @@ class DactylTarget:
                     else:
                         # Add this child to the parent's existing list if it's
                         # not already there.
-                        if p.data not in parent.data["children"]:
+                        if not any(kid is p.data for kid in parent.data["children"]):
                             parent.data["children"].append(p.data)
                 else:
                     # Start a new child list at the parent
@@ -282,26 +309,72 @@ class DactylTarget:
                 # Start an empty list of children
                 p.data["children"] = []
 
+        # Separate loop so we don't miss it where the parent isn't in-target
+        descendants = {}
         for p in self.pages:
-            # Separate loop so we don't miss it where the parent isn't in-target
-            p.data["is_ancestor_of"] = self.make_ancestor_lookup(p)
+            p.data["is_ancestor_of"] = self.make_ancestor_lookup(
+                    self.find_descendants(p.data, descendants))
 
     @staticmethod
-    def make_ancestor_lookup(p):
-        # logger.debug("defining is_ancestor_of for %s"%p)
+    def find_descendants(page_data, descendants):
+        """
+        Return the set of html fields of a page's direct and indirect
+        children. descendants maps id(page data) to sets already found, so
+        each page's set is only built once per target.
+        """
+        key = id(page_data)
+        if key in descendants:
+            return descendants[key]
+        found = set()
+        # Mark this page as in progress, in case the hierarchy has a loop
+        descendants[key] = found
+        kids = page_data.get("children")
+        if type(kids) == list:
+            for kid in kids:
+                found.add(kid.get("html"))
+                if type(kid.get("children")) == list:
+                    found |= DactylTarget.find_descendants(kid, descendants)
+        descendants[key] = frozenset(found)
+        return descendants[key]
+
+    @staticmethod
+    def make_ancestor_lookup(descendants):
+        """
+        Return an is_ancestor_of function, which checks whether a page's html
+        field is in the given set of descendants.
+        """
         def is_ancestor_of(html):
-            if "children" not in p.data.keys():
-                return False
-            if type(p.data["children"]) != list:
-                return False
-            for kid in p.data["children"]:
-                if kid["html"] == html:
-                    return True
-                if kid["is_ancestor_of"](html):
-                    return True
-            return False
+            return html in descendants
         return is_ancestor_of
 
+    def page_indexes(self):
+        """
+        Return dictionaries for looking up this target's pages' data by
+        their html, md, category, and parent fields, for templates and
+        filters. Where several pages have the same html or md value, the
+        first one wins. Categories and parents map to lists of pages, in
+        order.
+        """
+        by_html = {}
+        by_md = {}
+        by_category = {}
+        by_parent = {}
+        for page in self.pages:
+            data = page.data
+            by_html.setdefault(data.get("html"), data)
+            if "md" in data:
+                by_md.setdefault(data["md"], data)
+            if "category" in data:
+                by_category.setdefault(data["category"], []).append(data)
+            if "parent" in data:
+                by_parent.setdefault(data["parent"], []).append(data)
+        return {
+            "pages_by_html": by_html,
+            "pages_by_md": by_md,
+            "pages_by_category": by_category,
+            "pages_by_parent": by_parent,
+        }
+
     def categories(self):
         """Produce an ordered, de-duplicated list of categories from
            this target's page list"""
@@ -0,0 +1,126 @@
+################################################################################
+## Tree Navigation
+##
+## Renders the tree-nav.html navigation once per target, then fills in which
+## entries are active or expanded for each page, instead of walking the whole
+## tree in the template for every page.
+################################################################################
+
+from dactyl.common import *
+from dactyl.target import DactylTarget
+
+# Marks the places in a rendered skeleton that depend on the current page
+SLOT_MARKER = "\x00nav-slot\x00"
+
+# What to fill in each kind of slot with, for entries that are the current
+# page, entries that are its ancestors, and other entries
+SLOT_VALUES = {
+    "item_class":    {"active": "active", "parent": "active-parent", None: ""},
+    "toggler_class": {"active": "", "parent": "", None: "collapsed"},
+    "expanded":      {"active": "true", "parent": "true", None: "false"},
+    "group_class":   {"active": "show ", "parent": "show ", None: "collapse"},
+}
+
+class NavSkeleton:
+    """
+    Navigation HTML rendered once for a tree, with slots for the parts that
+    depend on the current page. Templates call its item_class(), toggler_class(),
+    expanded(), and group_class() methods for each entry while rendering it.
+    """
+    def __init__(self):
+        self.entries = [] # page data of each distinct entry, in order
+        self.entry_ids = {} # id(page data) -> index in entries
+        self.slots = [] # (entry index, kind) for each slot, in order
+        self.parts = None
+
+    def slot(self, pg, kind):
+        key = id(pg)
+        if key not in self.entry_ids:
+            self.entry_ids[key] = len(self.entries)
+            self.entries.append(pg)
+        self.slots.append((self.entry_ids[key], kind))
+        return SLOT_MARKER
+
+    def item_class(self, pg):
+        return self.slot(pg, "item_class")
+
+    def toggler_class(self, pg):
+        return self.slot(pg, "toggler_class")
+
+    def expanded(self, pg):
+        return self.slot(pg, "expanded")
+
+    def group_class(self, pg):
+        return self.slot(pg, "group_class")
+
+    def finish(self, html):
+        """
+        Index the HTML that was rendered with this skeleton's slots, so pages
+        can fill them in quickly.
+        """
+        text = html.split(SLOT_MARKER)
+        if len(text) != len(self.slots) + 1:
+            raise ValueError("tree navigation has %d slots but %d markers" %
+                             (len(self.slots), len(text) - 1))
+        # Every other part is a slot, filled in for pages outside this tree
+        self.parts = [text[0]]
+        self.slot_positions = [[] for entry in self.entries]
+        for i, (entry, kind) in enumerate(self.slots):
+            self.slot_positions[entry].append((len(self.parts), kind))
+            self.parts.append(SLOT_VALUES[kind][None])
+            self.parts.append(text[i+1])
+
+        # html -> indexes of entries with that html, and of their ancestors
+        self.entries_by_html = {}
+        self.ancestors_by_html = {}
+        descendants = {}
+        for i, pg in enumerate(self.entries):
+            self.entries_by_html.setdefault(pg.get("html"), []).append(i)
+            for html in DactylTarget.find_descendants(pg, descendants):
+                self.ancestors_by_html.setdefault(html, []).append(i)
+
+    def render(self, currentpage):
+        """
+        Return the navigation HTML for the given page, with the page's entry
+        active and the entries of its ancestors expanded.
+        """
+        html = currentpage.get("html")
+        states = {i: "parent" for i in self.ancestors_by_html.get(html, [])}
+        for i in self.entries_by_html.get(html, []):
+            if self.entries[i] == currentpage:
+                states[i] = "active"
+        if not states:
+            return "".join(self.parts)
+        parts = list(self.parts)
+        for i, state in states.items():
+            for pos, kind in self.slot_positions[i]:
+                parts[pos] = SLOT_VALUES[kind][state]
+        return "".join(parts)
+
+class TreeNav:
+    """
+    A Jinja global for rendering tree navigation with a call block:
+
+        {% call(nav) tree_nav(tree_top, currentpage) %}
+        ...
+        {% endcall %}
+
+    The block is only rendered once for each tree_top and URL prefix, with
+    the nav argument's methods marking the parts that depend on the current
+    page, so the block shouldn't use any other fields of the current page.
+    """
+    def __init__(self):
+        self.skeletons = {}
+
+    def reset(self):
+        """Forget rendered navigation, for when the pages' hierarchy changes"""
+        self.skeletons = {}
+
+    def __call__(self, tree_top, currentpage, caller):
+        key = (id(tree_top), currentpage.get("prefix"))
+        if key not in self.skeletons:
+            skeleton = NavSkeleton()
+            skeleton.finish(caller(skeleton))
+            # Keep tree_top so its id isn't reused while the skeleton exists
+            self.skeletons[key] = (tree_top, skeleton)
+        return self.skeletons[key][1].render(currentpage)
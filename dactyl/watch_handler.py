@@ -1,25 +1,224 @@
 ################################################################################
 # Dactyl watch mode handler class
 ################################################################################
+from fnmatch import fnmatch
+import threading
+
 from watchdog.events import PatternMatchingEventHandler
 
 from dactyl.common import *
+from dactyl.manifest import PageDependencies, DYNAMIC_TEMPLATE, MANIFEST_SUFFIX
+
+# Types of events that mean a file changed
+CHANGE_EVENTS = ("created", "modified", "deleted", "moved")
 
 class UpdaterHandler(PatternMatchingEventHandler):
-    """Updates to pattern-matched files means rendering."""
+    """
+    Updates to pattern-matched files means rendering. Keeps the target's pages
+    loaded between updates and only rebuilds the pages that use the changed
+    files.
+
+    Changes are collected until no more arrive for the configured quiet
+    period, then handled all at once in a separate thread. If more changes
+    arrive while that's building, the build stops and starts over with all
+    the changes.
+    """
     def __init__(self, builder):
         self.builder = builder
-        # Match on any change. Note, this causes an infinite build loop if the
-        # output directory is inside the template or content directory.
+        self.deps = PageDependencies(builder)
+        config = builder.config
+
+        self.ignore_globs = config["watch_ignore"]
+        # Never rebuild because of Dactyl's own output and temp files
+        temp_path = os.path.abspath(config["temporary_files_path"])
+        out_path = os.path.abspath(builder.config["out_path"])
+        self.ignore_dirs = [
+            out_path,
+            out_path + STAGING_SUFFIX,
+            out_path + PREVIOUS_SUFFIX,
+            os.path.join(temp_path, "dactyl_cache"),
+        ]
+        self.ignore_globs = self.ignore_globs + [
+            os.path.join(temp_path, "dactyl-*"),
+            out_path + "*" + MANIFEST_SUFFIX + "*",
+        ]
+
+        self.quiet_period = config["watch_quiet_period"]
+        # Pages that a cancelled build didn't finish
+        self.unbuilt = []
+        self.pending = set()
+        self.last_change = 0
+        self.building = False
+        self.lock = threading.Condition()
+        builder.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self.run_updates, daemon=True)
+        self.thread.start()
+
         patterns = ["*"]
-        PatternMatchingEventHandler.__init__(self, patterns)
+        PatternMatchingEventHandler.__init__(self, patterns=patterns)
 
     def on_any_event(self, event):
-        logger.debug("watch: got event!")
-        # Set builder to bypass errors, because a file temporarily not existing
-        #  should not cause watch mode to fail
-        self.builder.config.bypass_errors=True
-        self.builder.config.load_pages()
-        self.builder.build()
+        if event.is_directory or event.event_type not in CHANGE_EVENTS:
+            # Reading files also causes events on some platforms
+            return
+        paths = [event.src_path]
+        if getattr(event, "dest_path", None):
+            paths.append(event.dest_path)
+        paths = [os.path.abspath(p) for p in paths]
+        paths = [p for p in paths if not self.ignored(p)]
+        if not paths:
+            return
+        logger.debug("watch: got event for %s" % ", ".join(paths))
+
+        with self.lock:
+            self.pending.update(paths)
+            self.last_change = time.monotonic()
+            if self.building:
+                self.builder.cancel_event.set()
+            self.lock.notify()
+
+    def ignored(self, path):
+        """
+        Report whether changes to the file at the given path should be ignored.
+        """
+        for folder in self.ignore_dirs:
+            if path == folder or path.startswith(folder + os.sep):
+                return True
+        filename = os.path.basename(path)
+        return any(fnmatch(path, pattern) or fnmatch(filename, pattern)
+                   for pattern in self.ignore_globs)
+
+    def run_updates(self):
+        """
+        Wait for changes to settle, then update the output, forever.
+        """
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.lock.wait()
+                while True:
+                    remaining = (self.last_change + self.quiet_period -
+                                 time.monotonic())
+                    if remaining <= 0:
+                        break
+                    self.lock.wait(remaining)
+                paths = self.pending
+                self.pending = set()
+                self.builder.cancel_event.clear()
+                self.building = True
+
+            # Set builder to bypass errors, because a file temporarily not
+            #  existing should not cause watch mode to fail
+            self.builder.config.bypass_errors=True
+            try:
+                self.update(paths)
+            except BuildCancelled:
+                logger.info("files changed during the build; starting over")
+                with self.lock:
+                    self.pending.update(paths)
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                logger.error("Update failed: %s" % e)
+            finally:
+                with self.lock:
+                    self.building = False
+
+    def update(self, paths):
+        """
+        Copy or rebuild whatever depends on the files at the given paths.
+        """
+        changed = set(p for p in paths if not self.builder.copy_static_file(p))
+        if not changed and not self.unbuilt:
+            return
+
+        target = self.builder.target
+        pages = [p for p in target.pages if not p.is_virtual()]
+        content_changed = self.changed_under(changed, self.builder.config["content_path"])
+        template_changed = self.changed_under(changed, self.builder.config.get("template_path"))
+
+        # Pages whose contents need to be loaded again, and pages that only
+        # need to be rendered again with their existing contents
+        reload = []
+        render = []
+        for page in pages:
+            templates = self.deps.templates(page)
+            if (changed & templates["pp_files"] or (content_changed and
+                    DYNAMIC_TEMPLATE in templates["pp_files"])):
+                reload.append(page)
+            elif (changed & templates["template_files"] or (template_changed and
+                    DYNAMIC_TEMPLATE in templates["template_files"])):
+                render.append(page)
+        if not reload and not render and not self.unbuilt:
+            logger.debug("watch: no pages use %s" % ", ".join(changed))
+            return
+
+        self.deps.forget(reload, changed)
+        nav_before = {id(page): self.deps.nav_fields(page.data)
+                      for page in reload}
+        for page in reload:
+            logger.info("reloading page: %s" % page)
+        reload = self.reload_pages(reload)
+
+        if any(nav_before[id(page)] != self.deps.nav_fields(page.data)
+               for page in reload):
+            logger.info("navigation changed; rebuilding all pages")
+            loaded = reload + self.reload_pages(
+                    [page for page in target.pages if page not in reload])
+            target.update_hierarchy()
+            self.deps.forget(target.pages)
+            self.rebuild(loaded)
+            return
+
+        rebuild = reload + render
+        if reload:
+            # Pages that show other pages' contents: parents can display
+            # their children's blurbs, and preprocessing can use anything.
+            for page in reload:
+                rebuild += self.deps.ancestors(page)
+            rebuild += self.reload_pages([page for page in pages
+                    if page not in rebuild and
+                    self.deps.templates(page)["pp_uses_site"]])
+        self.rebuild(rebuild)
+
+    def reload_pages(self, pages):
+        """
+        Load the given pages again from their sources, and return the ones
+        that loaded. A page that fails to load, for example because its file
+        is being replaced, keeps its old contents until it changes again.
+        """
+        loaded = []
+        for page in pages:
+            try:
+                self.builder.target.reload_page(page)
+            except Exception as e:
+                logger.warning("Couldn't reload page '%s': %s" % (page, e))
+                continue
+            loaded.append(page)
+        return loaded
+
+    def rebuild(self, pages):
+        """
+        Build the given pages, plus any that the last build didn't finish
+        because it was cancelled.
+        """
+        self.unbuilt += [p for p in pages if p not in self.unbuilt]
+        try:
+            self.builder.build(rebuild=self.unbuilt)
+        except BuildCancelled:
+            # Some pages may have been built already, which changes what
+            # their parents show, so start them over from the source.
+            self.reload_pages(self.unbuilt)
+            raise
+        self.unbuilt = []
+        self.builder.report_output()
         logger.info("done rendering")
-        self.builder.copy_static()
+
+    @staticmethod
+    def changed_under(changed, folder):
+        """
+        Report whether any of the changed paths are inside the given folder.
+        """
+        if not folder:
+            return False
+        folder = os.path.abspath(folder) + os.sep
+        return any(path.startswith(folder) for path in changed)
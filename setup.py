@@ -45,7 +45,7 @@ setup(
         'argparse',
         'beautifulsoup4',
         'jinja2>=2.11',
-        'Markdown>=3.0.1',
+        'Markdown>=3.7',
         'ruamel.yaml',
         'requests',
         'watchdog',
@@ -53,6 +53,11 @@ setup(
         'pyspellchecker',
         'pygments'
     ],
+    extras_require={
+        'markdown-it': ['markdown-it-py>=3.0', 'mdit-py-plugins>=0.4'],
+        'lxml': ['lxml'],
+        'html5lib': ['html5lib'],
+    },
     package_data={
         '': [
             "templates/*",
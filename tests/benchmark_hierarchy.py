@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Benchmark for finding a target's page hierarchy and checking which pages
+# are ancestors of which, as the tree-nav template does for every page.
+# Compares the html index and precomputed descendant sets with scanning the
+# page list for each parent and walking each subtree for each check, which
+# Dactyl used to do.
+
+import sys
+import time
+import types
+
+from unit_shared import *
+
+from dactyl.target import DactylTarget
+
+LEVEL_SIZES = [1, 6, 30, 150, 600]
+
+def make_pages(num_pages):
+    """Make a 6-level tree of page stand-ins with num_pages pages in all"""
+    sizes = LEVEL_SIZES + [num_pages - sum(LEVEL_SIZES)]
+    levels = []
+    pages = []
+    for depth, size in enumerate(sizes):
+        level = []
+        for i in range(size):
+            data = {"html": "page-%d-%d.html" % (depth, i)}
+            if levels:
+                data["parent"] = levels[-1][i % len(levels[-1])].data["html"]
+            level.append(types.SimpleNamespace(data=data))
+        levels.append(level)
+        pages += level
+    return pages
+
+def old_find_hierarchy(pages):
+    for p in pages:
+        if "parent" in p.data.keys():
+            try:
+                parent = next((pg for pg in pages if pg.data["html"] == p.data["parent"]))
+            except StopIteration:
+                continue
+            if "children" in parent.data.keys():
+                if p.data not in parent.data["children"]:
+                    parent.data["children"].append(p.data)
+            else:
+                parent.data["children"] = [p.data]
+        if "children" not in p.data.keys():
+            p.data["children"] = []
+    for p in pages:
+        p.data["is_ancestor_of"] = old_ancestor_lookup(p.data)
+
+def old_ancestor_lookup(data):
+    def is_ancestor_of(html):
+        for kid in data["children"]:
+            if kid["html"] == html:
+                return True
+            if kid["is_ancestor_of"](html):
+                return True
+        return False
+    return is_ancestor_of
+
+def find_hierarchy(pages):
+    target = DactylTarget.__new__(DactylTarget)
+    target.pages = pages
+    target.find_hierarchy()
+
+def check_ancestors(pages, current_pages):
+    start = time.perf_counter()
+    results = [[p.data["is_ancestor_of"](cur.data["html"]) for p in pages]
+               for cur in current_pages]
+    return time.perf_counter() - start, results
+
+def main(num_pages, num_current):
+    results = {}
+    for name, func in (("old", old_find_hierarchy), ("new", find_hierarchy)):
+        pages = make_pages(num_pages)
+        start = time.perf_counter()
+        func(pages)
+        hierarchy_time = time.perf_counter() - start
+        # Check every page against a sample of current pages from all levels
+        current_pages = pages[::max(1, num_pages // num_current)]
+        check_time, results[name] = check_ancestors(pages, current_pages)
+        print("%s: find_hierarchy %.3fs, is_ancestor_of for %d pages x %d: %.3fs" %
+              (name, hierarchy_time, num_pages, len(current_pages), check_time))
+    assert results["old"] == results["new"], "Ancestor checks differ"
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20)
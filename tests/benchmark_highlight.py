@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Benchmark for converting code-heavy Markdown with syntax highlighting.
+# Compares highlighting every code block with reusing blocks from the
+# highlighted code cache, and with not guessing the language of code blocks
+# that don't specify one.
+
+import sys
+import tempfile
+import time
+
+from markdown import markdown
+
+from unit_shared import *
+
+from dactyl.disk_cache import DiskCache
+from dactyl.highlight_cache import HighlightCacheExtension
+
+EXTENSIONS = ["markdown.extensions.extra", "markdown.extensions.sane_lists",
+              "codehilite"]
+
+SNIPPETS = [
+    ("python", "def fib(n):\n    a, b = 0, 1\n    for i in range(n):\n"
+               "        a, b = b, a + b\n    return a\n"),
+    ("js", "const request = {\n  method: \"account_info\",\n"
+           "  params: [{account: \"rHb9CJAWyB4rj91VRWn96DkukG4bwdtyTh\"}]\n};\n"
+           "api.send(request).then(console.log);\n"),
+    ("json", "{\n  \"result\": {\n    \"status\": \"success\",\n"
+             "    \"ledger_index\": 6760970\n  }\n}\n"),
+    ("", "$ curl -X POST http://localhost:5005/ \\\n"
+         "    -d '{\"method\": \"server_info\"}'\n"),
+]
+
+def make_page(i):
+    blocks = ["# Code Page %d" % i]
+    for j in range(20):
+        lang, code = SNIPPETS[(i + j) % len(SNIPPETS)]
+        blocks.append("Example %d:\n\n```%s\n%s# %d\n```" % (j, lang, code, i * 20 + j))
+    return "\n\n".join(blocks)
+
+def convert(texts, extensions, extension_configs={}):
+    start = time.perf_counter()
+    results = [markdown(text, extensions=extensions,
+                        extension_configs=extension_configs) for text in texts]
+    return time.perf_counter() - start, results
+
+def main(num_pages):
+    texts = [make_page(i) for i in range(num_pages)]
+    plain_time, plain_html = convert(texts, EXTENSIONS)
+    no_guess_time, no_guess_html = convert(texts, EXTENSIONS,
+                                           {"codehilite": {"guess_lang": False}})
+    with tempfile.TemporaryDirectory() as cache_path:
+        cache = DiskCache("highlighted code", cache_path, 100 * 1024 * 1024)
+        extensions = EXTENSIONS + [HighlightCacheExtension(cache=cache)]
+        cold_time, cold_html = convert(texts, extensions)
+        warm_time, warm_html = convert(texts, extensions)
+
+    assert plain_html == cold_html == warm_html, "Cached HTML differs"
+    print("Converted %d pages with %d code blocks each" % (num_pages, 20))
+    print("  highlighting every block:         %.3fs" % plain_time)
+    print("  without guessing languages:       %.3fs" % no_guess_time)
+    print("  with an empty highlight cache:    %.3fs" % cold_time)
+    print("  with a full highlight cache:      %.3fs" % warm_time)
+    print("  speedup with a full cache: %.1fx" % (plain_time / warm_time))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
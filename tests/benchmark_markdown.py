@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# Benchmark for converting pages' Markdown to HTML. Compares reusing one
+# converter per set of extensions, as pages do now, with setting up a new
+# converter for every page, which Dactyl used to do.
+
+import os
+import sys
+import time
+
+from markdown import markdown
+
+from unit_shared import *
+
+from dactyl.page import DactylPage
+
+CONTENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "examples", "content")
+# The same extensions DactylPage.html_content uses
+EXTENSIONS = ["markdown.extensions.extra", "markdown.extensions.sane_lists",
+              "codehilite"]
+
+def read_pages():
+    texts = []
+    for dirpath, dirnames, filenames in os.walk(CONTENT_PATH):
+        for filename in sorted(filenames):
+            if filename.endswith(".md"):
+                with open(os.path.join(dirpath, filename), encoding="utf-8") as f:
+                    texts.append(f.read())
+    return texts
+
+def convert_each(texts, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        results = [markdown(text, extensions=EXTENSIONS) for text in texts]
+    return time.perf_counter() - start, results
+
+def convert_shared(texts, rounds):
+    page = DactylPage(mockconfig, {"md": "index.md"})
+    start = time.perf_counter()
+    for i in range(rounds):
+        results = [page.md_converter(EXTENSIONS).convert(text) for text in texts]
+    return time.perf_counter() - start, results
+
+def main(rounds):
+    texts = read_pages()
+    each_time, each_html = convert_each(texts, rounds)
+    shared_time, shared_html = convert_shared(texts, rounds)
+
+    assert each_html == shared_html, "Converted HTML differs"
+    num_pages = len(texts) * rounds
+    print("Converted %d pages (%d example pages, %d times)" %
+          (num_pages, len(texts), rounds))
+    print("  with a new converter per page: %.3fs (%.2fms/page)" %
+          (each_time, each_time * 1000 / num_pages))
+    print("  with a shared converter:       %.3fs (%.2fms/page)" %
+          (shared_time, shared_time * 1000 / num_pages))
+    print("  speedup: %.1fx" % (each_time / shared_time))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
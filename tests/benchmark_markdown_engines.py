@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Benchmark for converting Markdown with each markdown_engine, using the
+# example content. Runs with and without syntax highlighting, since
+# highlighting takes the same time with either engine.
+
+import glob
+import os
+import sys
+import time
+
+from unit_shared import *
+
+from dactyl.markdown_it_converter import MarkdownItConverter
+from markdown import Markdown
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+CONTENT_PATH = os.path.join(TESTS_PATH, "..", "examples", "content")
+EXTENSIONS = ["markdown.extensions.extra", "markdown.extensions.sane_lists"]
+
+def load_texts():
+    texts = []
+    for path in sorted(glob.glob(os.path.join(CONTENT_PATH, "**", "*.md"),
+                                 recursive=True)):
+        with open(path, encoding="utf-8") as f:
+            texts.append(f.read())
+    return texts
+
+def convert(converter, texts, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        for text in texts:
+            converter.reset().convert(text)
+    return time.perf_counter() - start
+
+def main(rounds):
+    texts = load_texts()
+    num_pages = len(texts) * rounds
+    print("Converting %d pages (%d example pages x %d)" %
+          (num_pages, len(texts), rounds))
+    for highlight in (False, True):
+        extensions = EXTENSIONS + (["codehilite"] if highlight else [])
+        pm_time = convert(Markdown(extensions=extensions), texts, rounds)
+        mdit_time = convert(MarkdownItConverter(highlight=highlight), texts, rounds)
+        print("%s syntax highlighting:" % ("With" if highlight else "Without"))
+        print("  python-markdown: %.3fs (%.2f ms/page)" %
+              (pm_time, pm_time * 1000 / num_pages))
+        print("  markdown-it:     %.3fs (%.2f ms/page)" %
+              (mdit_time, mdit_time * 1000 / num_pages))
+        print("  speedup: %.1fx" % (pm_time / mdit_time))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
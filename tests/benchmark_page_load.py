@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# Benchmark for loading pages' metadata, including guessing their names from
+# their first headers. Compares the lightweight header reader with converting
+# the first two lines of each page as Markdown, which Dactyl used to do.
+
+import os
+import sys
+import tempfile
+import time
+
+from unit_shared import *
+
+import dactyl.page
+from dactyl.page import DactylPage
+
+HEADERS = [
+    "# Getting Started",
+    "# Configuring *Widgets* and `gadgets`",
+    "## The [Widget API](widget-api.html)",
+    "Installation Guide\n==================",
+    "Troubleshooting\n---",
+    "<h1 id=\"intro\">Intro &amp; Overview</h1>",
+    "# Using __init__ in a _module_",
+    "# Release Notes\nThis release adds support for gadgets.",
+]
+
+def make_pages(content_path, num_pages):
+    page_defs = []
+    for i in range(num_pages):
+        filename = "page%d.md" % i
+        with open(os.path.join(content_path, filename), "w", encoding="utf-8") as f:
+            f.write(HEADERS[i % len(HEADERS)] + "\n\nSome text for page %d.\n" % i)
+        page_defs.append({"md": filename, "targets": ["bench"]})
+    return page_defs
+
+def load_pages(page_defs):
+    start = time.perf_counter()
+    pages = [DactylPage(mockconfig, dict(p)) for p in page_defs]
+    return time.perf_counter() - start, [p.data["name"] for p in pages]
+
+def main(num_pages):
+    with tempfile.TemporaryDirectory() as content_path:
+        mockconfig["content_path"] = content_path
+        page_defs = make_pages(content_path, num_pages)
+
+        fast_time, fast_names = load_pages(page_defs)
+
+        # Make every page take the full Markdown conversion path
+        guess_title = dactyl.page.guess_title
+        dactyl.page.guess_title = lambda lines: False
+        try:
+            full_time, full_names = load_pages(page_defs)
+        finally:
+            dactyl.page.guess_title = guess_title
+
+    assert fast_names == full_names, "Guessed names differ"
+    print("Loaded %d pages" % num_pages)
+    print("  with full Markdown conversion: %.3fs" % full_time)
+    print("  with header reader:            %.3fs" % fast_time)
+    print("  speedup: %.1fx" % (full_time / fast_time))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# Benchmark for rendering tree-nav.html's navigation for pages of a large
+# site. Compares rendering the navigation once and filling in each page's
+# active entries with walking the whole tree in the template for every page,
+# which Dactyl used to do.
+
+import sys
+import time
+
+from unit_shared import *
+
+from benchmark_hierarchy import make_pages, find_hierarchy
+from unit_tree_nav import LEGACY_TREE_NAV, make_env
+
+def render_all(template, pages, current_pages):
+    start = time.perf_counter()
+    results = []
+    for currentpage in current_pages:
+        results.append(template.render(pages=pages, currentpage=currentpage))
+    return time.perf_counter() - start, results
+
+def main(num_pages, num_current):
+    pages = make_pages(num_pages)
+    find_hierarchy(pages)
+    pages = [p.data for p in pages]
+    for i, data in enumerate(pages):
+        data["name"] = "Page %d" % i
+        data["prefix"] = "/"
+    current_pages = pages[::max(1, num_pages // num_current)]
+
+    env = make_env()
+    legacy_time, legacy = render_all(env.from_string(LEGACY_TREE_NAV),
+                                     pages, current_pages)
+    new_time, new = render_all(env.get_template("tree-nav.html"),
+                               pages, current_pages)
+    assert legacy == new, "Navigation differs"
+    print("Rendered navigation of %d pages for %d pages" %
+          (num_pages, len(current_pages)))
+    print("  walking the tree for each page: %.3fs" % legacy_time)
+    print("  filling in a rendered tree:     %.3fs" % new_time)
+    print("  speedup: %.1fx" % (legacy_time / new_time))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 30)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Benchmark for resolving xrefs, as the xrefs filter does for every XREF link
+# on every page. Compares the filter's page index with scanning the config's
+# page list for each link, which Dactyl used to do.
+
+import sys
+import time
+
+from dactyl import filter_xrefs
+
+TARGETS = ["en", "ja", "es"]
+
+class Config(dict):
+    """Stand-in for a DactylConfig, which keeps the index between lookups"""
+    xref_index = None
+
+def make_config(num_pages):
+    """Make a config with num_pages pages in 3 targets, some sharing names"""
+    pages = []
+    for i in range(num_pages):
+        target = TARGETS[i % len(TARGETS)]
+        pages.append({
+            "md": "%s/section-%d/page-%d.md" % (target, i % 10, i // 3),
+            "html": "%s-page-%d.html" % (target, i // 3),
+            "targets": [target],
+        })
+    return Config(pages=pages, targets=[{"name": t} for t in TARGETS])
+
+def old_find_file_in_target(fname, targetname, config):
+    if fname[-3:] == ".md":
+        for page in config["pages"]:
+            if "md" not in page:
+                continue
+            elif ("/" in fname and page["md"] == fname
+                    and targetname in page.get("targets",[])
+                    and page.get("html","") ):
+                return page
+            elif ( page["md"].split("/")[-1] == fname
+                    and targetname in page.get("targets",[])
+                    and page.get("html","") ):
+                return page
+
+    for page in config["pages"]:
+        if "html" not in page:
+            continue
+        elif page["html"] != fname:
+            continue
+        if targetname in page.get("targets", []):
+            return page
+    else:
+        return False
+
+def make_xrefs(config, num_xrefs):
+    """Xrefs by md path, md filename, and html filename, some missing"""
+    pages = config["pages"]
+    xrefs = []
+    for i in range(num_xrefs):
+        page = pages[(i * 7919) % len(pages)]
+        xrefs.append([page["md"], page["md"].split("/")[-1], page["html"],
+                      "missing-%d.html" % i][i % 4])
+    return xrefs
+
+def main(num_pages, num_xrefs):
+    config = make_config(num_pages)
+    xrefs = make_xrefs(config, num_xrefs)
+    results = {}
+    for name, func in (("old", old_find_file_in_target),
+                       ("new", filter_xrefs.find_file_in_target)):
+        start = time.perf_counter()
+        results[name] = [func(xref, target, config)
+                         for xref in xrefs for target in TARGETS]
+        print("%s: %d lookups in %d pages: %.3fs" % (name, len(results[name]),
+              num_pages, time.perf_counter() - start))
+    assert results["old"] == results["new"], "Lookups differ"
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
@@ -3,6 +3,7 @@
 import os
 import subprocess
 import sys
+import tempfile
 import unittest
 
 from distutils.dir_util import remove_tree
@@ -70,6 +71,73 @@ class TestDactyl(unittest.TestCase):
         assert os.path.isfile("out/badges.html")
         assert os.path.isfile("out/multicode_tabs.html")
 
+    def test_parallel_build_matches_serial(self):
+        subprocess.check_call(["dactyl_build","-t","filterdemos","-j","1","-o","out/serial"])
+        subprocess.check_call(["dactyl_build","-t","filterdemos","-j","3","-o","out/parallel"])
+        serial_files = sorted(os.listdir("out/serial"))
+        assert serial_files == sorted(os.listdir("out/parallel"))
+        for fname in serial_files:
+            if not fname.endswith(".html"):
+                continue
+            assert Path("out/serial", fname).read_text() == Path("out/parallel", fname).read_text()
+
+    def test_parallel_build_in_batches_matches_serial(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            serial = os.path.join(tmp, "serial")
+            batched = os.path.join(tmp, "batched")
+            subprocess.check_call(["dactyl_build","-t","filterdemos","-j","1","-o",serial])
+            subprocess.check_call(["dactyl_build","-t","filterdemos","-j","3","--max_inflight_pages","2","-o",batched])
+            for fname in os.listdir(serial):
+                if fname.endswith(".html"):
+                    assert Path(serial, fname).read_text() == Path(batched, fname).read_text()
+
+    def test_incremental_build_skips_unchanged_pages(self):
+        subprocess.check_call(["dactyl_build","-t","filterdemos","-i","-o","out/inc"])
+        assert os.path.isfile("out/inc.dactyl_manifest.json")
+        mtime = os.path.getmtime("out/inc/callouts.html")
+        os.remove("out/inc/badges.html")
+        subprocess.check_call(["dactyl_build","-t","filterdemos","-i","-o","out/inc"])
+        assert os.path.isfile("out/inc/badges.html")
+        assert os.path.getmtime("out/inc/callouts.html") == mtime
+
+    def test_html_cache_matches_uncached(self):
+        subprocess.check_call(["dactyl_build","-t","filterdemos","-o","out/uncached"])
+        for i in range(2):
+            subprocess.check_call(["dactyl_build","-t","filterdemos","--html_cache","-o","out/cached"])
+            for fname in os.listdir("out/uncached"):
+                if fname.endswith(".html"):
+                    assert Path("out/uncached", fname).read_text() == Path("out/cached", fname).read_text()
+
+    def test_unchanged_output_not_rewritten(self):
+        subprocess.check_call(["dactyl_build","-t","filterdemos","-o","out/same"])
+        mtime = os.path.getmtime("out/same/callouts.html")
+        Path("out/same/removed-page.html").write_text("old")
+        subprocess.check_call(["dactyl_build","-t","filterdemos","-o","out/same"])
+        assert os.path.getmtime("out/same/callouts.html") == mtime
+        assert os.path.isfile("out/same/removed-page.html")
+        subprocess.check_call(["dactyl_build","-t","filterdemos","-o","out/same","--delete_stale"])
+        assert not os.path.isfile("out/same/removed-page.html")
+        assert os.path.isfile("out/same/callouts.html")
+
+    def test_staged_output_keeps_previous(self):
+        subprocess.check_call(["dactyl_build","-t","filterdemos","--staged","-o","out/staged"])
+        Path("out/staged/removed-page.html").write_text("old")
+        subprocess.check_call(["dactyl_build","-t","filterdemos","--staged","-o","out/staged"])
+        assert not os.path.exists("out/staged.dactyl_staging")
+        assert os.path.isfile("out/staged.dactyl_previous/removed-page.html")
+        assert os.path.isfile("out/staged/callouts.html")
+        subprocess.check_call(["dactyl_build","-o","out/staged","--rollback"])
+        assert os.path.isfile("out/staged/removed-page.html")
+
+    def test_staged_output_recovers_interrupted_swap(self):
+        subprocess.check_call(["dactyl_build","-t","filterdemos","--staged","-o","out/staged"])
+        # The state between the two renames when an atomic exchange isn't available
+        os.rename("out/staged", "out/staged.dactyl_previous")
+        Path("out/staged.dactyl_previous/removed-page.html").write_text("old")
+        subprocess.check_call(["dactyl_build","-t","filterdemos","--staged","-o","out/staged"])
+        assert os.path.isfile("out/staged/callouts.html")
+        assert os.path.isfile("out/staged.dactyl_previous/removed-page.html")
+
     def test_dactyl_link_checker(self):
         # Build some docs to link-check
         subprocess.check_call(["dactyl_build","-t","filterdemos"])
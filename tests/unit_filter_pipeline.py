@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import glob
+import importlib
+import logging
+import os
+import types
+import unittest
+
+from bs4 import BeautifulSoup
+from markdown import markdown
+
+from unit_shared import *
+
+from dactyl.common import html_text, soup_form
+from dactyl.filter_pipeline import FilterPipeline, walk_soup
+from dactyl.page import DactylPage
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+CONTENT_PATH = os.path.join(TESTS_PATH, "..", "examples", "content")
+EXTENSIONS = ["markdown.extensions.extra", "markdown.extensions.sane_lists",
+              "codehilite"]
+
+SAMPLE_HTML = """<h1 class='title' ID="old">Q &amp; A: <code>x.y</code></h1>
+<!-- <h2>Commented out</h2> -->
+<p><img src="a.png"></p>
+<div><p>Nested paragraph</p></div>
+
+
+<p>Sibling paragraph</p>
+<h2 data-id="x">Q &amp; A: <code>x.y</code></h2>
+<pre><code>keep   this
+    whitespace
+</code></pre>
+<script>var h = "<h3>not a header</h3>";</script>
+<h3 title="a > b">Third  <em>level</em></h3>
+"""
+
+SAMPLE_MD = """# Sample_Header {: #sample_header }
+
+**Note:** [a badge: ok](https://old.example.com "BADGE_GREEN") and
+[Next >](https://old.example.com/next).
+
+> **Tip:** [More >](more.html)
+"""
+
+def make_filter(name, **attrs):
+    module = types.ModuleType("filter_"+name)
+    for key, val in attrs.items():
+        setattr(module, key, val)
+    return (name, module)
+
+class TestFilterPipeline(unittest.TestCase):
+    def test_hooks_and_modes(self):
+        def up(html, **kwargs):
+            return html.upper()
+        def nothing(soup, **kwargs):
+            pass
+        pipeline = FilterPipeline([
+            make_filter("a", filter_html=up, export={"x": 1}),
+            make_filter("b", filter_soup=nothing, export={"y": 2},
+                        modes={"filter_soup": ["html"]}),
+        ])
+        assert pipeline.names == ["a", "b"]
+        assert pipeline.exports == {"x": 1, "y": 2}
+        assert pipeline.stage("filter_html", "pdf") == [("a", up)]
+        assert pipeline.stage("filter_soup", "html") == [("b", nothing)]
+        assert pipeline.stage("filter_soup", "pdf") == []
+        assert pipeline.stage("filter_markdown", "html") == []
+
+    def test_soup_steps(self):
+        def visitors(soup, **kwargs):
+            return {}
+        def old_style(soup, **kwargs):
+            pass
+        pipeline = FilterPipeline([
+            make_filter("a", soup_visitors=visitors, filter_soup=old_style),
+            make_filter("b", soup_visitors=visitors),
+            make_filter("c", filter_soup=old_style),
+            make_filter("d", soup_visitors=visitors,
+                        modes={"soup_visitors": ["pdf"]}),
+        ])
+        assert pipeline.soup_steps("html") == [
+            ("soup_visitors", [("a", visitors), ("b", visitors)]),
+            ("filter_soup", [("c", old_style)]),
+        ]
+        assert pipeline.soup_steps("pdf")[-1] == ("soup_visitors",
+                                                  [("d", visitors)])
+
+    def test_walk_soup(self):
+        soup = BeautifulSoup('<p><a href="x">1</a><a>2</a></p>'
+                             '<div href="y"><a href="z">3</a></div>',
+                             "html.parser")
+        calls = []
+        errors = []
+        def remove(el):
+            calls.append(("remove", el.name))
+            el.extract()
+        def log(el):
+            calls.append(("log", el.name, el.get_text()))
+        def fail(el):
+            raise ValueError("no")
+        walk_soup(soup, [
+            ("first", {"a": log}),
+            ("second", {"[href]": remove}),
+            ("third", {"a": log, "div": log}),
+            ("fourth", {"p": fail, "a": log}),
+        ], on_error=lambda name, e: errors.append(name))
+        # Removing the div skips it and its contents for later filters, and
+        # a filter that fails isn't called again
+        assert calls == [
+            ("log", "a", "1"), ("remove", "a"),
+            ("log", "a", "2"), ("log", "a", "2"),
+            ("remove", "div"),
+        ]
+        assert errors == ["fourth"]
+
+    def test_builtin_visitors_in_one_walk(self):
+        html = markdown(SAMPLE_MD, extensions=EXTENSIONS)
+        context = {"currentpage": {"link_subs": {"https://old": "https://new"}},
+                   "target": {"name": "t"}, "config": {"pages": []},
+                   "logger": logging.getLogger(__name__)}
+        names = ["callouts", "badges", "buttonize", "external_links",
+                 "link_replacement", "standardize_header_ids"]
+        modules = [(name, importlib.import_module("dactyl.filter_"+name))
+                   for name in names]
+
+        expected = BeautifulSoup(html, "html.parser")
+        for name, module in modules:
+            module.filter_soup(expected, **context)
+
+        soup = BeautifulSoup(html, "html.parser")
+        [(hook, step_filters)] = FilterPipeline(modules).soup_steps("html")
+        walk_soup(soup, [(name, soup_visitors(soup, **context))
+                         for name, soup_visitors in step_filters])
+        assert str(soup) == str(expected)
+
+    def check_same_results(self, html, **fields):
+        soup_page = DactylPage(mockconfig, {"name": "Soup", **fields})
+        soup_page.soup = BeautifulSoup(html, "html.parser")
+        soup_page.update_toc()
+        soup_page.provide_blurb()
+        soup_html = str(soup_page.soup)
+
+        page = DactylPage(mockconfig, {"name": "String", **fields})
+        string_html = page.update_toc_html(html)
+        page.provide_blurb(string_html)
+
+        assert page.toc == soup_page.toc
+        assert page.data["headermap"] == soup_page.data["headermap"]
+        assert page.data["blurb"] == soup_page.data["blurb"]
+        assert html_text(string_html) == soup_page.soup.get_text()
+        assert str(BeautifulSoup(string_html, "html.parser")) == soup_html
+
+        # HTML that's written the way the soup writes it stays that way, so
+        # pages with and without soup filters come out the same
+        html = soup_form(html)
+        if html is not None:
+            page = DactylPage(mockconfig, {"name": "String", **fields})
+            assert page.update_toc_html(html) == soup_html
+
+    def test_no_dom_path(self):
+        self.check_same_results(SAMPLE_HTML)
+        self.check_same_results(SAMPLE_HTML,
+                hover_anchors='<i class="fa fa-link"></i>&para;')
+        self.check_same_results("")
+        self.check_same_results("<p> </p><p>Only paragraph</p>")
+
+    def test_soup_form(self):
+        for html in ['<p class="a b" id="x">It&#39;s &quot;A&quot; &amp; B &gt; C</p>',
+                     '<div>\n\n<hr />\n\n</div>\n<pre>\n\n</pre><br>',
+                     '<h2 id="x" title="&lt;b&gt;">&copy;&nbsp;&#x27;&#160;</h2>']:
+            assert soup_form(html) == str(BeautifulSoup(html, "html.parser"))
+        # Markup that the soup might write differently
+        for html in ["<!-- comment -->", "<p>x", "<p>&#1;</p>", "<p>&copy</p>",
+                     '<p title="&quot;">x</p>', '<p class=" a">x</p>',
+                     "<P>x</P>", "<b><i>x</b></i>", "<p>a < b</p>"]:
+            assert soup_form(html) is None
+
+    def test_no_dom_path_same_bytes(self):
+        md = '# It\'s\n\nQ &amp; A\n\n<div class="x">\n\n</div>\n\n## Two\n'
+        results = []
+        for soup_steps in ([], [("soup_visitors", [])]):
+            page = DactylPage(mockconfig, {"name": "Test page",
+                    "hover_anchors": "<i class='fa fa-link' title=\"it's\"></i>",
+                    "__md_generator": lambda: md})
+            # Pages with the same filters share the pipeline, so put it back
+            pipeline = page.filter_pipeline()
+            pipeline.soup_steps = lambda mode, tree_filters: soup_steps
+            try:
+                results.append(page.html_content({"currentpage": page.data,
+                                                  "mode": "html"}))
+            finally:
+                del pipeline.soup_steps
+            assert (page.soup is None) == (not soup_steps)
+        assert results[0] == results[1]
+
+    def test_no_dom_path_example_content(self):
+        paths = glob.glob(os.path.join(CONTENT_PATH, "**", "*.md"), recursive=True)
+        for path in sorted(paths):
+            with open(path, encoding="utf-8") as f:
+                html = markdown(f.read(), extensions=EXTENSIONS)
+            with self.subTest(page=path):
+                self.check_same_results(html, hover_anchors="&para;")
+
+if __name__ == '__main__':
+    unittest.main()
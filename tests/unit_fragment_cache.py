@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import tempfile
+import unittest
+
+import jinja2
+
+from unit_shared import *
+
+from dactyl.disk_cache import DiskCache
+from dactyl.fragment_cache import FragmentCache, FragmentCacheExtension
+from dactyl.page import DactylPage
+
+TEMPLATE = "{% cache 'menu', page %}{{ page }}: {{ counter() }}{% endcache %}"
+
+def make_template(fragment_cache, source=TEMPLATE, name=None):
+    """Make a template from source, named name if it isn't None"""
+    env = jinja2.Environment(extensions=[FragmentCacheExtension],
+                             loader=jinja2.DictLoader({}))
+    env.fragment_cache = fragment_cache
+    count = []
+    def counter():
+        count.append(1)
+        return len(count)
+    if name:
+        env.loader.mapping[name] = source
+        return env.get_template(name, globals={"counter": counter})
+    return env.from_string(source, globals={"counter": counter})
+
+class TestFragmentCache(unittest.TestCase):
+    def test_cache_tag(self):
+        cache = FragmentCache()
+        template = make_template(cache)
+        rendered = [template.render(page=page) for page in ("a", "a", "b", "a")]
+        assert rendered == ["a: 1", "a: 1", "b: 2", "a: 1"]
+        assert (cache.hits.value, cache.misses.value) == (2, 2)
+
+        # A new build renders the fragments again
+        cache.forget()
+        assert template.render(page="a") == "a: 3"
+
+    def test_uncacheable(self):
+        # Without a cache, or with a value that can't be hashed, the tag
+        # renders its contents every time
+        template = make_template(None)
+        assert [template.render(page="a") for i in range(2)] == ["a: 1", "a: 2"]
+        cyclic = []
+        cyclic.append(cyclic)
+        template = make_template(FragmentCache())
+        assert template.render(page=cyclic) == "[[...]]: 1"
+        assert template.render(page=cyclic) == "[[...]]: 2"
+
+    def test_saved_fragments(self):
+        with tempfile.TemporaryDirectory() as path:
+            version = ["1"]
+            def make_cache():
+                return FragmentCache(DiskCache("test", path, 1024*1024),
+                                     version=lambda: version[0])
+            assert make_template(make_cache()).render(page="a") == "a: 1"
+            cache = make_cache()
+            assert make_template(cache).render(page="a") == "a: 1"
+            assert cache.hits.value == 1
+            # Saved fragments aren't used after the settings change
+            version[0] = "2"
+            cache = make_cache()
+            make_template(cache).render(page="a")
+            assert (cache.hits.value, cache.misses.value) == (0, 1)
+
+    def test_changed_template(self):
+        with tempfile.TemporaryDirectory() as path:
+            make_cache = lambda: FragmentCache(DiskCache("test", path,
+                                                         1024*1024))
+            assert make_template(make_cache()).render(page="a") == "a: 1"
+            # Saved fragments aren't used after the block changes, or in
+            # another template
+            edited = TEMPLATE.replace(": ", " - ")
+            assert make_template(make_cache(), edited).render(page="a") == \
+                    "a - 1"
+            assert make_template(make_cache(), name="other.html").render(
+                    page="a") == "a: 1"
+            cache = make_cache()
+            make_template(cache, name="other.html").render(page="a")
+            assert cache.hits.value == 1
+
+    def test_preprocessor(self):
+        page = DactylPage(mockconfig, {"name": "Testpage"})
+        env = page.get_pp_env(loader=None, cache_templates=False)
+        template = env.from_string(
+                "{% cache 'title' %}{{ currentpage.name }}{% endcache %}")
+        assert template.render(currentpage={"name": "One"}) == "One"
+        assert template.render(currentpage={"name": "Two"}) == "One"
+        mockconfig.fragment_cache.forget()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import tempfile
+import unittest
+
+from markdown import markdown
+
+from unit_shared import *
+
+from dactyl.disk_cache import DiskCache
+from dactyl.highlight_cache import HighlightCacheExtension
+
+EXTENSIONS = ["markdown.extensions.extra", "markdown.extensions.sane_lists",
+              "codehilite"]
+
+SAMPLE_MD = """# Code Samples
+
+```python
+def hello():
+    print("hello")
+```
+
+Some text with `inline code`.
+
+    indented = True
+    print(indented)
+
+``` { .js hl_lines="2" }
+let x = 1;
+let y = 2;
+```
+
+~~~
+no language given
+~~~
+
+```python
+def hello():
+    print("hello")
+```
+
+``` { .js } }
+not a valid fenced block
+```
+"""
+
+class TestHighlightCache(unittest.TestCase):
+    def test_same_html(self):
+        expected = markdown(SAMPLE_MD, extensions=EXTENSIONS)
+        with tempfile.TemporaryDirectory() as cache_path:
+            cache = DiskCache("test", cache_path, 1024 * 1024)
+            extensions = EXTENSIONS + [HighlightCacheExtension(cache=cache)]
+            first = markdown(SAMPLE_MD, extensions=extensions)
+            assert first == expected
+            # The repeated block is a hit. The invalid one is always a miss.
+            assert cache.hits.value == 1
+            assert cache.misses.value == 5
+            second = markdown(SAMPLE_MD, extensions=extensions)
+            assert second == expected
+            assert cache.hits.value == 1 + 5
+            assert cache.misses.value == 5 + 1
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import glob
+import importlib
+import logging
+import os
+import re
+import unittest
+
+from markdown import markdown
+
+from unit_shared import *
+
+from dactyl.common import HTML_PARSERS, html_soup
+from dactyl.filter_pipeline import FilterPipeline, walk_soup
+from dactyl.page import DactylPage
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+CONTENT_PATH = os.path.join(TESTS_PATH, "..", "examples", "content")
+EXTENSIONS = ["markdown.extensions.extra", "markdown.extensions.sane_lists",
+              "codehilite"]
+FILTERS = ["callouts", "badges", "buttonize", "external_links",
+           "standardize_header_ids", "multicode_tabs"]
+
+def installed(parser):
+    if parser == "html.parser":
+        return True
+    try:
+        importlib.import_module(parser)
+        return True
+    except ImportError:
+        return False
+
+def squash_whitespace(text):
+    # html5lib keeps blank lines between elements that html.parser and lxml
+    # turn into one newline, which doesn't change how the page looks
+    return re.sub(r"\s+", " ", text)
+
+class TestHTMLParsers(unittest.TestCase):
+    def filtered_page(self, html, parser):
+        mockconfig["html_parser"] = parser
+        page = DactylPage(mockconfig, {"name": "Test page",
+                                       "hover_anchors": "&para;"})
+        soup = html_soup(html, parser)
+        page.soup = soup
+        page.update_toc()
+        page.provide_blurb()
+        context = {"currentpage": page.data, "target": {"name": "t"},
+                   "config": {"pages": []}, "mode": "html",
+                   "logger": logging.getLogger(__name__)}
+        modules = [(name, importlib.import_module("dactyl.filter_"+name))
+                   for name in FILTERS]
+        [(hook, step_filters)] = FilterPipeline(modules).soup_steps("html")
+        walk_soup(soup, [(name, soup_visitors(soup, **context))
+                         for name, soup_visitors in step_filters])
+        return page, soup
+
+    def test_fragment(self):
+        html = "\n<!-- comment -->\n<p>One</p>\ntext <b>two</b>\n"
+        for parser in HTML_PARSERS:
+            if not installed(parser):
+                continue
+            with self.subTest(parser=parser):
+                assert str(html_soup(html, parser)) == html
+                assert str(html_soup("", parser)) == ""
+
+    def test_example_content(self):
+        paths = glob.glob(os.path.join(CONTENT_PATH, "**", "*.md"), recursive=True)
+        parsers = [p for p in HTML_PARSERS if installed(p) and p != "html.parser"]
+        if not parsers:
+            self.skipTest("Neither lxml nor html5lib is installed")
+        try:
+            for path in sorted(paths):
+                with open(path, encoding="utf-8") as f:
+                    html = markdown(f.read(), extensions=EXTENSIONS)
+                expected_page, expected = self.filtered_page(html, "html.parser")
+                for parser in parsers:
+                    with self.subTest(page=path, parser=parser):
+                        page, soup = self.filtered_page(html, parser)
+                        assert squash_whitespace(str(soup)) == \
+                               squash_whitespace(str(expected))
+                        assert squash_whitespace(soup.get_text()) == \
+                               squash_whitespace(expected.get_text())
+                        assert page.toc == expected_page.toc
+                        assert page.data["blurb"] == expected_page.data["blurb"]
+        finally:
+            mockconfig["html_parser"] = "html.parser"
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Conformance tests for the markdown-it engine: it should make the same HTML
+# as Python-Markdown for everything Dactyl uses, apart from whitespace and
+# the few places where Python-Markdown doesn't follow CommonMark.
+
+import difflib
+import glob
+import os
+import re
+import unittest
+
+from bs4 import BeautifulSoup, Comment, NavigableString
+from markdown import markdown
+
+from unit_shared import *
+
+try:
+    from dactyl.markdown_it_converter import MarkdownItConverter
+except ImportError:
+    MarkdownItConverter = None
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+CONTENT_PATH = os.path.join(TESTS_PATH, "..", "examples", "content")
+EXTENSIONS = ["markdown.extensions.extra", "markdown.extensions.sane_lists"]
+# Some of the pages' frontmatter is invalid on purpose, so don't parse it
+FRONTMATTER = re.compile(r"\A---\n.*?\n---\n", re.S)
+
+# Example pages that show where Python-Markdown doesn't follow CommonMark
+KNOWN_DIFFERENCES = {
+    # Code fences inside blockquotes work in markdown-it
+    "filters/callouts.md",
+    # List numbering, indented code fences, and loose vs. tight list items
+    "lists-and-codeblocks.md",
+}
+
+FEATURES_MD = """# Features {: #custom-id .big }
+
+## Closed header ## {: .small}
+
+A paragraph with a footnote[^note], another[^2], and the first again[^note].
+{: .intro data-x="1" }
+
+| Left | Center | Right |
+|:-----|:------:|------:|
+| a    | b      | c     |
+| `code` | **bold** | [link](x.html) |
+
+```python
+print("hi")
+```
+
+``` { .js .extra hl_lines="2" }
+let x = 1;
+let y = 2;
+```
+
+```js hl_lines="1"
+let a;
+```
+
+    indented_code = True
+
+Term
+:   Definition of the term.
+
+<div class="callout" markdown="1">
+**Bold** inside a div.
+
+* list in div
+</div>
+
+<div class="outer" markdown="1">
+<div class="inner">
+Raw inner html.
+</div>
+
+Outer *markdown*.
+</div>
+
+A [cross-reference](XREF: page.html), `[not](a link)`, and
+[a link with a title](x.html "Title here").
+
+[^note]: The note.
+[^2]: Second note
+    continued.
+"""
+
+def normalize(html):
+    """
+    Return a list of lines describing the elements, attributes, and text in
+    some HTML, ignoring differences in whitespace and formatting.
+    """
+    lines = []
+    def walk(node, depth):
+        for child in node.children:
+            if isinstance(child, Comment):
+                continue
+            if isinstance(child, NavigableString):
+                text = " ".join(str(child).split())
+                if text:
+                    lines.append("  "*depth + repr(text))
+                continue
+            attrs = sorted((k, " ".join(v) if isinstance(v, list) else v)
+                           for k, v in child.attrs.items())
+            lines.append("  "*depth + "<%s %s>" % (child.name, attrs))
+            walk(child, depth+1)
+    walk(BeautifulSoup(html, "html.parser"), 0)
+    return lines
+
+def differences(text, highlight=True):
+    extensions = EXTENSIONS + (["codehilite"] if highlight else [])
+    expected = normalize(markdown(text, extensions=extensions))
+    actual = normalize(MarkdownItConverter(highlight=highlight).convert(text))
+    return "\n".join(difflib.unified_diff(expected, actual, lineterm=""))
+
+@unittest.skipIf(MarkdownItConverter is None, "markdown-it-py isn't installed")
+class TestMarkdownEngines(unittest.TestCase):
+    def test_features(self):
+        self.assertEqual(differences(FEATURES_MD), "")
+
+    def test_features_no_highlighting(self):
+        self.assertEqual(differences(FEATURES_MD, highlight=False), "")
+
+    def test_example_content(self):
+        paths = glob.glob(os.path.join(CONTENT_PATH, "**", "*.md"), recursive=True)
+        paths.append(os.path.join(TESTS_PATH, "gfm-compat.md"))
+        for path in sorted(paths):
+            name = os.path.relpath(path, CONTENT_PATH).replace(os.sep, "/")
+            if name in KNOWN_DIFFERENCES:
+                continue
+            with open(path, encoding="utf-8") as f:
+                text = FRONTMATTER.sub("", f.read())
+            with self.subTest(page=name):
+                self.assertEqual(differences(text), "")
+
+if __name__ == '__main__':
+    unittest.main()
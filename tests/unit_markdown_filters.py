@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import glob
+import importlib
+import os
+import types
+import unittest
+from xml.etree.ElementTree import SubElement
+
+from markdown import Markdown
+
+from unit_shared import *
+
+from dactyl.common import html_soup, parse_frontmatter
+from dactyl.filter_pipeline import FilterPipeline
+from dactyl.markdown_filters import walk_tree
+from dactyl.page import DactylPage
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+FILTERS_PATH = os.path.join(TESTS_PATH, "..", "examples", "content", "filters")
+FILTERS = ["callouts", "badges", "buttonize", "external_links",
+           "multicode_tabs"]
+
+def make_filter(name, **attrs):
+    module = types.ModuleType("filter_"+name)
+    for key, val in attrs.items():
+        setattr(module, key, val)
+    return (name, module)
+
+class TestMarkdownFilters(unittest.TestCase):
+    def setUp(self):
+        self.old_filters = mockconfig.filters
+        mockconfig.filters = {name: importlib.import_module("dactyl.filter_"+name)
+                              for name in FILTERS}
+
+    def tearDown(self):
+        mockconfig.filters = self.old_filters
+        mockconfig["markdown_filters"] = []
+
+    def build(self, path, filters, markdown_filters, mode="html"):
+        mockconfig["markdown_filters"] = markdown_filters
+        with open(path, encoding="utf-8") as f:
+            text, metadata = parse_frontmatter(f.read())
+        page = DactylPage(mockconfig, {"name": "Test page", "md": path,
+                                       "filters": filters,
+                                       "hover_anchors": "&para;"})
+        page.rawtext = text
+        page.pp_template_name = None
+        context = {"currentpage": page.data, "config": mockconfig,
+                   "target": {"name": "t", "filters": []}, "mode": mode,
+                   "pages": [], "categories": []}
+        return page, page.html_content(context, save=False)
+
+    def test_markdown_stage(self):
+        def visitors(root, md, **kwargs):
+            return {}
+        def nothing(html, **kwargs):
+            return html
+        pipeline = FilterPipeline([
+            make_filter("a", markdown_visitors=visitors),
+            make_filter("b", markdown_visitors=visitors),
+            make_filter("c", filter_html=nothing),
+            make_filter("d", markdown_visitors=visitors),
+        ])
+        # Only the filters before c can run first, while converting Markdown
+        assert pipeline.markdown_stage("html", ["a", "b", "d"]) == [
+            ("a", visitors), ("b", visitors)]
+        assert pipeline.markdown_stage("html", ["b"]) == [("b", visitors)]
+        assert pipeline.markdown_stage("html", []) == []
+
+    def test_walk_tree(self):
+        root = Markdown().parser.parseDocument(["p1", "", "p2"]).getroot()
+        calls = []
+        def add(el):
+            calls.append(("add", el.text))
+            SubElement(el, "p").text = "new"
+        def log(el):
+            calls.append(("log", el.text))
+        walk_tree(root, [("first", {"p": add}), ("second", {"p": log})])
+        # Elements added during the walk aren't visited
+        assert calls == [("add", "p1"), ("log", "p1"),
+                         ("add", "p2"), ("log", "p2")]
+
+    def test_same_results(self):
+        paths = sorted(glob.glob(os.path.join(FILTERS_PATH, "*.md")))
+        for path in paths:
+            for mode in ("html", "es"):
+                for filters in [[name] for name in FILTERS] + [FILTERS]:
+                    with self.subTest(page=path, mode=mode, filters=filters):
+                        expected_page, expected = self.build(path, filters,
+                                                             [], mode)
+                        page, html = self.build(path, filters, filters, mode)
+                        assert str(html_soup(html)) == str(html_soup(expected))
+                        assert page.toc == expected_page.toc
+
+    def test_no_soup(self):
+        path = os.path.join(FILTERS_PATH, "callouts.md")
+        page, html = self.build(path, FILTERS, FILTERS)
+        assert page.soup is None
+        assert 'class="dactyl-callout note"' in html
+        page, html = self.build(path, FILTERS, [])
+        assert page.soup is not None
+
+if __name__ == '__main__':
+    unittest.main()
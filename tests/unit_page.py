@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 import unittest
 import os
+import tempfile
+import types
 
 from unit_shared import *
 
+from dactyl.disk_cache import DiskCache
 from dactyl.page import DactylPage
+from dactyl.common import guess_title, html_soup
 
 
 class TestDactylPage(unittest.TestCase):
@@ -26,6 +30,90 @@ class TestDactylPage(unittest.TestCase):
         print(page.md)
         assert page.md == "This page is Testpage."
 
+    def test_release(self):
+        page = DactylPage(mockconfig, {"name": "Testpage"})
+        page.html = "<p>Test</p>"
+        page.data["plaintext"] = "Test"
+        page.release()
+        assert page.html is None
+        # Other pages' templates may still use the plaintext
+        assert page.data["plaintext"] == "Test"
+
+    def test_reload_missing_file(self):
+        from dactyl.watch_handler import UpdaterHandler
+        handler = UpdaterHandler.__new__(UpdaterHandler)
+        handler.builder = types.SimpleNamespace(target=mocktarget)
+        with tempfile.TemporaryDirectory() as path:
+            md_path = os.path.join(path, "page.md")
+            with open(md_path, "w") as f:
+                f.write("---\nhtml: one.html\n---\n# One\n")
+            page = DactylPage(mockconfig, {"md": md_path})
+            data = page.data
+            assert page.data["html"] == "one.html"
+
+            # Editors and git can remove a file briefly while replacing it
+            os.remove(md_path)
+            with self.assertLogs("dactyl.common", level="WARNING"):
+                assert handler.reload_pages([page]) == []
+            assert page.data is data
+            assert page.data["html"] == "one.html"
+
+            with open(md_path, "w") as f:
+                f.write("---\nhtml: two.html\n---\n# Two\n")
+            assert handler.reload_pages([page]) == [page]
+            assert page.data is data
+            assert page.data["html"] == "two.html"
+
+    def test_html_cache_key(self):
+        def cache_key(**settings):
+            config = MockDactylConfig(MockCliArgs)
+            config.config.update(settings)
+            config.html_cache = DiskCache("html", tempfile.gettempdir(), 0)
+            page = DactylPage(config, {"name": "Testpage"})
+            return page.html_cache_key("Test", [], {"mode": "html"})
+        key = cache_key()
+        assert key == cache_key(html_cache=True, html_cache_size=1,
+                                fragment_cache=True, template_cache=False)
+        assert key != cache_key(html_parser="html5lib")
+        assert key != cache_key(callout_class="note")
+
+    def test_pp_template_compiled_when_used(self):
+        page = DactylPage(mockconfig, {"name": "Testpage",
+            "__md_generator": lambda: "This page is {{currentpage.name}}."})
+        assert page.pp_template is None
+        assert page.md_content({"currentpage":page.data}) == "This page is Testpage."
+        assert page.pp_template is not None
+
+    def test_guess_title(self):
+        assert guess_title(["# Configuring *Widgets* and `gadgets`"]) == "Configuring Widgets and gadgets"
+        assert guess_title(["Installation Guide", "======"]) == "Installation Guide"
+        assert guess_title(["<h2 id='x'>Q &amp; A</h2>", ""]) == "Q & A"
+        assert guess_title(["Some text", "# Header"]) == "Header"
+        assert guess_title(["Some text", "More text"]) is None
+        # Needs the full Markdown converter
+        assert guess_title(["> # Quoted header", ""]) is False
+        # Emphasis markers that are next to each other or don't match up
+        assert guess_title(["### *em**em*"]) is False
+        assert guess_title(["### **_a**b_"]) is False
+        assert guess_title(["### *a* and __b__"]) == "a and b"
+
+    def test_toc(self):
+        page = DactylPage(mockconfig, {"name": "Testpage",
+                                       "hover_anchors": "<i>#</i>&para;"})
+        page.soup = html_soup("<h1>Q &amp; A</h1><h2>Q &lt; A.</h2>"
+                              "<h4>Deep</h4><h2>Q &amp; A</h2>")
+        page.update_toc()
+        assert [h["id"] for h in page.toc] == ["q-a", "q-a-1", "deep", "q-a-2"]
+        assert page.data["headermap"]["Q < A-#\u00b6"] == "#q-a-1"
+        # Each header gets its own copy of the hover anchor's contents
+        assert str(page.soup.h4) == '<h4 id="deep">Deep<a aria-hidden="true" ' \
+                'class="hover_anchor" href="#deep"><i>#</i>\u00b6</a></h4>'
+        assert len(page.soup.find_all("i")) == 4
+        assert page.legacy_toc() == (
+            '<li class="level-1"><a href="#q-a">Q &amp; A</a></li>\n'
+            '<li class="level-2"><a href="#q-a-1">Q &lt; A.</a></li>\n'
+            '<li class="level-2"><a href="#q-a-2">Q &amp; A</a></li>\n')
+
     def test_get_filters_for_page(self):
         # Please note: due to the mock setup for unit testing, this function will always return an empty set.  Refactoring is recommended to verify the remaining functionality for this method.
         page = DactylPage(mockconfig, {})
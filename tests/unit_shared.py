@@ -3,6 +3,7 @@
 class MockCliArgs:
     version=None
     bypass_errors=False
+    html_parser=None
     config="test-config.yml"
     debug=False
     quiet=False
@@ -4,6 +4,8 @@ import os
 
 from unit_shared import *
 
+from dactyl.common import track_pages
+from dactyl.page import DactylPage
 from dactyl.target import DactylTarget
 
 
@@ -14,6 +16,50 @@ class TestDactylPage(unittest.TestCase):
         t.load_pages()
 
 
+    def test_find_hierarchy(self):
+        t = DactylTarget.__new__(DactylTarget)
+        t.pages = [DactylPage(mockconfig, data) for data in [
+            {"name": "Top", "html": "top.html"},
+            {"name": "Mid", "html": "mid.html", "parent": "top.html"},
+            {"name": "Leaf", "html": "leaf.html", "parent": "mid.html"},
+            {"name": "Other", "html": "other.html", "parent": "missing.html"},
+        ]]
+        top, mid, leaf, other = [p.data for p in t.pages]
+        t.find_hierarchy()
+        t.find_hierarchy()
+        assert top["children"] == [mid]
+        assert mid["children"] == [leaf]
+        assert top["is_ancestor_of"]("leaf.html")
+        assert mid["is_ancestor_of"]("leaf.html")
+        assert not mid["is_ancestor_of"]("top.html")
+        assert not leaf["is_ancestor_of"]("leaf.html")
+        assert not other["is_ancestor_of"]("top.html")
+
+    def test_page_indexes(self):
+        t = DactylTarget.__new__(DactylTarget)
+        t.pages = [DactylPage(mockconfig, data) for data in [
+            {"name": "Top", "html": "top.html", "md": "filters/badges.md"},
+            {"name": "A", "html": "a.html", "parent": "top.html",
+             "category": "Letters"},
+            {"name": "B", "html": "b.html", "parent": "top.html",
+             "category": "Letters", "md": "filters/badges.md"},
+            {"name": "A again", "html": "a.html"},
+        ]]
+        top, a, b, a_again = [p.data for p in t.pages]
+        indexes = t.page_indexes()
+        assert indexes["pages_by_html"] == {"top.html": top, "a.html": a,
+                                            "b.html": b}
+        assert indexes["pages_by_html"]["a.html"] is a
+        assert indexes["pages_by_md"]["filters/badges.md"] is top
+        assert indexes["pages_by_category"] == {"Letters": [a, b]}
+        assert indexes["pages_by_parent"] == {"top.html": [a, b]}
+
+        # Reading the indexes counts as reading the list of pages
+        context = track_pages({"pages": [top, a, b], **indexes})
+        assert not context["pages"].accessed
+        assert context["pages_by_html"]["b.html"] is b
+        assert context["pages"].accessed
+
 
 if __name__ == '__main__':
     unittest.main()
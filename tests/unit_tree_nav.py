@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import jinja2
+
+from unit_shared import *
+
+from dactyl.page import DactylPage
+from dactyl.target import DactylTarget
+from dactyl.tree_nav import TreeNav
+
+# tree-nav.html as it was before TreeNav, which walked the whole tree for
+# every page
+LEGACY_TREE_NAV = """\
+{% if tree_top is undefined %}
+  {% set tree_top = pages|list|first %}
+{% endif %}
+
+{% macro page_w_children(pg, n) %}
+  {% if pg.is_ancestor_of(currentpage.html) %}
+    {% set active_parent=True %}
+  {% else %}
+    {% set active_parent=False %}
+  {% endif %}
+
+  <div class="nav-item {% if currentpage == pg %}active{% elif active_parent%}active-parent{% endif %}">
+    {% if not pg.children %}
+    <a class="nav-link nav-leaf" href="{% if "//" not in pg.html %}{{currentpage.prefix}}{% endif %}{{pg.html}}">{{ pg.name }}</a>
+    {% else %}
+
+
+      <a class="nav-toggler {% if not active_parent and currentpage != pg %}collapsed{% endif %}" role="button" data-toggle="collapse" href="#tree_nav_group_{{n}}" aria-expanded="{% if active_parent or currentpage == pg %}true{% else %}false{% endif %}" aria-controls="tree_nav_group_{{n}}"></a>
+    <a class="nav-link" href="{% if "//" not in pg.html %}{{currentpage.prefix}}{% endif %}{{pg.html}}">{{ pg.name }}</a>
+
+    <nav class="nav flex-column {% if active_parent or pg == currentpage %}show {% else %}collapse{% endif %}" id="tree_nav_group_{{n}}">
+    {% for child in pg.children %}
+      {{ page_w_children(child, n~"_"~loop.index) }}
+    {% endfor %}
+    </nav>
+
+    {% endif %}
+  </div>
+{% endmacro %}
+
+<nav class="nav flex-column dactyl-tree-nav">
+  <div class="nav-item nav-parent">
+    <a class="nav-link" href="{% if "//" not in tree_top.html %}{{currentpage.prefix}}{% endif %}{{tree_top.html}}">{{tree_top.name}}</a>
+  </div>
+  {% for child in tree_top.children %}
+    {{ page_w_children(child, loop.index) }}
+  {% endfor %}
+</nav>"""
+
+def make_env():
+    env = jinja2.Environment(undefined=jinja2.ChainableUndefined,
+                             loader=jinja2.PackageLoader("dactyl"),
+                             trim_blocks=True, lstrip_blocks=True)
+    env.globals["tree_nav"] = TreeNav()
+    return env
+
+def make_pages(page_defs):
+    target = DactylTarget.__new__(DactylTarget)
+    target.pages = [DactylPage(mockconfig, data) for data in page_defs]
+    target.find_hierarchy()
+    return [p.data for p in target.pages]
+
+class TestTreeNav(unittest.TestCase):
+    def test_same_as_legacy(self):
+        pages = make_pages([
+            {"name": "Top", "html": "index.html"},
+            {"name": "A", "html": "a.html", "parent": "index.html"},
+            {"name": "A1", "html": "a1.html", "parent": "a.html"},
+            {"name": "A1x", "html": "a1x.html", "parent": "a1.html"},
+            {"name": "B", "html": "b.html", "parent": "index.html"},
+            {"name": "B1", "html": "b1.html", "parent": "b.html"},
+            {"name": "External", "html": "https://example.com/",
+             "parent": "b.html"},
+        ])
+        env = make_env()
+        template = env.get_template("tree-nav.html")
+        legacy = env.from_string(LEGACY_TREE_NAV)
+        for tree_top in (pages[0], pages[4]):
+            for currentpage in pages + [{"name": "Other", "html": "x.html"}]:
+                for prefix in ("/", "../"):
+                    context = {"pages": pages, "tree_top": tree_top,
+                               "currentpage": {**currentpage, "prefix": prefix}}
+                    if currentpage in pages:
+                        context["currentpage"] = currentpage
+                        currentpage["prefix"] = prefix
+                    with self.subTest(top=tree_top["html"],
+                                      page=currentpage["html"], prefix=prefix):
+                        assert template.render(context) == legacy.render(context)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from bs4 import BeautifulSoup
+
+from unit_shared import *
+
+from dactyl import filter_xrefs
+
+PAGES = [
+    {"md": "a/intro.md", "html": "a-intro.html", "targets": ["one"]},
+    {"md": "b/intro.md", "html": "b-intro.html", "targets": ["two"]},
+    {"md": "c/intro.md", "html": "", "targets": ["one", "two"]},
+    {"md": "guide.md", "html": "guide.html", "targets": []},
+    {"md": "guide2.md", "html": "guide.html", "targets": ["two"]},
+    {"html": "a/intro.md", "targets": ["one"]},
+    {"md": "x/a/intro.md", "html": "x-intro.html", "targets": ["one"],
+     "name": "X Intro"},
+]
+
+TARGETS = [
+    {"name": "one", "display_name": "Target One"},
+    {"name": "blank"},
+    {"name": "one", "display_name": "Duplicate"},
+]
+
+class TestXrefs(unittest.TestCase):
+    def setUp(self):
+        self.config = {"pages": PAGES, "targets": TARGETS}
+
+    def test_find_file_in_target(self):
+        find = lambda fname, target: filter_xrefs.find_file_in_target(
+                fname, target, self.config)
+        # By filename in any folder, first page in order
+        assert find("intro.md", "one") is PAGES[0]
+        assert find("intro.md", "two") is PAGES[1]
+        # By exact path only if it has a folder
+        assert find("a/intro.md", "one") is PAGES[0]
+        assert find("x/a/intro.md", "one") is PAGES[6]
+        # Falls back to html filenames
+        assert find("a/intro.md", "two") is False
+        assert find("guide.html", "two") is PAGES[4]
+        assert find("guide.md", "two") is False
+        assert find("missing.md", "one") is False
+
+    def test_find_file_in_any_target(self):
+        find = lambda fname: filter_xrefs.find_file_in_any_target(
+                fname, self.config)
+        assert find("intro.md") is PAGES[0]
+        assert find("b/intro.md") is PAGES[1]
+        # Pages with no targets don't count
+        assert find("guide.md") is False
+        assert find("guide.html") is PAGES[4]
+
+    def test_lookup_display_name(self):
+        lookup = lambda name: filter_xrefs.lookup_display_name(name,
+                                                                self.config)
+        assert lookup("one").strip() == "Target One"
+        with self.assertLogs(level="WARNING"):
+            assert lookup("blank") == "blank"
+        with self.assertLogs(level="WARNING"):
+            assert lookup("missing") == "missing"
+
+    def test_filter_soup(self):
+        config = MockDactylConfig(MockCliArgs)
+        config["pages"] = PAGES
+        soup = BeautifulSoup('<a href="xref: x/a/intro.md#top"></a> '
+                '<a href="XREF: b/intro.md">Intro</a>', "html.parser")
+        filter_xrefs.filter_soup(soup, target={"name": "one", "prefix": "/"},
+                                 config=config)
+        assert str(soup) == ('<a href="/x-intro.html#top">X Intro</a> '
+            '<span class="dactyl_xref">"Intro" in the <em>two</em>'
+            '</span>')
+        # Loading the pages again drops the index
+        assert config.xref_index is not None
+        config["pages"] = []
+        config.load_pages()
+        assert config.xref_index is None
+
+if __name__ == '__main__':
+    unittest.main()